@@ -0,0 +1,63 @@
+# Microbenchmark of the Arduino response parsers: the regular expression parser, the fixed-width
+# fast path and the batch decoder (per response).
+#
+# python benchmarks/arduino_messages.py [number of channels]
+import random
+import sys
+import timeit
+
+from pycontrolsystem.Server.Drivers.ArduinoDriver import ArduinoMessages
+
+
+def build_output_message(channel_ids, precisions, values):
+    """ Builds the response the Arduino would send to the query message of these channels """
+    output_message = "o"
+
+    for channel_name, precision, value in zip(channel_ids, precisions, values):
+        mantissa, exponent = "{:.{}e}".format(abs(value), precision).split("e")
+        output_message += "{}{}{}{}{}".format(channel_name,
+                                              "-" if value < 0 else "+",
+                                              mantissa.replace(".", ""),
+                                              abs(int(exponent)),
+                                              "-" if int(exponent) < 0 else "+")
+
+    return output_message + "\r\n"
+
+
+def main(number_of_channels=8, number_of_responses=1000):
+    channel_ids = ["{}{}".format("abcdefghij"[i // 10], i % 10) for i in range(number_of_channels)]
+    precisions = [random.randint(1, 6) for _ in channel_ids]
+
+    parser = ArduinoMessages.compile_output_parser(tuple(channel_ids), tuple(precisions))
+    split_channels, split_precisions = [channel_ids], [precisions]
+    if len(ArduinoMessages.build_query_message(channel_ids, precisions)) > 1:
+        split_channels, split_precisions = ArduinoMessages.split_query_message(channel_ids, precisions)
+
+    responses = []
+    for _ in range(number_of_responses):
+        values = {channel_name: random.uniform(-1e4, 1e4) for channel_name in channel_ids}
+        responses.append([build_output_message(message_channels, message_precisions,
+                                               [values[channel_name] for channel_name in message_channels])
+                          for message_channels, message_precisions in zip(split_channels, split_precisions)])
+
+    def regex():
+        for output_messages in responses:
+            ArduinoMessages.parse_arduino_output_message(output_messages)
+
+    def fast():
+        for output_messages in responses:
+            ArduinoMessages.parse_arduino_output_message(output_messages, channel_ids, precisions)
+
+    def batch():
+        parser.parse_batch(responses)
+
+    print("{} channels, {} responses ({} message(s) each)".format(number_of_channels, number_of_responses,
+                                                                   len(split_channels)))
+
+    for name, func in (("regex", regex), ("fast path", fast), ("batch", batch)):
+        duration = min(timeit.repeat(func, number=1, repeat=5))
+        print("{:>10}: {:8.2f} us per response".format(name, 1e6 * duration / number_of_responses))
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -7,7 +7,6 @@
 
 import json
 # import datetime
-from collections import deque
 # Noinspections necessary for PyCharm because installed PyQt5 module is just called 'pyqt'
 # noinspection PyPackageRequirements
 from PyQt5.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QGroupBox, \
@@ -18,6 +17,8 @@ from PyQt5.QtCore import pyqtSignal, pyqtSlot, QObject
 from .gui.widgets.DateTimePlotWidget import DateTimePlotWidget
 from .gui.widgets.EntryForm import EntryForm
 from .gui.widgets.ChannelDial import ChannelDial
+from .RingBuffer import RingBuffer
+from .Decimation import MinMaxPyramid
 
 
 class ChannelWidget(QGroupBox):
@@ -249,8 +250,10 @@ class Channel(QObject):
             self._plot_settings = plot_settings
 
         self._retain_last_n_values = stored_values
-        self._x_values = deque(maxlen=self._retain_last_n_values)
-        self._y_values = deque(maxlen=self._retain_last_n_values)
+        # timestamps (column 0) and values (column 1) of the last stored_values points
+        self._history = RingBuffer(self._retain_last_n_values, columns=2)
+        # min/max envelopes of the history for plotting (level of detail)
+        self._lod = MinMaxPyramid(self._history)
 
         # entry form representation (settings page in gui)
         self._entry_form = EntryForm(self.label, '',
@@ -482,11 +485,21 @@ class Channel(QObject):
 
     @property
     def x_values(self):
-        return self._x_values
+        """ numpy view of the stored timestamps (no copy, only valid until new data is appended) """
+        return self._history.column(0)
 
     @property
     def y_values(self):
-        return self._y_values
+        """ numpy view of the stored values (no copy, only valid until new data is appended) """
+        return self._history.column(1)
+
+    @property
+    def lod(self):
+        return self._lod
+
+    @property
+    def last_x_value(self):
+        return self._history.last(0)
 
     @property
     def stored_values(self):
@@ -494,29 +507,17 @@ class Channel(QObject):
 
     @stored_values.setter
     def stored_values(self, value):
-        n = len(self._x_values)
-
-        if value < n:
-            # take last n values of current deque
-            x_vals = [self._x_values[i] for i in range(n - value, n)]
-            y_vals = [self._y_values[i] for i in range(n - value, n)]
-        else:
-            x_vals = self._x_values
-            y_vals = self._y_values
-
         self._retain_last_n_values = value
-        self._x_values = deque(maxlen=self._retain_last_n_values)
-        self._x_values.extend(x_vals)
-        self._y_values = deque(maxlen=self._retain_last_n_values)
-        self._y_values.extend(y_vals)
+        self._history.resize(value)
+        self._lod.rebuild()
 
     def append_data(self, x, y):
-        self._x_values.append(x)
-        self._y_values.append(y)
+        self._history.append(x, y)
+        self._lod.append(x, y)
 
     def clear_data(self):
-        self._x_values.clear()
-        self._y_values.clear()
+        self._history.clear()
+        self._lod.rebuild()
         self._plot_widget.clear()  # setdata(0,0)
 
     # ---- properties ----
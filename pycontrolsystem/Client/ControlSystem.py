@@ -14,6 +14,7 @@ import threading
 import queue
 import os
 import datetime
+import numpy as np
 from multiprocessing import Process, Pipe
 from slackclient import SlackClient
 
@@ -45,12 +46,383 @@ from .Device import Device
 from .Channel import Channel
 from .Procedure import BasicProcedure, PidProcedure  # , Procedure, TimerProcedure
 from .FileOps import load_from_csv
+from .Routing import RoutingTable
+from ..WireFormat import FrameDecoder, WIRE_VERSION
+try:
+    from .SampleRing import SampleRing, METADATA_POLLING_RATE, METADATA_POLLING_RATE_TARGET, METADATA_MIN, \
+        records_from_response, records_from_frames
+except ImportError:
+    # multiprocessing.shared_memory needs Python 3.8, send everything through the pipe
+    SampleRing = None
 
 LOG_DATA = True
 
 
-def query_server(com_pipe, server_url, debug=False):
-    """ Sends info from server to communicator pipe """
+class SampleWriter(object):
+    """
+    Hands the device values the query process got from the server to the GUI. If there is a SampleRing,
+    the values are written into it and only the new sequence number goes through the pipe
+    ("query_samples"), otherwise the responses/frames are sent through the pipe. Device and channel
+    indices refer to the schema ("query_schema"), which is sent whenever the device list changes.
+    Error messages always go through the pipe as "query_response".
+    """
+
+    def __init__(self, com_pipe, ring=None):
+        self._pipe = com_pipe
+        self._ring = ring
+        self._lock = threading.Lock()  # the stream thread and the query process both send
+
+        self._devices = []
+        self._device_indices = {}
+        self._channel_indices = []
+
+    def send(self, message):
+        with self._lock:
+            self._pipe.send(message)
+
+    def set_schema(self, device_dict_list):
+        self._devices = [device['device_id'] for device in device_dict_list]
+        channels = [device['channel_ids'] for device in device_dict_list]
+
+        self._device_indices = {device_id: i for i, device_id in enumerate(self._devices)}
+        self._channel_indices = [{channel_id: j for j, channel_id in enumerate(channel_ids)}
+                                 for channel_ids in channels]
+
+        self.send(["query_schema", {'version': WIRE_VERSION, 'devices': self._devices, 'channels': channels}])
+
+    def write_response(self, parsed_response, timestamp):
+        """ parsed_response is a response of /device/query (or a JSON event of /device/stream) """
+        if self._ring is None:
+            parsed_response["timestamp"] = timestamp
+            self.send(["query_response", parsed_response])
+            return
+
+        records, errors = records_from_response(parsed_response, self._device_indices,
+                                                self._channel_indices, timestamp)
+        self._write(records, errors)
+
+    def write_frames(self, frames, timestamp):
+        """ frames are decoded WireFormat data/error frames """
+        if self._ring is None:
+            self.send(["query_frames", {'timestamp': timestamp, 'frames': frames}])
+            return
+
+        records, frame_errors = records_from_frames(frames, timestamp)
+        errors = {self._devices[device_index]: message for device_index, message in frame_errors
+                  if device_index < len(self._devices)}
+        self._write(records, errors)
+
+    def _write(self, records, errors):
+        if len(records) > 0:
+            with self._lock:
+                sequence = self._ring.write(records)
+                self._pipe.send(["query_samples", {'sequence': sequence}])
+
+        if errors:
+            self.send(["query_response", errors])
+
+
+class SetDispatcher(object):
+    """
+    Sends the set commands to the server from one background thread over a keep-alive session.
+    Everything that was submitted while the last request was on its way goes out as one /device/set
+    request with a list of commands, so a dial drag doesn't open a connection (and thread) per value.
+    """
+
+    def __init__(self, server_url, debug=False):
+        self._url = server_url + "device/set"
+        self._debug = debug
+        self._session = requests.Session()
+        self._pending = queue.Queue()
+
+        self._thread = threading.Thread(target=self._run, name='SetDispatcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, cmd):
+        self._pending.put(cmd)
+
+    def close(self):
+        """ Sends whatever is still pending and stops the thread """
+        self._pending.put(None)
+        self._thread.join(timeout=5.0)
+        self._session.close()
+
+    def _run(self):
+        while True:
+            cmds = [self._pending.get()]
+
+            while True:
+                try:
+                    cmds.append(self._pending.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = None in cmds
+            cmds = [cmd for cmd in cmds if cmd is not None]
+
+            if cmds:
+                self._send(cmds)
+
+            if stop:
+                return
+
+    def _send(self, cmds):
+        try:
+            _r = self._session.post(self._url, data={'data': json.dumps(cmds)}, timeout=(3.05, 5.0))
+
+            if _r.status_code == 200:
+                if self._debug:
+                    print("Sending {} set command(s) to server successful, response was: {}".format(len(cmds),
+                                                                                                   _r.text))
+            else:
+                print("Sending set command to server unsuccessful, response-code was: {}".format(_r.status_code))
+        except Exception as e:
+            if self._debug:
+                print("Exception '{}' caught while communicating with RasPi server.".format(e))
+
+
+class InterlockSync(object):
+    """
+    Loads the procedures on the server as interlocks and asks it every period which of them it can't act
+    on right now (action device missing, no value for a rule yet, dropped action), both from a background
+    thread. on_active is called with the names of the procedures the server handles whenever they change,
+    the client keeps doing the actions of all others itself. If the server can't be reached, that's none.
+    """
+
+    def __init__(self, server_url, on_active, period=0.5, debug=False):
+        self._url = server_url
+        self._on_active = on_active
+        self._period = period
+        self._debug = debug
+        self._session = requests.Session()
+        self._pending = queue.Queue()
+
+        self._thread = threading.Thread(target=self._run, name='InterlockSync', daemon=True)
+        self._thread.start()
+
+    def load(self, session):
+        self._pending.put(session)
+
+    def close(self):
+        self._pending.put(None)
+        self._thread.join(timeout=5.0)
+        self._session.close()
+
+    def _run(self):
+        loaded = []
+        active = []
+
+        while True:
+            try:
+                sessions = [self._pending.get(timeout=self._period)]
+            except queue.Empty:
+                sessions = []
+
+            while True:
+                try:
+                    sessions.append(self._pending.get_nowait())
+                except queue.Empty:
+                    break
+
+            if None in sessions:
+                return
+
+            if sessions:
+                # only the newest session matters
+                loaded = self._load(sessions[-1])
+
+            unavailable = self._status() if loaded else {}
+            new_active = [name for name in loaded if unavailable is not None and name not in unavailable]
+
+            if sessions or new_active != active:
+                active = new_active
+                self._on_active(active)
+
+    def _load(self, session):
+        try:
+            _r = self._session.post(self._url + "interlock/load", data={'data': json.dumps(session)}, timeout=2.0)
+
+            if _r.status_code == 200:
+                return json.loads(_r.text)
+
+            print("Loading interlocks on server unsuccessful, response-code was: {}".format(_r.status_code))
+        except Exception as e:
+            if self._debug:
+                print("Exception '{}' caught while sending interlocks to server.".format(e))
+
+        return []
+
+    def _status(self):
+        try:
+            _r = self._session.get(self._url + "interlock/status", timeout=2.0)
+
+            if _r.status_code == 200:
+                return json.loads(_r.text)
+        except Exception as e:
+            if self._debug:
+                print("Exception '{}' caught while getting interlock status from server.".format(e))
+
+        return None
+
+
+class ServerStream(object):
+    """
+    Subscription to the server's /device/stream route. The server pushes new device values, which are
+    read in a background thread and handed to the SampleWriter. With binary=True we ask for the binary
+    WireFormat, whose schema has to match the subscribed device list. Servers that only speak
+    Server-Sent Events answer with JSON, which is handled like the responses of /device/query.
+    """
+
+    def __init__(self, server_url, device_dict_list, writer, binary=True, debug=False, session=None):
+        self._url = server_url + "device/stream"
+        self._session = session if session is not None else requests.Session()
+        self._device_dict_list = device_dict_list
+        self._writer = writer
+        self._binary = binary
+        self._debug = debug
+
+        self._response = None
+        self._thread = None
+        self._closed = False
+        self._not_supported = False
+
+    @property
+    def is_alive(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def not_supported(self):
+        return self._not_supported
+
+    def open(self):
+        """ Subscribes to the server. Returns True if the stream is running """
+        _data = {'data': json.dumps(self._device_dict_list)}
+        if self._binary:
+            _data['format'] = 'binary'
+
+        try:
+            # read timeout: the server sends keepalives every few seconds, so this only triggers if it's gone
+            self._response = self._session.post(self._url, data=_data, stream=True, timeout=(3.05, 15.0))
+        except Exception as e:
+            if self._debug:
+                print("Exception '{}' caught while subscribing to server stream.".format(e))
+            return False
+
+        if self._response.status_code in (404, 405):
+            # Server doesn't have the streaming route (e.g. DummyServer)
+            self._not_supported = True
+            return False
+        elif self._response.status_code != 200:
+            if self._debug:
+                print("Response code was not 200: {}".format(self._response.status_code))
+            return False
+
+        if self._response.headers.get('Content-Type', '').startswith('application/octet-stream'):
+            target = self._read_binary
+        else:
+            target = self._read
+
+        self._thread = threading.Thread(target=target, daemon=True)
+        self._thread.start()
+
+        return True
+
+    def close(self):
+        self._closed = True
+        try:
+            self._response.close()
+        except AttributeError:
+            pass
+
+    def _send(self, message):
+        if not self._closed:
+            self._writer.send(message)
+
+    def _read(self):
+        buffer = b''
+        event_count = 0
+        event_time = timeit.default_timer()
+
+        try:
+            for chunk in self._response.iter_content(chunk_size=None):
+                buffer += chunk
+
+                while b'\n\n' in buffer:
+                    event, buffer = buffer.split(b'\n\n', 1)
+
+                    if not event.startswith(b'data: '):
+                        # keepalive comment
+                        continue
+
+                    parsed_response = json.loads(event[6:].decode())
+
+                    if self._debug:
+                        print("The response was: {}".format(parsed_response))
+
+                    if self._closed:
+                        break
+
+                    self._writer.write_response(parsed_response, time.time())
+
+                    event_count += 1
+                    if event_count == 20:
+                        duration = timeit.default_timer() - event_time
+                        event_time = timeit.default_timer()
+                        event_count = 0
+
+                        self._send(["polling_rate", 20.0 / duration])
+
+        except Exception as e:
+            if self._debug and not self._closed:
+                print("Exception '{}' caught while reading server stream.".format(e))
+
+    def _read_binary(self):
+        decoder = FrameDecoder()
+        frame_count = 0
+        frame_time = timeit.default_timer()
+
+        try:
+            for chunk in self._response.iter_content(chunk_size=None):
+                frames = decoder.feed(chunk)
+
+                if not frames:
+                    # keepalive or incomplete frame
+                    continue
+
+                if frames[0][0] == 'schema':
+                    # the SampleWriter already sent the schema of the subscribed device list, check it's the same
+                    schema = frames.pop(0)[1]
+                    if schema['devices'] != [device['device_id'] for device in self._device_dict_list] or \
+                            schema['channels'] != [device['channel_ids'] for device in self._device_dict_list]:
+                        print("Server stream schema does not match the subscribed devices, closing stream.")
+                        break
+
+                    if not frames:
+                        continue
+
+                if self._closed:
+                    break
+
+                self._writer.write_frames(frames, time.time())
+
+                frame_count += len(frames)
+                if frame_count >= 20:
+                    duration = timeit.default_timer() - frame_time
+                    self._send(["polling_rate", frame_count / duration])
+
+                    frame_time = timeit.default_timer()
+                    frame_count = 0
+
+        except Exception as e:
+            if self._debug and not self._closed:
+                print("Exception '{}' caught while reading server stream.".format(e))
+
+
+def query_server(com_pipe, server_url, debug=False, ring_name=None):
+    """
+    Sends info from server to communicator pipe. If ring_name is given, the values are written into
+    that SampleRing (shared memory) instead
+    """
     _keep_communicating = True
     _com_period = 5.0
     _device_dict_list = None
@@ -58,6 +430,22 @@ def query_server(com_pipe, server_url, debug=False):
     poll_time = timeit.default_timer()
     _paused = False
 
+    # ETag of the device list on the server, we only post the device list again when it changed
+    _query_version = None
+
+    # the fastest polling rate the server negotiated with our devices, polling faster gets no new values
+    _server_period = 0.0
+
+    # Subscribe to the server's push stream if it has one, fall back to polling /device/query otherwise
+    _streaming = True
+    _stream = None
+
+    _ring = SampleRing(name=ring_name) if ring_name is not None else None
+    _writer = SampleWriter(com_pipe, _ring)
+
+    # keep-alive connection instead of a new one for every query
+    _session = requests.Session()
+
     while _keep_communicating:
         # Do the timing of this process:
         _thread_start_time = timeit.default_timer()
@@ -67,17 +455,45 @@ def query_server(com_pipe, server_url, debug=False):
                 _com_period = _in_message[1]
             elif _in_message[0] == "device_or_channel_changed":
                 _device_dict_list = _in_message[1]
+                _writer.set_schema(_device_dict_list)
+                _query_version = None
+                if _stream is not None:
+                    # resubscribe with the new device list
+                    _stream.close()
+                    _stream = None
             elif _in_message[0] == "pause_query":
                 _paused = not _paused
+                if _stream is not None:
+                    _stream.close()
+                    _stream = None
+
+        if _streaming and _device_dict_list and not _paused:
+            if _stream is None or not _stream.is_alive:
+                _stream = ServerStream(server_url, _device_dict_list, _writer, debug=debug, session=_session)
+
+                if not _stream.open():
+                    if _stream.not_supported:
+                        _streaming = False
+                    else:
+                        # server not reachable, don't hammer it with new subscriptions
+                        com_pipe.poll(max(_com_period, 1.0))
+                    _stream = None
+                    continue
+
+            # The stream thread does all the work, just wait for new messages from the GUI
+            com_pipe.poll(1.0)
+            continue
 
         if _device_dict_list is not None and _device_dict_list and not _paused:
             poll_count += 1
             _url = server_url + "device/query"
-            _data = {'data': json.dumps(_device_dict_list)}
 
             try:
 
-                _r = requests.post(_url, data=_data)
+                if _query_version is None:
+                    _r = _session.post(_url, data={'data': json.dumps(_device_dict_list)})
+                else:
+                    _r = _session.post(_url, headers={'If-Match': _query_version})
                 timestamp = time.time()
                 _response_code = _r.status_code
 
@@ -88,9 +504,15 @@ def query_server(com_pipe, server_url, debug=False):
 
                 continue
 
+            if _response_code == 412:
+                # server doesn't know our device list (e.g. it was restarted), send it again
+                _query_version = None
+                continue
+
             if _response_code == 200:
 
                 _response = _r.text
+                _query_version = _r.headers.get('ETag')
 
                 if debug:
 
@@ -103,11 +525,13 @@ def query_server(com_pipe, server_url, debug=False):
 
             # if _response.strip() != r"{}" and "error" not in str(_response).lower():
             if _response.strip() != r"{}":
-                parsed_response = json.loads(_response)
-                parsed_response["timestamp"] = timestamp
-                pipe_message = ["query_response", parsed_response]
+                _parsed = json.loads(_response)
+
+                _targets = [values['polling_rate_target'] for values in _parsed.values()
+                            if isinstance(values, dict) and values.get('polling_rate_target')]
+                _server_period = 1.0 / max(_targets) if _targets else 0.0
 
-                com_pipe.send(pipe_message)
+                _writer.write_response(_parsed, timestamp)
 
         if poll_count == 20:
             duration = timeit.default_timer() - poll_time
@@ -115,14 +539,13 @@ def query_server(com_pipe, server_url, debug=False):
             poll_count = 0
             polling_rate = 20.0 / duration
 
-            pipe_message = ["polling_rate", polling_rate]
-            com_pipe.send(pipe_message)
+            _writer.send(["polling_rate", polling_rate])
 
             if debug:
                 print("Polling rate = {}".format(polling_rate))
 
         # Do the timing of this process:
-        _sleepy_time = _com_period - timeit.default_timer() + _thread_start_time
+        _sleepy_time = max(_com_period, _server_period) - timeit.default_timer() + _thread_start_time
 
         if _sleepy_time > 0.0:
             # if debug:
@@ -131,26 +554,39 @@ def query_server(com_pipe, server_url, debug=False):
 
 
 class Communicator(QObject):
-    """ Sends and recieves messages to and from the query process """
+    """
+    Sends and recieves messages to and from the query process. communicate() blocks on the pipe
+    (in the communicator's QThread) and emits a signal for every message, outgoing messages are
+    written to the pipe directly.
+    """
 
     sig_status = pyqtSignal(str)
 
     # gui update signals
     sig_poll_rate = pyqtSignal(float)
     sig_device_info = pyqtSignal(dict)
+    sig_device_schema = pyqtSignal(dict)
+    sig_device_frames = pyqtSignal(dict)
+    sig_device_samples = pyqtSignal(dict)
 
-    def __init__(self, pipe, parent_app):
+    def __init__(self, pipe, parent_app, poll_timeout=0.5):
         super().__init__()
         self._pipe = pipe
         self._app = parent_app  # reference to main QApplication
         self._terminate = False
         self._keep_communicating = True
 
-        # need a queue for procedure actions
-        self._message_queue = queue.Queue()
+        # the pipe is read in the communicator thread, but written from the gui and procedure threads
+        self._send_lock = threading.Lock()
+        self._running = threading.Event()
+        self._running.set()
+
+        # (s) how long to block on the pipe before checking for terminate
+        self._poll_timeout = poll_timeout
 
     def send_message(self, message):
-        self._message_queue.put(message)
+        with self._send_lock:
+            self._pipe.send(message)
 
     @property
     def isRunning(self):
@@ -159,6 +595,10 @@ class Communicator(QObject):
     @isRunning.setter
     def isRunning(self, val):
         self._keep_communicating = val
+        if val:
+            self._running.set()
+        else:
+            self._running.clear()
 
     @property
     def pipe(self):
@@ -166,36 +606,39 @@ class Communicator(QObject):
 
     # @pyqtSlot()
     def communicate(self):
-        while True:
-            if self._keep_communicating:
-                # listen to the pipe
-                if self._pipe.poll():
-                    gui_message = self._pipe.recv()
-                    if gui_message[0] == "polling_rate":
-                        self.sig_poll_rate.emit(gui_message[1])
-                    elif gui_message[0] == "query_response":
-                        self.sig_device_info.emit(gui_message[1])
-
-                # if there is a message, send it
-                if not self._message_queue.empty():
-                    message = self._message_queue.get()
-                    self._pipe.send(message)
-                    self._message_queue.task_done()
-
-                self._app.processEvents()
-
-                if self._terminate:
-                    break
-            else:
-                time.sleep(1.0)
+        while not self._terminate:
+            if not self._keep_communicating:
+                # paused, sleep until we are running again (or terminated)
+                self._running.wait(self._poll_timeout)
+                continue
+
+            # block until there is something to read
+            try:
+                if not self._pipe.poll(self._poll_timeout):
+                    continue
 
-            if self._terminate:
-                self.sig_status.emit('Communicator terminating...')
+                gui_message = self._pipe.recv()
+            except (EOFError, OSError):
+                # query process went away
                 break
 
+            if gui_message[0] == "polling_rate":
+                self.sig_poll_rate.emit(gui_message[1])
+            elif gui_message[0] == "query_response":
+                self.sig_device_info.emit(gui_message[1])
+            elif gui_message[0] == "query_frames":
+                self.sig_device_frames.emit(gui_message[1])
+            elif gui_message[0] == "query_schema":
+                self.sig_device_schema.emit(gui_message[1])
+            elif gui_message[0] == "query_samples":
+                self.sig_device_samples.emit(gui_message[1])
+
+        self.sig_status.emit('Communicator terminating...')
+
     def terminate(self):
         self.sig_status.emit('Communicator received terminate signal')
         self._terminate = True
+        self._running.set()
 
 
 class ControlSystem(object):
@@ -273,9 +716,12 @@ class ControlSystem(object):
         # --- Initialize server --- #
         self.debug = debug
         self._server_url = 'http://{}:{}/'.format(server_ip, server_port)
+        self._session = requests.Session()  # for requests from the GUI thread
+        self._set_dispatcher = SetDispatcher(self._server_url, debug=debug)
+        self._interlock_sync = InterlockSync(self._server_url, self.on_interlocks_active, debug=debug)
 
         try:
-            r = requests.get(self._server_url + 'initialize/')
+            r = self._session.get(self._server_url + 'initialize/')
             if r.status_code == 200:
                 self._window.status_message(r.text)
             else:
@@ -307,11 +753,27 @@ class ControlSystem(object):
         # --- Set up data dictionaries and lists --- #
         self._devices = {}
         self._procedures = {}
+        self._procedure_index = {}  # channel -> basic procedures with rules on that channel
         self._critical_procedures = {}
         self._emergency_stop_signals = {}
         self._plotted_channels = []
+        self._displayed_revisions = {}  # channel -> data revision shown in its read widget
+
+        # (device id, channel name) -> channel, rebuilt whenever devices/channels change
+        self._routes = RoutingTable()
         self._locked_devices = []
 
+        # schema of the binary server stream (device ids and channel names, frames refer to them by index)
+        self._stream_schema = None
+
+        # shared memory with the values from the query process (see setup_communication_threads)
+        self._sample_ring = None
+        self._sample_sequence = 0
+
+        # names of the devices the server polls together at the same instant (see set_snapshot_group)
+        self._snapshot_devices = []
+        self._snapshot_rate = 0.0
+
         # --- Keep persistent communicator thread --- #
         self._com_thread = QThread()
 
@@ -337,8 +799,14 @@ class ControlSystem(object):
         """ Create gui/server pipe pair, start communicator """
         self._pipe_gui, pipe_server = Pipe()
 
+        # the query process writes the device values into shared memory, only sequence numbers go through the pipe
+        if SampleRing is not None:
+            self._sample_ring = SampleRing()
+            self._sample_sequence = 0
+
         self._com_process = Process(target=query_server,
-                                    args=(pipe_server, self._server_url, self.debug,))
+                                    args=(pipe_server, self._server_url, self.debug,
+                                          self._sample_ring.name if self._sample_ring is not None else None))
 
         self._keep_communicating = True
 
@@ -348,6 +816,9 @@ class ControlSystem(object):
         self._communicator.sig_status.connect(self.on_communicator_status)
         self._communicator.sig_poll_rate.connect(self.on_communicator_poll_rate)
         self._communicator.sig_device_info.connect(self.on_communicator_device_info)
+        self._communicator.sig_device_schema.connect(self.on_communicator_device_schema)
+        self._communicator.sig_device_frames.connect(self.on_communicator_device_frames)
+        self._communicator.sig_device_samples.connect(self.on_communicator_device_samples)
         self._com_thread.start()
 
         # Tell the query process the current polling rate:
@@ -380,6 +851,10 @@ class ControlSystem(object):
         except AttributeError:
             pass
 
+        if self._sample_ring is not None:
+            self._sample_ring.close()
+            self._sample_ring = None
+
         self._retry_devices = False
         try:
             del self._retry_thread
@@ -402,6 +877,12 @@ class ControlSystem(object):
         parsed_response = data
         # print(parsed_response)
 
+        columns = []
+        values = []
+        timestamps = []
+        t_starts = []
+        t_ends = []
+
         for device_name, device in self._devices.items():
             device_id = device.device_id
 
@@ -412,14 +893,10 @@ class ControlSystem(object):
 
             # if "ERROR" in parsed_response[device_id]:
             if any(resp in parsed_response[device_id] for resp in ("ERROR", "TIMEOUT")):
-                device.lock(message=parsed_response[device_id])
-                if device not in self._locked_devices:
-                    self._locked_devices.append(device)
+                self._lock_device(device, parsed_response[device_id])
                 continue
 
-            if device in self._locked_devices:
-                self._locked_devices.remove(device)
-                device.overview_widget.hide_error_message()
+            self._clear_device_error(device)
 
             try:
                 timestamp = parsed_response[device_id]['timestamp']
@@ -428,52 +905,193 @@ class ControlSystem(object):
                 # did not get a valid response or dict might be empty
                 continue
 
+            # when the server sent the query and got the response (timestamp can be a snapshot barrier)
+            t_start = parsed_response[device_id].get('t_start', np.nan)
+            t_end = parsed_response[device_id].get('t_end', np.nan)
+
+            if 'polling_rate_target' in parsed_response[device_id]:
+                device.polling_rate_target = parsed_response[device_id]['polling_rate_target']
+
             for channel_name, value in parsed_response[device_id].items():
                 # metadata the server sent back that doesn't contain channel values
-                if channel_name in ['timestamp', 'polling_rate']:
+                if channel_name in ['timestamp', 'polling_rate', 'polling_rate_target', 't_start', 't_end',
+                                    'snapshot']:
                     continue
-                #
-                # if device_name == "naims":
-                #     print("Updating channel {} with value {}".format(channel_name, value))
-
-                channel = device.get_channel_by_name(channel_name)
-                if channel is None:
-                    device.lock(message='Could not find channel with name {}.'.format(channel_name))
-                    if device not in self._locked_devices:
-                        self._locked_devices.append(device)
+
+                column = self._routes.column(device_id, channel_name)
+                if column < 0:
+                    self._lock_device(device, 'Could not find channel with name {}.'.format(channel_name))
                     continue
 
-                # Scale value back to channel
-                channel.value = value / channel.scaling
-                self.update_stored_values(device_name, channel_name, timestamp)
+                columns.append(column)
+                values.append(value)
+                timestamps.append(timestamp)
+                t_starts.append(t_start)
+                t_ends.append(t_end)
+
+        self._update_channels(columns, values, timestamps, t_starts, t_ends)
+
+    # @pyqtSlot(dict)
+    def on_communicator_device_schema(self, data: dict):
+        """ Device values from the query process refer to devices and channels by index into this """
+        self._stream_schema = data
+
+    # @pyqtSlot(dict)
+    def on_communicator_device_frames(self, data: dict):
+        """ Read in decoded binary frames from the server stream, and update devices accordingly """
+        if self._stream_schema is None:
+            return
+
+        schema_columns = self._routes.schema_columns(self._stream_schema)
+        devices = {device.device_id: device for device in self._devices.values()}
+
+        columns = []
+        values = []
+        timestamps = []
+        t_starts = []
+        t_ends = []
+
+        for frame in data['frames']:
+            device_index = frame[1]
+
+            try:
+                device = devices[self._stream_schema['devices'][device_index]]
+            except (KeyError, IndexError):
+                continue
+
+            if device.locked:
+                continue
+
+            if frame[0] == 'error':
+                self._lock_device(device, frame[2])
+                continue
+
+            self._clear_device_error(device)
+
+            # the server's timestamp of the sample, like the JSON path
+            _, _, timestamp, polling_rate, channel_indices, frame_values, t_start, t_end = frame
+            device.polling_rate = polling_rate
+
+            frame_columns = self._known_columns(device, schema_columns[device_index][channel_indices])
+            known = frame_columns >= 0
+
+            columns.append(frame_columns[known])
+            values.append(frame_values[known])
+            timestamps.append(np.full(known.sum(), timestamp))
+            t_starts.append(np.full(known.sum(), t_start))
+            t_ends.append(np.full(known.sum(), t_end))
+
+        if columns:
+            self._update_channels(np.concatenate(columns), np.concatenate(values), np.concatenate(timestamps),
+                                  np.concatenate(t_starts), np.concatenate(t_ends))
+
+    # @pyqtSlot(dict)
+    def on_communicator_device_samples(self, data: dict):
+        """ Read in the new sample records from the shared memory ring, and update devices accordingly """
+        if self._sample_ring is None or self._stream_schema is None:
+            return
+
+        records = self._sample_ring.read(self._sample_sequence, data['sequence'])
+        self._sample_sequence = data['sequence']
+
+        if len(records) == 0:
+            return
+
+        schema_columns = self._routes.schema_columns(self._stream_schema)
+        devices = {device.device_id: device for device in self._devices.values()}
+        use = np.zeros(len(records), dtype=bool)
+        columns = np.full(len(records), -1)
+
+        # the records are written device by device
+        boundaries = np.concatenate(([0], np.flatnonzero(np.diff(records['device'])) + 1, [len(records)]))
+
+        for start, stop in zip(boundaries[:-1], boundaries[1:]):
+            device_index = int(records['device'][start])
+
+            try:
+                device = devices[self._stream_schema['devices'][device_index]]
+            except (KeyError, IndexError):
+                continue
+
+            if device.locked:
+                continue
+
+            self._clear_device_error(device)
+
+            device_channels = records['channel'][start:stop]
+
+            metadata = device_channels >= METADATA_MIN
+            if metadata.any():
+                for channel_index, value in zip(device_channels[metadata].tolist(),
+                                                records['value'][start:stop][metadata].tolist()):
+                    if channel_index == METADATA_POLLING_RATE:
+                        device.polling_rate = value
+                    elif channel_index == METADATA_POLLING_RATE_TARGET:
+                        device.polling_rate_target = value
+
+            device_columns = np.full(stop - start, -1)
+            device_columns[~metadata] = self._known_columns(device,
+                                                            schema_columns[device_index][device_channels[~metadata]])
+
+            columns[start:stop] = device_columns
+            use[start:stop] = device_columns >= 0
+
+        self._update_channels(columns[use], records['value'][use], records['timestamp'][use],
+                              records['t_start'][use], records['t_end'][use])
+
+    def _known_columns(self, device, columns):
+        """ Locks the device if any of the columns is unknown (-1) """
+        if (columns < 0).any():
+            self._lock_device(device, 'Could not find all channels of device {} in the response.'.format(device.name))
 
-                # try:
-                #     self.log_data(channel, timestamp)
-                # except Exception as e:
-                #     if self.debug:
-                #         print("Exception '{}' caught while trying to log data.".format(e))
+        return columns
+
+    def _update_channels(self, columns, values, timestamps, t_starts, t_ends):
+        """
+        Sets the values (as sent by the server) of the channels in the given RoutingTable columns,
+        scaling all of them at once, and checks the procedures once for all changed channels.
+        t_starts/t_ends are the times the server sent the queries and got the responses.
+        """
+        if len(columns) == 0:
+            return
+
+        columns = np.asarray(columns, dtype=int)
+        values = self._routes.scale(columns, values)
+
+        changed_channels = set()
+
+        for column, value, timestamp, t_start, t_end in zip(columns.tolist(), values.tolist(),
+                                                            np.asarray(timestamps).tolist(),
+                                                            np.asarray(t_starts).tolist(),
+                                                            np.asarray(t_ends).tolist()):
+            device_name, device, channel_name, channel = self._routes.columns[column]
+
+            channel.value = value
+            self._store_value(device_name, channel_name, channel, timestamp, t_start, t_end)
+            changed_channels.add(channel)
+
+        self.check_procedures(changed_channels)
+
+    def _lock_device(self, device, message):
+        device.lock(message=message)
+        if device not in self._locked_devices:
+            self._locked_devices.append(device)
+
+    def _clear_device_error(self, device):
+        if device in self._locked_devices:
+            self._locked_devices.remove(device)
+            device.overview_widget.hide_error_message()
 
     # @pyqtSlot()
     def device_or_channel_changed(self):
         """ Sends a device changed request to the pipe """
-        device_dict_list = [{
-            'device_driver': device.driver,
-            'device_id': device.device_id,
-            'locked_by_server': False,
-            'channel_ids': [name for name, mych in device.channels.items() if
-                            mych.mode in ['read', 'both']],
-            'precisions': [mych.precision for name, mych in device.channels.items() if
-                           mych.mode in ['read', 'both']],
-            'values': [None for name, mych in device.channels.items() if
-                       mych.mode in ['read', 'both']],
-            'data_types': [str(mych.data_type) for name, mych in device.channels.items() if
-                           mych.mode in ['read', 'both']]
-        }
+        self._routes.build(self._devices)
 
-            for device_name, device in self._devices.items()
-            if not (device.locked or
-                    len([name for name, mych in device.channels.items() if
-                         mych.mode in ['read', 'both']]) == 0)]
+        device_dict_list = [self.query_data(device)
+                            for device_name, device in self._devices.items()
+                            if not (device.locked or
+                                    len([name for name, mych in device.channels.items() if
+                                         mych.mode in ['read', 'both']]) == 0)]
 
         pipe_message = ["device_or_channel_changed", device_dict_list]
 
@@ -483,8 +1101,11 @@ class ControlSystem(object):
             pass
 
     # @pyqtSlot(Channel, object)
-    def set_value_callback(self, channel, val):
-        """ Creates a SET message to send to server """
+    def set_value_callback(self, channel, val, priority='user'):
+        """
+        Creates a SET message to send to server. priority is 'emergency', 'interlock' or 'user', the server
+        sends more urgent set commands first and replaces waiting ones to the same channel with the latest
+        """
         # values = None
         if channel.data_type == float:
             values = val * channel.scaling
@@ -502,12 +1123,11 @@ class ControlSystem(object):
                  'channel_ids': [channel.name],
                  'precisions': [None],
                  'values': [values],
-                 'data_types': [str(channel.data_type)]}
+                 'data_types': [str(channel.data_type)],
+                 'priority': priority}
 
-        # Create a new thread that sends the set command to the server and
-        # waits for an answer.
-        new_set_thread = threading.Thread(target=self.update_device_on_server, args=(_data,))
-        new_set_thread.start()
+        # The dispatcher thread sends it (together with whatever else is pending) to the server
+        self._set_dispatcher.submit(_data)
 
     def update_device_retry_labels(self):
         while self._retry_devices:
@@ -524,53 +1144,55 @@ class ControlSystem(object):
                 device.unlock()
             self.device_or_channel_changed()
 
-    def update_device_on_server(self, _data):
-        """ Sends POST request to server with new device/channel info """
-        _url = self._server_url + "device/set"
-        try:
-            _data = {'data': json.dumps(_data)}
-            _r = requests.post(_url, data=_data)
-
-            if _r.status_code == 200:
-                print("Sending set command to server successful, response was: {}".format(_r.text))
-            else:
-                print("Sending set command to server unsuccessful, response-code was: {}".format(_r.status_code))
-        except Exception as e:
-            if self.debug:
-                print("Exception '{}' caught while communicating with RasPi server.".format(e))
-
     # ---- Internal variable modifiers ----
 
     def update_stored_values(self, device_name, channel_name, timestamp):
-        """ Update the value deques for each channel """
+        """ Update the value history of the channel and check the procedures """
         ch = self._devices[device_name].channels[channel_name]
 
+        self._store_value(device_name, channel_name, ch, timestamp)
+        self.check_procedures({ch})
+
+    def _store_value(self, device_name, channel_name, ch, timestamp, t_start=np.nan, t_end=np.nan):
+        """ Append the channel's current value to its history (and the log file, with t_start/t_end) """
         # zero values will crash log scale plots
         if ch.value == 0:
             ch.value = 1e-20
 
-        if len(ch.x_values) > 0:
+        if ch.last_x_value is not None:
             # only append new data (i.e. if we are polling faster than this
             # device can respond, might receive same point twice)
-            if ch.x_values[-1] != timestamp:
+            if ch.last_x_value != timestamp:
                 ch.append_data(timestamp, ch.value)
                 if LOG_DATA:
-                    self._data_logger.log_value(device_name, channel_name, ch.value, timestamp)
+                    self._data_logger.log_value(device_name, channel_name, ch.value, timestamp, t_start, t_end)
         else:
             ch.append_data(timestamp, ch.value)
             if LOG_DATA:
-                self._data_logger.log_value(device_name, channel_name, ch.value, timestamp)
+                self._data_logger.log_value(device_name, channel_name, ch.value, timestamp, t_start, t_end)
+
+    def check_procedures(self, channels):
+        """ Check the basic procedures whose rules use any of the channels to see if we should activate them """
+        procedures = []
+        for channel in channels:
+            for procedure in self._procedure_index.get(channel, ()):
+                if procedure not in procedures:
+                    procedures.append(procedure)
+
+        for procedure in procedures:
+            if procedure.should_perform_procedure(channels):
+                procedure.do_actions(triggered_by_rules=True)
+
+    def update_procedure_index(self):
+        """ Rebuild the channel -> basic procedures index, call whenever procedures are added or removed """
+        self._procedure_index = {}
 
-        # check basic procedures to see if we should activate them
         for name, procedure in self._procedures.items():
             if not isinstance(procedure, BasicProcedure):
                 continue
 
-            if not self._devices[device_name] in procedure.rule_devices():
-                continue
-
-            if procedure.should_perform_procedure():
-                procedure.do_actions()
+            for channel in procedure.rule_channels():
+                self._procedure_index.setdefault(channel, []).append(procedure)
 
     # # @pyqtSlot(object)
     def connect_device_channel_entry_form(self, obj):
@@ -812,9 +1434,7 @@ class ControlSystem(object):
 
         # update the pinned plot
         if self._pinned_channel is not None:
-            self._pinned_curve.setData(self._pinned_channel.x_values,
-                                       self._pinned_channel.y_values,
-                                       clear=True, _callsync='off')
+            self._window._pinnedplot.set_lod_data(self._pinned_channel.lod)
 
         if self._window.current_tab == 'main':
             # update read values on overview page
@@ -823,6 +1443,12 @@ class ControlSystem(object):
                     if channel.read_widget is None:
                         continue
 
+                    # only redraw values that changed since the last time
+                    if self._displayed_revisions.get(channel) == channel.lod.revision:
+                        continue
+
+                    self._displayed_revisions[channel] = channel.lod.revision
+
                     if channel.data_type in [int, float]:
                         fmt = '{:' + channel.displayformat + '}'
                         val = str(fmt.format(channel.value))
@@ -831,13 +1457,9 @@ class ControlSystem(object):
         # If plot tab is in window mode, we would like it to update always...
         if self._window.current_tab == 'plots' or self._plots_in_window:
 
-            # update the plotted channels
-            for _, _ in self._devices.items():
-
-                for channel in self._plotted_channels:
-                    # pyqtgraph cant plot log of 0
-                    channel._plot_curve.setData(channel.x_values, channel.y_values,
-                                                clear=True, _callsync='off')
+            # update the plotted channels (skips channels without new data)
+            for channel in self._plotted_channels:
+                channel.plot_widget.plot_item.set_lod_data(channel.lod)
 
         self._app.processEvents()
 
@@ -926,6 +1548,14 @@ class ControlSystem(object):
 
         # Then we shut down communication threads
         self.shutdown_communication_threads()
+
+        # send the set commands that are still pending
+        self._set_dispatcher.close()
+        self._interlock_sync.close()
+
+        # write whatever is still buffered to the log file
+        self._data_logger.close()
+
         self._window.close()
 
     # ---- dialogs ---- #
@@ -942,45 +1572,113 @@ class ControlSystem(object):
 
             self._device_file_name = fileName
 
-        with open(self._device_file_name, 'w') as f:
-            devdict = {}
-            for device_name, device in self._devices.items():
-                devdict[device_name] = device.get_json()
-
-            procdict = {}
-            for proc_name, procedure in self._procedures.items():
-                procdict[proc_name] = procedure.json
-
-            winsettingsdict = self._window.current_settings()
-
-            chpinname = None
-            devpinname = None
-            if self._pinned_channel is not None:
-                chpinname = self._pinned_channel.name
-                devpinname = self._pinned_channel.parent_device.name
-
-            cssettingsdict = {
-                'pinned-channel': chpinname,
-                'pinned-device': devpinname,
-                'plotted-channels': [(x.name, x.parent_device.name) for
-                                     x in self._plotted_channels]}
-
-            # TODO: I don't like saving the Slack token in plain text json! -DW
-            slacksettingsdict = {'token': self._slack_token,
-                                 'channel': self._slack_channel}
-
-            output = {
-                'devices': devdict,
-                'procedures': procdict,
-                'window-settings': winsettingsdict,
-                'control-system-settings': cssettingsdict,
-                'slack-settings': slacksettingsdict
-            }
+        output = self.session_json()
 
+        with open(self._device_file_name, 'w') as f:
             json.dump(output, f, sort_keys=True, indent=4, separators=(', ', ': '))
 
         self._window.status_message('Saved session to {}.'.format(self._device_file_name))
 
+        self.push_interlocks(output)
+
+    def session_json(self):
+        """ Serializable representation of the session (devices, procedures, settings) """
+        devdict = {}
+        for device_name, device in self._devices.items():
+            devdict[device_name] = device.get_json()
+
+        procdict = {}
+        for proc_name, procedure in self._procedures.items():
+            procdict[proc_name] = procedure.json
+
+        winsettingsdict = self._window.current_settings()
+
+        chpinname = None
+        devpinname = None
+        if self._pinned_channel is not None:
+            chpinname = self._pinned_channel.name
+            devpinname = self._pinned_channel.parent_device.name
+
+        cssettingsdict = {
+            'pinned-channel': chpinname,
+            'pinned-device': devpinname,
+            'plotted-channels': [(x.name, x.parent_device.name) for
+                                 x in self._plotted_channels],
+            'snapshot': {'devices': self._snapshot_devices,
+                         'rate': self._snapshot_rate}}
+
+        # TODO: I don't like saving the Slack token in plain text json! -DW
+        slacksettingsdict = {'token': self._slack_token,
+                             'channel': self._slack_channel}
+
+        return {
+            'devices': devdict,
+            'procedures': procdict,
+            'window-settings': winsettingsdict,
+            'control-system-settings': cssettingsdict,
+            'slack-settings': slacksettingsdict
+        }
+
+    @staticmethod
+    def query_data(device):
+        """ The device's entry in the device list the server is queried with """
+        return {
+            'device_driver': device.driver,
+            'device_id': device.device_id,
+            'locked_by_server': False,
+            'channel_ids': [name for name, mych in device.channels.items() if
+                            mych.mode in ['read', 'both']],
+            'precisions': [mych.precision for name, mych in device.channels.items() if
+                           mych.mode in ['read', 'both']],
+            'values': [None for name, mych in device.channels.items() if
+                       mych.mode in ['read', 'both']],
+            'data_types': [str(mych.data_type) for name, mych in device.channels.items() if
+                           mych.mode in ['read', 'both']]
+        }
+
+    def set_snapshot_group(self, device_names, rate):
+        """
+        Lets the server poll these devices together: it triggers all of them at the same instant, at most
+        rate (Hz) times per second, and all their values get the time of that instant as timestamp,
+        so e.g. beam current and vacuum pressure can be correlated sample by sample.
+        An empty list or a rate <= 0 switches it off.
+        """
+        self._snapshot_devices = [name for name in device_names if name in self._devices]
+        self._snapshot_rate = rate
+
+        self.push_snapshot_group()
+
+    def push_snapshot_group(self):
+        data = [self.query_data(self._devices[name]) for name in self._snapshot_devices if name in self._devices]
+
+        try:
+            _r = self._session.post(self._server_url + "snapshot/group",
+                                    data={'data': json.dumps(data), 'rate': self._snapshot_rate}, timeout=2.0)
+
+            if _r.status_code != 200:
+                print("Setting snapshot group on server unsuccessful, response-code was: {}".format(_r.status_code))
+        except Exception as e:
+            if self.debug:
+                print("Exception '{}' caught while sending snapshot group to server.".format(e))
+
+    def push_interlocks(self, session=None):
+        """
+        Sends the procedures to the server (in the background, see InterlockSync), which evaluates the
+        rules of the basic procedures itself (see Server/Interlock.py) and does their actions within one
+        device cycle. For those the client then only shows them and sends the notifications.
+        """
+        if session is None:
+            session = self.session_json()
+
+        # the server doesn't need the slack token
+        self._interlock_sync.load({'devices': session['devices'], 'procedures': session['procedures']})
+
+    def on_interlocks_active(self, names):
+        """ Called from the InterlockSync thread with the procedures the server currently acts on """
+        for name, procedure in list(self._procedures.items()):
+            if isinstance(procedure, BasicProcedure):
+                procedure.server_side = name in names
+
     def on_save_as_button(self):
         _fn, _ = QFileDialog.getSaveFileName(self._window,
                                              "Save Session as JSON", "", "Text Files (*.txt)")
@@ -1071,6 +1769,8 @@ class ControlSystem(object):
         self._window.apply_settings(winsettings)
         self.apply_settings(cssettings)
 
+        self.push_interlocks()
+
         # Test slack client
         if self._slack_token is not None:
             _sc = SlackClient(self._slack_token)
@@ -1120,6 +1820,8 @@ class ControlSystem(object):
 
         procedure.initialize()
 
+        self.update_procedure_index()
+
     def edit_procedure(self, proc):
         self.show_ProcedureDialog(False, proc=proc)
 
@@ -1131,7 +1833,9 @@ class ControlSystem(object):
                 del self._emergency_stop_signals[proc.name]
       
         del self._procedures[proc.name]
+        self.update_procedure_index()
         self._window.update_procedures(self._procedures)
+        self.push_interlocks()
 
     # # @pyqtSlot()
     # # @pyqtSlot(Procedure)
@@ -1146,6 +1850,7 @@ class ControlSystem(object):
 
             self.add_procedure(rproc)
             self._window.update_procedures(self._procedures)
+            self.push_interlocks()
 
     # @pyqtSlot()
     def show_ErrorDialog(self, error_message='Error'):
@@ -1173,6 +1878,9 @@ class ControlSystem(object):
         for item in settings['plotted-channels']:
             self._plotted_channels.append(self._devices[item[1]].channels[item[0]])
 
+        if 'snapshot' in settings:
+            self.set_snapshot_group(settings['snapshot']['devices'], settings['snapshot']['rate'])
+
     def run(self):
         # self.setup_communication_threads()
         self.update_gui_devices()
@@ -1,46 +1,212 @@
 import h5py
 import numpy as np
+import threading
 import time
 import os
 
 
+# columns of the rows in the buffers and datasets
+COLUMNS = ('timestamp', 'value', 't_start', 't_end')
+
+# version of the file layout, in the file's 'format_version' attribute. 1: (N, 2) (timestamp, value)
+# datasets resized row by row, 2: COLUMNS, chunked datasets with a 'length' attribute
+FORMAT_VERSION = 2
+
+
+class ChannelBuffer(object):
+    """ Preallocated rows (see COLUMNS) of one channel waiting to be written to the file """
+
+    def __init__(self, capacity):
+        self._rows = np.empty((capacity, len(COLUMNS)), dtype=float)
+        self._count = 0
+        self._dropped = 0
+
+    @property
+    def count(self):
+        return self._count
+
+    @property
+    def dropped(self):
+        return self._dropped
+
+    def append(self, timestamp, value, t_start=np.nan, t_end=np.nan):
+        """ Returns False (and counts the sample as dropped) if the buffer is full """
+        if self._count == len(self._rows):
+            self._dropped += 1
+            return False
+
+        self._rows[self._count] = (timestamp, value, t_start, t_end)
+        self._count += 1
+
+        return True
+
+    def take(self):
+        """ Returns a copy of the buffered rows and empties the buffer """
+        rows = self._rows[:self._count].copy()
+        self._count = 0
+
+        return rows
+
+
 class DataLogger(object):
-    def __init__(self, filename):
+    """
+    Logs the channel values to an hdf5 file. log_value only puts the value into the channel's buffer,
+    a background thread writes the buffers to the file every flush_interval seconds, or as soon as
+    flush_size values are waiting. The datasets grow in whole chunks, their 'length' attribute holds
+    the number of valid rows (the datasets are trimmed to it on close). The rows are (timestamp, value,
+    t_start, t_end), t_start/t_end being the time the server sent the query and got the response (NaN
+    if unknown), their names are in the datasets' 'columns' attribute, the layout version in the file's
+    'format_version' attribute. If the writer can't keep up,
+    values that don't fit into a full channel buffer are dropped and counted (see stats).
+    """
+
+    def __init__(self, filename, flush_interval=1.0, flush_size=4096, buffer_size=65536, chunk_size=1024):
         self._h5fn = filename
         self._h5file = None
         self._data_set = {}
         self._main_group = None
 
+        self._flush_interval = flush_interval  # (s)
+        self._flush_size = flush_size  # number of values
+        self._buffer_size = buffer_size  # values per channel
+        self._chunk_size = chunk_size  # rows
+
+        self._buffers = {}  # (dev_name, ch_name) -> ChannelBuffer
+        self._pending = 0
+        self._condition = threading.Condition()
+
+        self._writer = None
+        self._terminate = False
+
+        self._written = 0
+        self._flushes = 0
+        self._reported_drops = 0
+
+    @property
+    def stats(self):
+        with self._condition:
+            dropped = sum(buffer.dropped for buffer in self._buffers.values())
+
+            return {'written': self._written,
+                    'pending': self._pending,
+                    'dropped': dropped,
+                    'flushes': self._flushes}
+
     def initialize(self):
         if not os.path.exists(os.path.dirname(self._h5fn)):
             os.makedirs(os.path.dirname(self._h5fn))
         self._h5file = h5py.File(self._h5fn, "w")
+        self._h5file.attrs['format_version'] = FORMAT_VERSION
+        self._h5file.attrs['columns'] = ', '.join(COLUMNS)
         self._main_group = self._h5file.create_group("mist1_control_system")
 
+        self._terminate = False
+        self._writer = threading.Thread(target=self._write_loop, name='DataLogger', daemon=True)
+        self._writer.start()
+
     def add_device(self, dev_name):
-        if dev_name not in self._main_group.keys():
-            self._main_group.create_group(dev_name)
+        # the groups are created by the writer thread
+        pass
 
     def add_channel(self, dev_name, ch_name):
+        with self._condition:
+            if (dev_name, ch_name) not in self._buffers:
+                self._buffers[(dev_name, ch_name)] = ChannelBuffer(self._buffer_size)
+
+    def log_value(self, dev_name, ch_name, ch_value, timestamp, t_start=np.nan, t_end=np.nan):
+
+        if ch_value is None:
+            return
+
+        with self._condition:
+            try:
+                buffer = self._buffers[(dev_name, ch_name)]
+            except KeyError:
+                buffer = self._buffers[(dev_name, ch_name)] = ChannelBuffer(self._buffer_size)
+
+            if buffer.append(timestamp, ch_value, t_start, t_end):
+                self._pending += 1
+
+                if self._pending >= self._flush_size:
+                    self._condition.notify()
+
+    def close(self):
+        """ Writes everything that is still buffered and closes the file """
+        with self._condition:
+            self._terminate = True
+            self._condition.notify()
+
+        if self._writer is not None:
+            self._writer.join()
+            self._writer = None
+
+        if self._h5file is not None:
+            for dset in self._data_set.values():
+                dset.resize((dset.attrs['length'], len(COLUMNS)))
+
+            self._h5file.close()
+            self._h5file = None
+
+    def _write_loop(self):
+        while True:
+            with self._condition:
+                if not self._terminate and self._pending < self._flush_size:
+                    self._condition.wait(self._flush_interval)
+
+                terminate = self._terminate
+                rows = {key: buffer.take() for key, buffer in self._buffers.items() if buffer.count > 0}
+                self._pending = 0
+
+            try:
+                self._write(rows)
+            except Exception as e:
+                print("Exception '{}' caught while writing to the log file.".format(e))
+
+            if terminate:
+                break
+
+    def _get_data_set(self, dev_name, ch_name):
+        dataset_name = "{}/{}/{}".format(self._main_group.name, dev_name, ch_name)
+
+        if dataset_name not in self._data_set:
+            if dev_name not in self._main_group.keys():
+                self._main_group.create_group(dev_name)
+
+            dset = self._main_group[dev_name].create_dataset(ch_name, (0, len(COLUMNS)),
+                                                             maxshape=(None, len(COLUMNS)),
+                                                             chunks=(self._chunk_size, len(COLUMNS)),
+                                                             dtype=float, fillvalue=np.nan,
+                                                             compression="gzip")
+            dset.attrs['length'] = 0
+            dset.attrs['columns'] = ', '.join(COLUMNS)
+            self._data_set[dataset_name] = dset
+
+        return self._data_set[dataset_name]
 
-        self.add_device(dev_name)
+    def _write(self, rows):
+        if not rows:
+            return
 
-        if ch_name not in self._main_group[dev_name].keys():
-            dset = self._main_group[dev_name].create_dataset(ch_name, (1, 2), maxshape=(None, 2),
-                                                             dtype=float, compression="gzip")
-            self._data_set[dset.name] = dset
+        for (dev_name, ch_name), data in rows.items():
+            dset = self._get_data_set(dev_name, ch_name)
 
-    def log_value(self, dev_name, ch_name, ch_value, timestamp):
+            length = int(dset.attrs['length'])
+            new_length = length + len(data)
 
-        self.add_channel(dev_name, ch_name)
+            if new_length > len(dset):
+                # grow by whole chunks, not row by row
+                chunks = -(-new_length // self._chunk_size)
+                dset.resize((chunks * self._chunk_size, len(COLUMNS)))
 
-        if ch_value is not None:
-            dataset_name = "{}/{}/{}".format(self._main_group.name, dev_name, ch_name)
-            dset = self._data_set[dataset_name]
+            dset[length:new_length] = data
+            dset.attrs['length'] = new_length
 
-            dset.resize((len(dset) + 1, 2))
+            self._written += len(data)
 
-            a = (timestamp, ch_value)
-            dset[len(dset) - 1] = a
+        self._h5file.flush()
+        self._flushes += 1
 
-            self._h5file.flush()
+        dropped = self.stats['dropped']
+        if dropped > self._reported_drops:
+            print("DataLogger can't keep up, dropped {} values so far.".format(dropped))
+            self._reported_drops = dropped
@@ -0,0 +1,153 @@
+import numpy as np
+
+from .RingBuffer import RingBuffer
+
+
+class MinMaxPyramid(object):
+    """
+    Level of detail for plotting a long (timestamp, value) history. Level k holds the min/max envelope
+    of buckets of base_bucket * 2**k samples and is updated incrementally with every appended sample.
+    data_for_view picks the coarsest level that still has at least one bucket per pixel in the visible
+    x range, so a plot never gets (many) more points than it is wide. The raw samples stay in the
+    history RingBuffer, which the pyramid only reads.
+    """
+
+    def __init__(self, history, base_bucket=4, min_buckets=16):
+        self._history = history
+        self._base_bucket = base_bucket
+        self._min_buckets = min_buckets
+
+        self._bucket_sizes = []
+        self._levels = []  # RingBuffers of (first timestamp, min, max) per bucket
+        self._partial = []  # incomplete bucket per level: [first timestamp, min, max, count] or None
+        self._covered = []  # number of samples that went into complete buckets of each level
+        self._total = 0  # number of samples appended
+        self._revision = 0  # changes whenever the data changes, plots skip redrawing if it didn't
+
+        self.rebuild()
+
+    @property
+    def levels(self):
+        return len(self._levels)
+
+    @property
+    def revision(self):
+        return self._revision
+
+    def _setup_levels(self):
+        capacity = self._history.capacity
+
+        self._bucket_sizes = []
+        bucket_size = self._base_bucket
+        while capacity // bucket_size >= self._min_buckets:
+            self._bucket_sizes.append(bucket_size)
+            bucket_size *= 2
+
+        self._levels = [RingBuffer(capacity // bucket_size + 1, columns=3) for bucket_size in self._bucket_sizes]
+        self._partial = [None] * len(self._bucket_sizes)
+        self._covered = [0] * len(self._bucket_sizes)
+
+    def rebuild(self):
+        """ Recomputes all levels from the history (after it was resized or cleared) """
+        self._setup_levels()
+        self._revision += 1
+
+        x = self._history.column(0)
+        y = self._history.column(1)
+        n = len(x)
+        self._total = n
+
+        for k, bucket_size in enumerate(self._bucket_sizes):
+            m = n // bucket_size
+
+            if m > 0:
+                buckets = y[:m * bucket_size].reshape(m, bucket_size)
+                self._levels[k].extend(x[:m * bucket_size:bucket_size], buckets.min(axis=1), buckets.max(axis=1))
+
+            self._covered[k] = m * bucket_size
+
+            # samples (level 0) or the bucket of the level below (k > 0) that don't make a full bucket yet
+            if k == 0:
+                rest = slice(m * bucket_size, n)
+            else:
+                previous_buckets = n // self._bucket_sizes[k - 1]
+                rest = slice(m * bucket_size, previous_buckets * self._bucket_sizes[k - 1])
+
+            if rest.stop > rest.start:
+                count = (rest.stop - rest.start) // (bucket_size if k == 0 else self._bucket_sizes[k - 1])
+                self._partial[k] = [x[rest.start], y[rest].min(), y[rest].max(),
+                                    rest.stop - rest.start if k == 0 else count]
+
+    def append(self, x, y):
+        """ Call after appending (x, y) to the history """
+        self._total += 1
+        self._revision += 1
+
+        bucket = [x, y, y, 1]
+
+        for k, bucket_size in enumerate(self._bucket_sizes):
+            partial = self._partial[k]
+
+            if partial is None:
+                self._partial[k] = partial = bucket
+            else:
+                partial[1] = min(partial[1], bucket[1])
+                partial[2] = max(partial[2], bucket[2])
+                partial[3] += 1
+
+            # level 0 collects base_bucket samples, all others two buckets of the level below
+            if partial[3] < (self._base_bucket if k == 0 else 2):
+                break
+
+            self._levels[k].append(partial[0], partial[1], partial[2])
+            self._covered[k] += bucket_size
+            self._partial[k] = None
+
+            bucket = [partial[0], partial[1], partial[2], 1]
+
+    def data_for_view(self, x_min=None, x_max=None, pixels=None):
+        """
+        Returns (x, y) to plot for the x range [x_min, x_max] (None = everything) on a plot that is
+        pixels wide: the raw samples if there are few enough (or pixels is None), otherwise the min/max
+        envelope as alternating (timestamp, min), (timestamp, max) points.
+        """
+        x = self._history.column(0)
+        y = self._history.column(1)
+
+        if len(x) == 0:
+            return x, y
+
+        first = 0 if x_min is None else max(0, np.searchsorted(x, x_min, side='left') - 1)
+        last = len(x) if x_max is None else min(len(x), np.searchsorted(x, x_max, side='right') + 1)
+        visible = last - first
+
+        if pixels is None or visible <= 2 * max(1, int(pixels)) or not self._levels:
+            return x[first:last], y[first:last]
+
+        # coarsest level with at least one bucket per pixel
+        pixels = max(1, int(pixels))
+        k = 0
+        while k + 1 < len(self._bucket_sizes) and visible // self._bucket_sizes[k + 1] >= pixels:
+            k += 1
+
+        level = self._levels[k]
+        bucket_x = level.column(0)
+
+        # only buckets whose samples are still in the history and visible
+        start = np.searchsorted(bucket_x, max(x[0], x[first]), side='left')
+        stop = np.searchsorted(bucket_x, x[last - 1], side='right')
+
+        envelope_x = np.repeat(bucket_x[start:stop], 2)
+        envelope_y = np.empty(len(envelope_x))
+        envelope_y[0::2] = level.column(1)[start:stop]
+        envelope_y[1::2] = level.column(2)[start:stop]
+
+        # raw samples before the first complete bucket that is still in the history
+        head_stop = np.searchsorted(x, bucket_x[start], side='left') if stop > start else first
+
+        # the newest samples that are not in a complete bucket of this level yet
+        tail = min(self._total - self._covered[k], len(x))
+        tail_start = max(len(x) - tail, first)
+
+        return (np.concatenate((x[first:head_stop], envelope_x, x[tail_start:last])),
+                np.concatenate((y[first:head_stop], envelope_y, y[tail_start:last])))
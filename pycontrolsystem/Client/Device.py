@@ -147,6 +147,7 @@ class Device(QObject):
         self._error_message = ''
         self._retry_time = 30
         self._polling_rate = 0.0  # Hz
+        self._polling_rate_target = None  # Hz, the rate the server negotiated with the device
 
         self._entry_form = EntryForm(self._label, '', self.user_edit_properties(), self)
         self._entry_form.sig_save.connect(self.save_changes)
@@ -288,8 +289,26 @@ class Device(QObject):
     @polling_rate.setter
     def polling_rate(self, value):
         self._polling_rate = value
-        if self._initialized:
+        self.update_polling_rate_label()
+
+    @property
+    def polling_rate_target(self):
+        return self._polling_rate_target
+
+    @polling_rate_target.setter
+    def polling_rate_target(self, value):
+        self._polling_rate_target = value
+        self.update_polling_rate_label()
+
+    def update_polling_rate_label(self):
+        if not self._initialized:
+            return
+
+        if self._polling_rate_target is None:
             self._polling_rate_label.setText('Polling rate: {0:.2f} Hz'.format(self._polling_rate))
+        else:
+            self._polling_rate_label.setText('Polling rate: {0:.2f} Hz (target {1:.2f} Hz)'.format(
+                self._polling_rate, self._polling_rate_target))
 
     @property
     def error_message(self):
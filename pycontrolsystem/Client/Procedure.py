@@ -85,7 +85,7 @@ class Procedure(QObject):
 class BasicProcedure(Procedure):
 
     _sig_trigger = pyqtSignal(object)
-    _sig_set = pyqtSignal(object, float)
+    _sig_set = pyqtSignal(object, float, str)
     _sig_send_slack = pyqtSignal(str)
 
     def __init__(self,
@@ -122,6 +122,14 @@ class BasicProcedure(Procedure):
 
         self._running = False
 
+        # the server has this procedure as an interlock and does the actions when the rules are met,
+        # the client only shows it and sends the notifications
+        self._server_side = False
+        self._skip_actions = False
+
+        # last result of each rule, only rules whose channel changed are evaluated again
+        self._rule_results = {}
+
         # if the procedure condition is met and the procedure activates,
         # it shouldn't activate again until the condition has been un-met
         self._tripped = False
@@ -164,6 +172,10 @@ class BasicProcedure(Procedure):
 
         return list(devices)
 
+    def rule_channels(self):
+        """ Only return the channels used in this procedure's rules """
+        return {rule['channel'] for idx, rule in self._rules.items()}
+
     def devices_channels_used(self):
         devices = set()
         channels = set()
@@ -209,12 +221,32 @@ class BasicProcedure(Procedure):
     def triggertype(self):
         return self._triggertype
 
-    def should_perform_procedure(self):
-        condition_satisfied = True
-        for arduino_id, rule in self._rules.items():
-            if not rule['comp'](rule['channel'].value, rule['value']):
-                condition_satisfied = False
-                break
+    @property
+    def priority(self):
+        """ Priority of this procedure's set commands in the server's set command queue """
+        if self._triggertype == 'emstop':
+            return 'emergency'
+
+        return 'interlock'
+
+    @property
+    def server_side(self):
+        return self._server_side
+
+    @server_side.setter
+    def server_side(self, server_side):
+        self._server_side = server_side
+
+    def should_perform_procedure(self, changed_channels=None):
+        """
+        Evaluates the rules. If changed_channels is given, only the rules of those channels are evaluated
+        again, the others keep their last result
+        """
+        for idx, rule in self._rules.items():
+            if changed_channels is None or idx not in self._rule_results or rule['channel'] in changed_channels:
+                self._rule_results[idx] = rule['comp'](rule['channel'].value, rule['value'])
+
+        condition_satisfied = all(self._rule_results[idx] for idx in self._rules.keys())
 
         if not condition_satisfied:
             self._tripped = False
@@ -223,9 +255,11 @@ class BasicProcedure(Procedure):
 
         return condition_satisfied
 
-    def do_actions(self):
+    def do_actions(self, triggered_by_rules=False):
         """ pre-function to set up the action running of this procedure """
         if not self._running and not self._tripped:
+            # if the rules triggered it, the server already did the actions
+            self._skip_actions = triggered_by_rules and self._server_side
             self._tripped = True
             self._btnReset.setEnabled(True)
             self._btnTrigger.setEnabled(False)
@@ -235,10 +269,12 @@ class BasicProcedure(Procedure):
     def run_procedure(self):
         """ To be run in a separate thread. Set values as specified by user """
         for arduino_id, action in self._actions.items():
+            if self._skip_actions:
+                break
 
             time.sleep(action['delay'])
 
-            self._sig_set.emit(action['channel'], action['value'])
+            self._sig_set.emit(action['channel'], action['value'], self.priority)
 
         # Handle notifications
         if self.notifications["email"]:
@@ -0,0 +1,85 @@
+import numpy as np
+
+
+class RingBuffer(object):
+    """
+    Fixed capacity history of one or more columns of float64 values (e.g. timestamps and values of a
+    channel). Every value is written twice, at i and i + capacity, so the last n values of a column are
+    always one contiguous slice of the underlying array and column() can return a view instead of a copy.
+    The views are only valid until the next append/resize/clear.
+    """
+
+    def __init__(self, capacity, columns=1):
+        self._capacity = max(1, int(capacity))
+        self._columns = columns
+        self._data = np.zeros((columns, 2 * self._capacity), dtype=float)
+        self._head = 0  # where the next value is written
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    def append(self, *values):
+        """ Appends one value per column """
+        self._data[:, self._head] = values
+        self._data[:, self._head + self._capacity] = values
+
+        self._head = (self._head + 1) % self._capacity
+        self._count = min(self._count + 1, self._capacity)
+
+    def extend(self, *columns):
+        """ Appends many values at once, one array per column """
+        columns = np.asarray(columns, dtype=float)
+        n = columns.shape[1]
+
+        if n >= self._capacity:
+            self._data[:, :self._capacity] = columns[:, -self._capacity:]
+            self._data[:, self._capacity:] = columns[:, -self._capacity:]
+            self._head = 0
+            self._count = self._capacity
+            return
+
+        indices = (self._head + np.arange(n)) % self._capacity
+        self._data[:, indices] = columns
+        self._data[:, indices + self._capacity] = columns
+
+        self._head = (self._head + n) % self._capacity
+        self._count = min(self._count + n, self._capacity)
+
+    def column(self, i=0):
+        """ Contiguous view of the values of column i, oldest first """
+        start = (self._head - self._count) % self._capacity
+
+        return self._data[i, start:start + self._count]
+
+    def last(self, i=0):
+        """ The newest value of column i, None if empty """
+        if self._count == 0:
+            return None
+
+        return self._data[i, (self._head - 1) % self._capacity]
+
+    def clear(self):
+        self._head = 0
+        self._count = 0
+
+    def resize(self, capacity):
+        """ Changes the capacity, keeping the newest values that still fit """
+        capacity = max(1, int(capacity))
+        if capacity == self._capacity:
+            return
+
+        kept = [self.column(i)[-capacity:].copy() for i in range(self._columns)]
+        count = len(kept[0])
+
+        self._capacity = capacity
+        self._data = np.zeros((self._columns, 2 * capacity), dtype=float)
+        self._data[:, :count] = kept
+        self._data[:, capacity:capacity + count] = kept
+
+        self._head = count % capacity
+        self._count = count
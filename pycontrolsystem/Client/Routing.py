@@ -0,0 +1,60 @@
+import numpy as np
+
+
+class RoutingTable(object):
+    """
+    Maps (device id, channel name) of the values coming from the server to a column index, built once
+    whenever the devices/channels change. Every column has its device, channel and scaling, so the
+    values of a whole response can be scaled with one numpy operation.
+    """
+
+    def __init__(self, devices=None):
+        self._columns = []  # (device name, device, channel name, channel)
+        self._index = {}  # (device id, channel name) -> column
+        self._scaling = np.ones(0)
+
+        self._schema = None
+        self._schema_columns = []
+
+        if devices is not None:
+            self.build(devices)
+
+    @property
+    def columns(self):
+        return self._columns
+
+    def build(self, devices):
+        """ devices is ControlSystem's {device name: Device} """
+        columns = []
+        index = {}
+
+        for device_name, device in devices.items():
+            for channel_name, channel in device.channels.items():
+                index[(device.device_id, channel_name)] = len(columns)
+                columns.append((device_name, device, channel_name, channel))
+
+        scaling = np.array([channel.scaling for _, _, _, channel in columns], dtype=float)
+
+        # may be called from the retry thread, swap everything at once
+        self._columns, self._index, self._scaling, self._schema = columns, index, scaling, None
+
+    def column(self, device_id, channel_name):
+        """ Column of the channel, -1 if there is no such channel """
+        return self._index.get((device_id, channel_name), -1)
+
+    def schema_columns(self, schema):
+        """
+        For a WireFormat/SampleRing schema: list (per device index) of arrays that map the schema's
+        channel indices to columns (-1 for unknown channels)
+        """
+        if schema is not self._schema:
+            self._schema = schema
+            self._schema_columns = [np.array([self.column(device_id, channel_name) for channel_name in channels],
+                                             dtype=int)
+                                    for device_id, channels in zip(schema['devices'], schema['channels'])]
+
+        return self._schema_columns
+
+    def scale(self, columns, values):
+        """ Scales the raw values of the server back to channel values """
+        return np.asarray(values, dtype=float) / self._scaling[columns]
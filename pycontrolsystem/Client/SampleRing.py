@@ -0,0 +1,196 @@
+import numpy as np
+from multiprocessing import shared_memory
+
+# One channel value. channel == METADATA_POLLING_RATE: value is the polling rate of the device,
+# channel == METADATA_POLLING_RATE_TARGET: the polling rate the server negotiated with the device.
+# timestamp is the server's timestamp of the sample (the barrier time for snapshot groups), t_start and
+# t_end the wall clock time the query went out and its response was complete (NaN if unknown)
+sample_dtype = np.dtype([('device', '<u2'), ('channel', '<u2'), ('timestamp', '<f8'), ('t_start', '<f8'),
+                         ('t_end', '<f8'), ('value', '<f8')])
+
+METADATA_POLLING_RATE = 0xFFFF
+METADATA_POLLING_RATE_TARGET = 0xFFFE
+METADATA_MIN = METADATA_POLLING_RATE_TARGET  # channel indices from here on are metadata
+
+# the header holds the sequence number of the next record to write
+_header_dtype = np.dtype('<u8')
+
+
+class SampleRing(object):
+    """
+    Ring of sample records in shared memory. The query process writes the values it gets from the
+    server into it and only sends the new sequence number through the pipe, the GUI reads the records
+    between the last and the new sequence number without copying or unpickling anything.
+    There is one writer and one reader. If the reader falls more than capacity records behind, the
+    oldest records are lost (and counted).
+    """
+
+    def __init__(self, capacity=65536, name=None):
+        self._capacity = capacity
+        size = _header_dtype.itemsize + capacity * sample_dtype.itemsize
+
+        if name is None:
+            self._shm = shared_memory.SharedMemory(create=True, size=size)
+            self._owner = True
+        else:
+            self._shm = _attach(name)
+            self._owner = False
+
+        self._header = np.ndarray((1,), dtype=_header_dtype, buffer=self._shm.buf)
+        self._records = np.ndarray((capacity,), dtype=sample_dtype, buffer=self._shm.buf,
+                                   offset=_header_dtype.itemsize)
+
+        if self._owner:
+            self._header[0] = 0
+
+        self._lost = 0
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    @property
+    def sequence(self):
+        """ Sequence number of the next record that will be written """
+        return int(self._header[0])
+
+    @property
+    def lost(self):
+        return self._lost
+
+    def write(self, records):
+        """ Writes the records (array of sample_dtype) and returns the new sequence number """
+        sequence = int(self._header[0])
+        records = records[-self._capacity:]
+        n = len(records)
+
+        start = sequence % self._capacity
+        first = min(n, self._capacity - start)
+        self._records[start:start + first] = records[:first]
+        self._records[:n - first] = records[first:]
+
+        sequence += n
+        self._header[0] = sequence
+
+        return sequence
+
+    def read(self, start, stop):
+        """
+        Returns the records start <= sequence number < stop. This is a view into the shared memory,
+        unless the range wraps around the end of the ring.
+        """
+        # records older than this have been overwritten by the writer already
+        oldest = int(self._header[0]) - self._capacity
+
+        if start < oldest:
+            self._lost += min(oldest, stop) - start
+            start = min(oldest, stop)
+
+        first = start % self._capacity
+        n = stop - start
+
+        if first + n <= self._capacity:
+            return self._records[first:first + n]
+
+        return np.concatenate((self._records[first:], self._records[:first + n - self._capacity]))
+
+    def close(self):
+        # drop our views of the buffer first, SharedMemory can't close while they exist
+        self._header = None
+        self._records = None
+        self._shm.close()
+
+        if self._owner:
+            self._shm.unlink()
+
+
+def _attach(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13 registers the block with the resource tracker again when attaching, which
+        # would unlink it when this process exits. Only the process that created it should do that.
+        shm = shared_memory.SharedMemory(name=name)
+        try:
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        except (ImportError, AttributeError):
+            pass
+
+        return shm
+
+
+def records_from_response(parsed_response, device_indices, channel_indices, timestamp):
+    """
+    Turns a /device/query style response {device id: {channel name: value, ...}} into sample records.
+    device_indices maps device ids to device indices, channel_indices[device index] channel names to
+    channel indices. The records get the server's timestamp of the device's values, timestamp (the
+    time the response was received) only if there is none. Returns (records, {device id: error message}).
+    """
+    rows = []
+    errors = {}
+
+    for device_id, values in parsed_response.items():
+        try:
+            device_index = device_indices[device_id]
+        except KeyError:
+            continue
+
+        if not isinstance(values, dict):
+            errors[device_id] = values
+            continue
+
+        indices = channel_indices[device_index]
+        sample_time = (values.get('timestamp', timestamp),
+                       values.get('t_start', np.nan), values.get('t_end', np.nan))
+
+        for channel_name, value in values.items():
+            if channel_name == 'polling_rate':
+                rows.append((device_index, METADATA_POLLING_RATE) + sample_time + (value,))
+            elif channel_name == 'polling_rate_target':
+                rows.append((device_index, METADATA_POLLING_RATE_TARGET) + sample_time + (value,))
+            elif channel_name in indices:
+                try:
+                    rows.append((device_index, indices[channel_name]) + sample_time + (float(value),))
+                except (TypeError, ValueError):
+                    errors[device_id] = "ERROR: Got '{}' for channel {}".format(value, channel_name)
+
+    return np.array(rows, dtype=sample_dtype), errors
+
+
+def records_from_frames(frames, timestamp):
+    """
+    Turns decoded WireFormat data frames into sample records, with the server's timestamp of each frame
+    (timestamp, the time the frames were received, only if a frame has none).
+    Returns (records, [(device index, error message), ...]).
+    """
+    parts = []
+    errors = []
+
+    for frame in frames:
+        if frame[0] == 'error':
+            errors.append((frame[1], frame[2]))
+            continue
+
+        _, device_index, frame_timestamp, polling_rate, channel_indices, values, t_start, t_end = frame
+
+        records = np.empty(len(values) + 1, dtype=sample_dtype)
+        records['device'] = device_index
+        records['timestamp'] = frame_timestamp if frame_timestamp > 0.0 else timestamp
+        records['t_start'] = t_start
+        records['t_end'] = t_end
+        records['channel'][0] = METADATA_POLLING_RATE
+        records['value'][0] = polling_rate
+        records['channel'][1:] = channel_indices
+        records['value'][1:] = values
+
+        parts.append(records)
+
+    if not parts:
+        return np.empty(0, dtype=sample_dtype), errors
+
+    return np.concatenate(parts), errors
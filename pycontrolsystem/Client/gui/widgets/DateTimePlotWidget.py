@@ -46,12 +46,39 @@ class DateTimePlotWidget(pg.PlotWidget):
 
         self._settings = settings
         self._curve = self.plot()
+
+        # (data revision, view) of the last set_lod_data, to skip redrawing if nothing changed
+        self._drawn = None
         self.update_settings()
 
     @property
     def curve(self):
         return self._curve
 
+    def set_lod_data(self, lod):
+        """
+        Plots the data of a MinMaxPyramid at the resolution of the current view. Does nothing if neither
+        the data nor the view changed since the last call, and the cost of a redraw depends on the width
+        of the plot, not on the length of the history.
+        """
+        drawn = (lod, lod.revision, tuple(self.viewRange()[0]), self.getViewBox().width())
+        if drawn == self._drawn:
+            return
+
+        self._drawn = drawn
+
+        if self._settings is not None and self._settings['x']['log']:
+            # view range is in log10 units, just plot everything
+            x, y = lod.data_for_view()
+        elif self.getViewBox().autoRangeEnabled()[0]:
+            # the view follows the data, so everything will be visible
+            x, y = lod.data_for_view(pixels=self.getViewBox().width())
+        else:
+            x_min, x_max = self.viewRange()[0]
+            x, y = lod.data_for_view(x_min, x_max, pixels=self.getViewBox().width())
+
+        self._curve.setData(x, y, clear=True, _callsync='off')
+
     @property
     def settings(self):
         return self._settings
@@ -62,6 +89,8 @@ class DateTimePlotWidget(pg.PlotWidget):
         self.update_settings()
 
     def update_settings(self):
+        self._drawn = None
+
         if self._settings is None:
             return
 
@@ -0,0 +1,131 @@
+import heapq
+import itertools
+import queue
+import threading
+import time
+
+# lower number = sent first
+PRIORITY_EMERGENCY = 0
+PRIORITY_INTERLOCK = 1
+PRIORITY_USER = 2
+
+priorities = {'emergency': PRIORITY_EMERGENCY,
+              'interlock': PRIORITY_INTERLOCK,
+              'user': PRIORITY_USER}
+
+
+class _QueuedCommand(object):
+
+    def __init__(self, key, cmd, priority, sequence, enqueued=None):
+        self.key = key
+        self.cmd = cmd
+        self.priority = priority
+        self.sequence = sequence
+        self.enqueued = time.monotonic() if enqueued is None else enqueued
+        self.removed = False
+
+        # [cmd, priority, enqueued] of a less urgent set to the same channels that came in meanwhile
+        self.followup = None
+
+    def __lt__(self, other):
+        return (self.priority, self.sequence) < (other.priority, other.sequence)
+
+
+class SetCommandQueue(object):
+    """
+    Replaces the FIFO set command queue of a DeviceManager. Commands come out by priority (emergency
+    stop, then interlock actions, then user sets), FIFO within the same priority.
+    A set to the same channels as a command that is still waiting (dial drags, PID output) replaces
+    the value of that command instead of queueing another one, so only the latest value gets sent.
+    There is only one entry per channels in the queue, at the most urgent priority. A less urgent set
+    never replaces a more urgent value, it is kept as the entry's follow-up (coalesced the same way)
+    and queued at its own priority once the urgent value was sent.
+    Same interface as the queue.Queue it replaces (put, get_nowait, empty, qsize).
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._pending = {}  # (device id, channel ids) -> _QueuedCommand still in the heap
+        self._count = 0  # commands waiting, follow-ups included
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def command_key(cmd):
+        return cmd['device_id'], tuple(cmd['channel_ids'])
+
+    def put(self, cmd, priority=PRIORITY_USER):
+        """ Returns True if the command replaced the value of a waiting one """
+        key = self.command_key(cmd)
+
+        with self._lock:
+            queued = self._pending.get(key)
+
+            if queued is None:
+                self._push(_QueuedCommand(key, cmd, priority, next(self._sequence)))
+                self._count += 1
+                return False
+
+            if priority == queued.priority:
+                queued.cmd = cmd
+                return True
+
+            if priority > queued.priority:
+                if queued.followup is None:
+                    queued.followup = [cmd, priority, time.monotonic()]
+                    self._count += 1
+                    return False
+
+                queued.followup[0] = cmd
+                queued.followup[1] = min(priority, queued.followup[1])
+                return True
+
+            # more urgent now: move it up, but keep its age. The follow-up came in before this set.
+            queued.removed = True
+            if queued.followup is not None:
+                self._count -= 1
+
+            self._push(_QueuedCommand(key, cmd, priority, next(self._sequence), queued.enqueued))
+
+        return True
+
+    def _push(self, queued):
+        self._pending[queued.key] = queued
+        heapq.heappush(self._heap, queued)
+
+    def get_nowait(self):
+        """ Returns (cmd, age in s) of the most urgent command, raises queue.Empty if there is none """
+        with self._lock:
+            while self._heap:
+                queued = heapq.heappop(self._heap)
+
+                if queued.removed:
+                    continue
+
+                del self._pending[queued.key]
+                self._count -= 1
+
+                if queued.followup is not None:
+                    followup_cmd, priority, enqueued = queued.followup
+                    self._push(_QueuedCommand(queued.key, followup_cmd, priority, next(self._sequence), enqueued))
+
+                return queued.cmd, time.monotonic() - queued.enqueued
+
+        raise queue.Empty
+
+    def empty(self):
+        return self.qsize() == 0
+
+    def qsize(self):
+        return self._count
+
+    def oldest_age(self):
+        """ (s) How long the oldest waiting command has been waiting, 0 if the queue is empty """
+        with self._lock:
+            ages = [queued.enqueued for queued in self._heap if not queued.removed] + \
+                [queued.followup[2] for queued in self._pending.values() if queued.followup is not None]
+
+        if not ages:
+            return 0.0
+
+        return time.monotonic() - min(ages)
@@ -1,7 +1,8 @@
 # This file contains classes which handle locating device information
 # from various sources on the server computer.
 
-import subprocess
+import os
+import re
 import usb.core
 import platform
 
@@ -9,8 +10,112 @@ import platform
 # noinspection PyPackageRequirements
 from serial.tools import list_ports
 
+try:
+    import pyudev
+except ImportError:
+    pyudev = None
+
 myplatform = platform.platform()
 
+_sys_class_tty = '/sys/class/tty'
+_sys_usb_devices = '/sys/bus/usb/devices'
+
+
+class HotplugMonitor(object):
+    """
+    Tells whether devices of a subsystem were added/removed since the last call, from the kernel's
+    udev (netlink) events. Needs pyudev, available is False without it.
+    """
+
+    def __init__(self, subsystem):
+        self._monitor = None
+        self._first = True
+
+        if pyudev is None:
+            return
+
+        try:
+            monitor = pyudev.Monitor.from_netlink(pyudev.Context())
+            monitor.filter_by(subsystem)
+            monitor.start()
+            self._monitor = monitor
+        except Exception as e:
+            print("Unable to listen to udev events ({}), scanning sysfs instead.".format(e))
+
+    @property
+    def available(self):
+        return self._monitor is not None
+
+    def changed(self):
+        if self._first:
+            self._first = False
+            return True
+
+        changed = False
+        while self._monitor.poll(timeout=0) is not None:
+            changed = True
+
+        return changed
+
+
+def _read_attribute(path, name):
+    """ Contents of a sysfs attribute file, None if it doesn't exist """
+    try:
+        with open(os.path.join(path, name)) as f:
+            return f.read().strip()
+    except (IOError, OSError, UnicodeDecodeError):
+        return None
+
+
+def _udev_string(value):
+    """ Like udev's usb_id: whitespace becomes '_', and so does everything udev doesn't allow """
+    value = '_'.join(value.split())
+
+    return re.sub(r'[^0-9A-Za-z#+\-.:=@_]', '_', value)
+
+
+def usb_id_serial(usb_device_path):
+    """ Emulates the ID_SERIAL udev property (vendor_model[_serial]) of a USB device from its sysfs attributes """
+    vendor = _read_attribute(usb_device_path, 'manufacturer') or _read_attribute(usb_device_path, 'idVendor') or ''
+    model = _read_attribute(usb_device_path, 'product') or _read_attribute(usb_device_path, 'idProduct') or ''
+    serial = _read_attribute(usb_device_path, 'serial')
+
+    id_serial = '{}_{}'.format(_udev_string(vendor), _udev_string(model))
+
+    if serial:
+        id_serial += '_' + _udev_string(serial)
+
+    return id_serial
+
+
+def _usb_device_of_tty(tty_name):
+    """ sysfs path of the USB device a tty belongs to, None if it's not a USB tty """
+    path = os.path.realpath(os.path.join(_sys_class_tty, tty_name, 'device'))
+
+    while path.startswith('/sys/devices/') and '/usb' in path:
+        if os.path.exists(os.path.join(path, 'idVendor')):
+            return path
+
+        path = os.path.dirname(path)
+
+    return None
+
+
+def _tty_key(tty_name):
+    """
+    (tty name, sysfs link, devnum of its USB device) - devnum changes on every plug, so a different
+    device on the same port (same name and link) gets a different key
+    """
+    link = os.readlink(os.path.join(_sys_class_tty, tty_name))
+    devnum = None
+
+    if '/usb' in link:
+        usb_device_path = _usb_device_of_tty(tty_name)
+        if usb_device_path is not None:
+            devnum = _read_attribute(usb_device_path, 'devnum')
+
+    return tty_name, link, devnum
+
 
 class DeviceFinder(object):
 
@@ -18,6 +123,7 @@ class DeviceFinder(object):
         self._identifiers = identifiers
         self._current_devices = {}
         self._name = 'BASE'
+        self._force_rescan = True
 
     def find_devices(self):
         raise NotImplementedError("Subclasses should implement this!")
@@ -29,6 +135,8 @@ class DeviceFinder(object):
     @identifiers.setter
     def identifiers(self, val):
         self._identifiers = val
+        # devices have to be matched against the new identifiers
+        self._force_rescan = True
 
     @property
     def name(self):
@@ -36,29 +144,82 @@ class DeviceFinder(object):
 
 
 class SerialDeviceFinderLinux(DeviceFinder):
+    """
+    Finds USB serial ports from sysfs (/sys/class/tty) instead of running usb.sh, which forked udevadm
+    twice per USB node on every call. The ID_SERIAL of every port is read once and cached, and the ports
+    are only rescanned if udev reported a change (with pyudev) or the list of ttys changed. The cache is
+    keyed by tty name, sysfs link and USB devnum, so a replugged device is never taken for the old one.
+    """
 
     def __init__(self, identifiers):
         DeviceFinder.__init__(self, identifiers)
         self._name = 'serial'
 
+        self._monitor = HotplugMonitor('tty')
+        self._signature = None
+        self._id_serials = {}  # (tty name, sysfs link, devnum) -> (sysfs path of the USB device, ID_SERIAL)
+
+    def _rescan_needed(self):
+        force_rescan, self._force_rescan = self._force_rescan, False
+
+        if self._monitor.available:
+            if self._monitor.changed() or force_rescan:
+                self._id_serials = {}
+                return True
+
+            return False
+
+        # without udev events: the ttys, the devices they link to and the devnums of the USB ones
+        try:
+            signature = tuple(_tty_key(name) for name in sorted(os.listdir(_sys_class_tty)))
+        except OSError:
+            signature = None
+
+        if signature == self._signature and signature is not None and not force_rescan:
+            return False
+
+        self._signature = signature
+
+        return True
+
+    def _usb_ports(self):
+        """ Returns ['<port> - <ID_SERIAL>', ...] like usb.sh did """
+        id_serials = {}
+
+        for name in os.listdir(_sys_class_tty):
+            try:
+                key = _tty_key(name)
+            except OSError:
+                # gone in the meantime
+                continue
+
+            if key in self._id_serials:
+                id_serials[key] = self._id_serials[key]
+                continue
+
+            usb_device_path = _usb_device_of_tty(name)
+            if usb_device_path is not None:
+                id_serials[key] = (usb_device_path, usb_id_serial(usb_device_path))
+
+        self._id_serials = id_serials
+
+        return ['/dev/{} - {}'.format(key[0], id_serial) for key, (_, id_serial) in sorted(id_serials.items())]
+
     def find_devices(self):
         # _device_added = False
         # _device_removed = False
 
+        if not self._rescan_needed():
+            return {'current': self._current_devices, 'added': {}, 'obsolete': {}}
+
         # local dictionaries to hold intermediate values
         _device_ids = list(self._current_devices.keys())
         _found_devices_by_ids = {}
         _obsolete_devices_by_ids = {}
         _added_devices_by_ids = {}
 
-        # this device finder opens a shell script to return device-port pairs
-        proc = subprocess.Popen('/home/pi/RasPiServer_v5/usb.sh',
-                                stdout=subprocess.PIPE, shell=True)
-
-        output = proc.stdout.read().strip()
-
         # Loop through all found devices and add them to a new list, remove them from the current list
-        for line in output.decode().split("\n"):
+        for line in self._usb_ports():
             # Go through all identifiers and see if one is found in this serial port
             _identifier = [identifier for identifier in self._identifiers.keys() if identifier in line]
 
@@ -155,11 +316,21 @@ class SerialDeviceFinderWindows(DeviceFinder):
 
 
 class FTDIDeviceFinder(DeviceFinder):
+    """
+    Finds the devices with ftdi_info by vendor/product id. On Linux the USB devices are read from sysfs
+    (only when udev reported a change or the list of devices changed, attributes are cached by sysfs name
+    and devnum), elsewhere PyUSB enumerates the bus.
+    """
 
     def __init__(self, identifiers):
         DeviceFinder.__init__(self, identifiers)
         self._name = 'ftdi'
 
+        self._use_sysfs = os.path.isdir(_sys_usb_devices)
+        self._monitor = HotplugMonitor('usb') if self._use_sysfs else None
+        self._signature = None
+        self._usb_devices = {}  # (sysfs name, devnum) -> (vendor/product id, bus, address)
+
         self._vend_prod_list = {}
         for name, info in self._identifiers.items():
             try:
@@ -168,25 +339,85 @@ class FTDIDeviceFinder(DeviceFinder):
                 # driver does not have ftdi field
                 pass
 
+    def _rescan_needed(self):
+        force_rescan, self._force_rescan = self._force_rescan, False
+
+        if not self._use_sysfs:
+            return True
+
+        if self._monitor.available:
+            if self._monitor.changed() or force_rescan:
+                self._usb_devices = {}
+                return True
+
+            return False
+
+        # a device replugged on the same port has the same sysfs name, but a new devnum
+        try:
+            signature = tuple((name, _read_attribute(os.path.join(_sys_usb_devices, name), 'devnum'))
+                              for name in sorted(os.listdir(_sys_usb_devices)) if ':' not in name)
+        except OSError:
+            signature = None
+
+        if signature == self._signature and signature is not None and not force_rescan:
+            return False
+
+        self._signature = signature
+
+        return True
+
+    def _sysfs_usb_devices(self):
+        """ Returns [(vendor/product id, bus, address), ...] of all USB devices """
+        usb_devices = {}
+
+        for name in os.listdir(_sys_usb_devices):
+            if ':' in name:
+                # interface, not a device
+                continue
+
+            path = os.path.join(_sys_usb_devices, name)
+            devnum = _read_attribute(path, 'devnum')
+            key = (name, devnum)
+
+            if key in self._usb_devices:
+                usb_devices[key] = self._usb_devices[key]
+                continue
+
+            try:
+                vend_prod = (int(_read_attribute(path, 'idVendor'), 16), int(_read_attribute(path, 'idProduct'), 16))
+                usb_devices[key] = (vend_prod, int(_read_attribute(path, 'busnum')), int(devnum))
+            except (TypeError, ValueError):
+                continue
+
+        self._usb_devices = usb_devices
+
+        return list(usb_devices.values())
+
     def find_devices(self):
         # !!! for ftdi devices, id = address since we can't access serial
         # numbers without opening & locking the devices !!!
         _device_added = False
         _device_removed = False
 
+        if not self._rescan_needed():
+            return {'current': self._current_devices, 'added': {}, 'obsolete': {}}
+
         # local dictionaries to hold intermediate values
         _device_ids = list(self._current_devices.keys())
         _found_devices_by_ids = {}
         _obsolete_devices_by_ids = {}
         _added_devices_by_ids = {}
 
-        # use PyUSB to find ftdi devices
-        dev = usb.core.find(find_all=True)
+        if self._use_sysfs:
+            usb_devices = self._sysfs_usb_devices()
+        else:
+            # use PyUSB to find ftdi devices
+            usb_devices = [((cfg.idVendor, cfg.idProduct), cfg.bus, cfg.address)
+                           for cfg in usb.core.find(find_all=True)]
 
-        for cfg in dev:
+        for vend_prod, bus, address in usb_devices:
             # look for matches with existing driver product/vendor IDs
-            vend_prod = (cfg.idVendor, cfg.idProduct)
-            bus_addr = (cfg.bus, cfg.address)
+            bus_addr = (bus, address)
             bus_addr_key = '{}:{}'.format(*bus_addr)
 
             idf = None
@@ -28,4 +28,6 @@ class ArduinoDriver:
 
     @staticmethod
     def translate_device_to_gui(data, device_data):
-        return ArduinoMessages.parse_arduino_output_message(data)
+        return ArduinoMessages.parse_arduino_output_message(data,
+                                                            device_data['channel_ids'],
+                                                            device_data['precisions'])
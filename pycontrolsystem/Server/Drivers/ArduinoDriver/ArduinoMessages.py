@@ -1,5 +1,8 @@
 import time
 import re
+from functools import lru_cache
+
+import numpy as np
 
 
 def build_set_message(channel_names, values_to_set):
@@ -119,7 +122,7 @@ def build_query_message(channel_ids, precisions, safe_messages=[]):
             # return build_query_message(split_channel, split_precision, safe_messages=[])
             all_messages.append(build_query_message(split_channel, split_precision))
 
-        return [(msg[0], 1) for msg in all_messages]
+        return [msg for messages in all_messages for msg in messages]
 
     else:
         msg = "q"
@@ -138,35 +141,215 @@ arduino_error_messages_dict = {'ERR0': "Undefined error (does not fall into any
                                'ERR4': "Querying for one or more non-existing channel/s."}
 
 
-def parse_arduino_output_message(output_messages):
+# Everybody stand back. I know regular expressions.
+output_value_pattern = re.compile(r"([a-zA-Z][0-9])([\+\-])([0-9])([0-9]+)([0-9])([\+\-])")
+
+# exact powers of ten, dividing/multiplying by them rounds the same way float("1.234e-5") does
+_powers_of_ten = [10.0 ** i for i in range(23)]
+
+
+def check_for_error(output_message):
+    if "ERR" in output_message:
+        error_key = output_message.split("\r\n")[0]
+        raise Exception(error_key, arduino_error_messages_dict[error_key])
+
+
+def parse_arduino_output_message(output_messages, channel_ids=None, precisions=None):
+    """
+    Parses the responses to the query message(s) into {channel name: value}. If the channel_ids and
+    precisions of the query are given, the fixed-width fast path is used, falling back to the regular
+    expression for responses that don't have the expected layout.
+    """
+    if channel_ids is not None and precisions is not None:
+        return compile_output_parser(tuple(channel_ids), tuple(precisions)).parse(output_messages)
+
     result = {}
     for output_message in output_messages:
+        check_for_error(output_message)
+        result.update(parse_output_message_regex(output_message))
 
-        if "ERR" in output_message:
-            error_key = output_message.split("\r\n")[0]
-            raise Exception(error_key, arduino_error_messages_dict[error_key])
-        else:
-
-            parsed_message = ""
+    return result
 
-            # Everybody stand back. I know regular expressions.
-            pattern = "([a-zA-Z][0-9])([\+\-])([0-9])([0-9]+)([0-9])([\+\-])"
 
-            matches = re.findall(pattern, output_message, flags=0)
+def parse_output_message_regex(output_message):
+    result = {}
 
-            for match in matches:
-                channel_name = match[0]
+    for match in output_value_pattern.findall(output_message):
+        channel_name = match[0]
 
-                value = float("{}.{}".format(match[2], match[3]))
+        value = float("{}.{}".format(match[2], match[3]))
 
-                if match[5] == "+":
-                    value *= 10 ** (int(match[4]))
-                elif match[5] == "-":
-                    value *= 10 ** (- int(match[4]))
+        if match[5] == "+":
+            value *= 10 ** (int(match[4]))
+        elif match[5] == "-":
+            value *= 10 ** (- int(match[4]))
 
-                if match[1] == "-":
-                    value = 0 - value
+        if match[1] == "-":
+            value = 0 - value
 
-                result[channel_name] = value
+        result[channel_name] = value
 
     return result
+
+
+@lru_cache(maxsize=256)
+def compile_output_parser(channel_ids, precisions):
+    """ Returns the (cached) OutputParser for a query of these channels with these precisions """
+    return OutputParser(channel_ids, precisions)
+
+
+class OutputParser(object):
+    """
+    Fast parser for the responses to one query. The query message fixes the order and precision of the
+    channels, so every response has a fixed layout: "o", then per channel name (2), sign (1), mantissa
+    (1 + precision digits), exponent (1) and exponent sign (1). The values are read directly from their
+    positions instead of searching for them.
+    """
+
+    def __init__(self, channel_ids, precisions):
+        self._channel_ids = channel_ids
+
+        # one response per query message, read the layout from the messages build_query_message sends:
+        # "q", the number of channels (2), then per channel name (2) and precision (1)
+        # per message: (message length, [(channel name, start, precision), ...])
+        self._layouts = []
+        for query_message, _ in build_query_message(list(channel_ids), list(precisions)):
+            fields = []
+            start = 1  # the "o"
+            for i in range(3, len(query_message), 3):
+                channel_name, precision = query_message[i:i + 2], int(query_message[i + 2])
+                fields.append((channel_name, start, precision))
+                start += output_message_per_channel_length(precision)
+
+            self._layouts.append((start, fields))
+
+        # column of each channel in the batch decoded array
+        self._columns = {channel_name: i for i, channel_name in enumerate(self._channel_ids)}
+
+    @property
+    def channel_ids(self):
+        return self._channel_ids
+
+    def parse(self, output_messages):
+        """ Same result as parse_arduino_output_message, {channel name: value} """
+        result = {}
+
+        if len(output_messages) != len(self._layouts):
+            for output_message in output_messages:
+                check_for_error(output_message)
+                result.update(parse_output_message_regex(output_message))
+
+            return result
+
+        for output_message, (length, fields) in zip(output_messages, self._layouts):
+            check_for_error(output_message)
+            fixed_width_message = self._strip(output_message, length)
+
+            if fixed_width_message is None or not self._parse_fields(fixed_width_message, fields, result):
+                result.update(parse_output_message_regex(output_message))
+
+        return result
+
+    @staticmethod
+    def _strip(output_message, length):
+        """ Returns the message without line ending (and channel count), None if it has the wrong length """
+        output_message = output_message.rstrip("\r\n")
+
+        if len(output_message) == length:
+            return output_message
+        elif len(output_message) == length + 2:
+            # "o" followed by the two digit number of channels
+            return output_message[0] + output_message[3:]
+
+        return None
+
+    @staticmethod
+    def _parse_fields(output_message, fields, result):
+        for channel_name, start, precision in fields:
+            if output_message[start:start + 2] != channel_name:
+                return False
+
+            end = start + 4 + precision
+
+            try:
+                mantissa = int(output_message[start + 3:end])
+                exponent = int(output_message[end])
+            except ValueError:
+                return False
+
+            if output_message[end + 1] == "-":
+                exponent = -exponent
+
+            exponent -= precision
+
+            if exponent < 0:
+                value = mantissa / _powers_of_ten[-exponent]
+            else:
+                value = mantissa * _powers_of_ten[exponent]
+
+            if output_message[start + 2] == "-":
+                value = -value
+
+            result[channel_name] = value
+
+        return True
+
+    def parse_batch(self, responses):
+        """
+        Decodes many buffered responses at once. responses is a list of output message lists (one per
+        query), the result a (len(responses), number of channels) array with the values in the order of
+        channel_ids. Responses that don't have the expected layout are parsed one by one.
+        """
+        values = np.full((len(responses), len(self._channel_ids)), np.nan)
+        fallback = [len(output_messages) != len(self._layouts) for output_messages in responses]
+
+        for i, (length, fields) in enumerate(self._layouts):
+            rows, messages = [], []
+
+            for row, output_messages in enumerate(responses):
+                if fallback[row]:
+                    continue
+
+                check_for_error(output_messages[i])
+                output_message = self._strip(output_messages[i], length)
+
+                if output_message is not None:
+                    rows.append(row)
+                    messages.append(output_message)
+                else:
+                    fallback[row] = True
+
+            if not rows:
+                continue
+
+            rows = np.array(rows)
+            chars = np.frombuffer("".join(messages).encode("ascii", "replace"),
+                                  dtype=np.uint8).reshape(len(rows), length)
+            digits = chars.astype(np.int64) - ord("0")
+            valid = np.ones(len(rows), dtype=bool)
+
+            for channel_name, start, precision in fields:
+                end = start + 4 + precision
+
+                valid &= np.all(chars[:, start:start + 2] == np.frombuffer(channel_name.encode(), dtype=np.uint8),
+                                axis=1)
+                valid &= np.all((digits[:, start + 3:end + 1] >= 0) & (digits[:, start + 3:end + 1] <= 9), axis=1)
+
+                mantissa = digits[:, start + 3:end] @ (10 ** np.arange(precision, -1, -1))
+                exponent = np.where(chars[:, end + 1] == ord("-"), -digits[:, end], digits[:, end]) - precision
+
+                value = mantissa * np.power(10.0, exponent)
+                values[rows, self._columns[channel_name]] = np.where(chars[:, start + 2] == ord("-"), -value, value)
+
+            for row in rows[~valid]:
+                fallback[row] = True
+
+        for row, use_fallback in enumerate(fallback):
+            if use_fallback:
+                values[row] = np.nan
+                parsed = parse_arduino_output_message(responses[row])
+                for channel_name, value in parsed.items():
+                    if channel_name in self._columns:
+                        values[row, self._columns[channel_name]] = value
+
+        return values
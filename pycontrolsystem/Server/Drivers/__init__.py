@@ -1,62 +1,118 @@
-from .ArduinoDriver import *
-from .MFCDriver import *
-from .TDKDriver import *
-from .REKDriver import *
-from .CODriver import *
-from .AIMDriver import *
+import importlib
+
+
+class LazyDriver(object):
+    """
+    Stands in for a driver class in driver_mapping. The driver's module is only imported when the first
+    instance is created (driver_mapping[name]['driver']() works as before), so importing the mapping
+    doesn't import every driver.
+    """
+
+    def __init__(self, package, class_name):
+        self._package = package
+        self._class_name = class_name
+        self._driver_class = None
+
+    @property
+    def driver_class(self):
+        if self._driver_class is None:
+            module = importlib.import_module('.' + self._package, __name__)
+            self._driver_class = getattr(module, self._class_name)
+
+        return self._driver_class
+
+    def __call__(self, *args, **kwargs):
+        return self.driver_class(*args, **kwargs)
+
 
 """
 The driver mapping contains the information needed for the DeviceDriver class and the Server to
-use the respective translation functions from GUI to Device and back and the correct baud rate
+use the respective translation functions from GUI to Device and back and the correct baud rate.
+'framing' selects how SerialCOM splits the incoming bytes into responses (see SerialCOM.framers):
+'line' ends a response at '\\r' or '\\n', 'checksum' additionally ends it two bytes after a ';'.
+'pipelined' (opt-in) lets the DeviceManager write all messages of a query/set command back-to-back
+and match the responses by order afterwards. Only for point-to-point, full-duplex ports whose device
+answers every message in order (the Arduino firmware), never for a half-duplex 'bus'.
+'ready_probe' (optional) is a message that SerialCOM sends after opening the port until the device
+answers it, e.g. to wait out the auto-reset of Arduinos. Devices without it are used right away.
+'bus' (optional) marks ports shared by several addressed devices (device id <serial number>_<address>),
+they are polled by a BusManager that schedules the addresses fairly.
+'min_polling_rate' and 'max_polling_rate' bound the rate the DeviceManager negotiates with the device
+(see Server/RateController.py): it polls as fast as the device's measured round-trip times allow and
+backs off on timeouts.
 """
-driver_mapping = {'ArduinoMicro': {'driver': ArduinoDriver,
+driver_mapping = {'ArduinoMicro': {'driver': LazyDriver('ArduinoDriver', 'ArduinoDriver'),
                                    'baud_rate': 115200,
+                                   'min_polling_rate': 1,
                                    'max_polling_rate': 50,
+                                   'framing': 'line',
+                                   'pipelined': True,
+                                   'ready_probe': 'q00',  # empty query
                                    'vid_pid': (0x2341, 0x8037),
                                    'known_serials': ["A", "9"]
                                    },
-                  'ArduinoMega': {'driver': ArduinoDriver,
+                  'ArduinoMega': {'driver': LazyDriver('ArduinoDriver', 'ArduinoDriver'),
                                   'baud_rate': 115200,
+                                  'min_polling_rate': 1,
                                   'max_polling_rate': 50,
+                                  'framing': 'line',
+                                  'pipelined': True,
+                                  'ready_probe': 'q00',  # empty query
                                   'vid_pid': (0x2341, 0x0042),
                                   'known_serials': ["95433343733351502071",
                                                     "954323138373513060D0",
                                                     "954323138373519002A2",
                                                     "95433343733351507011"]
                                   },
-                  'RS485': {'driver': MFCDriver,
+                  'RS485': {'driver': LazyDriver('MFCDriver', 'MFCDriver'),
                             'baud_rate': 9600,
+                            'min_polling_rate': 1,
                             'max_polling_rate': 50,
+                            'framing': 'checksum',
+                            'bus': True,
                             'vid_pid': (0x0403, 0x6001),
                             'known_serials': ["FTJRNRWQA"]
                             },
-                  'Teensy': {'driver': ArduinoDriver,
+                  'Teensy': {'driver': LazyDriver('ArduinoDriver', 'ArduinoDriver'),
                              'baud_rate': 115200,
+                             'min_polling_rate': 1,
                              'max_polling_rate': 50,
+                             'framing': 'line',
+                             'pipelined': True,
+                             'ready_probe': 'q00',  # empty query
                              'vid_pid': (0x16C0, 0x0483),
                              'known_serials': ["3596460"]
                              },
-                  'FT232R': {'driver': TDKDriver,
+                  'FT232R': {'driver': LazyDriver('TDKDriver', 'TDKDriver'),
                              'baud_rate': 19200,
+                             'min_polling_rate': 1,
                              'max_polling_rate': 50,
+                             'framing': 'line',
                              'vid_pid': (0x0403, 0x6001),
                              'known_serials': ["A5051Z0GA"]
                              },
-                  'Prolific': {'driver': REKDriver,
+                  'Prolific': {'driver': LazyDriver('REKDriver', 'REKDriver'),
                                'baud_rate': 9600,
+                               'min_polling_rate': 1,
                                'max_polling_rate': 50,
+                               'framing': 'line',
                                'vid_pid': (0x067B, 0x2303),
                                'known_serials': ["9", "8"]
                                },
-                  'nAIM-S': {'driver': AIMDriver,
+                  'nAIM-S': {'driver': LazyDriver('AIMDriver', 'AIMDriver'),
                              'baud_rate': 9600,
+                             'min_polling_rate': 1,
                              'max_polling_rate': 10,
+                             'framing': 'checksum',
                              'vid_pid': (0x067B, 0x2303),
                              'known_serials': ["7"]
                              },
-                  'MATSUSADA': {'driver': CODriver,
+                  'MATSUSADA': {'driver': LazyDriver('CODriver', 'CODriver'),
                                 'baud_rate': 9600,
+                                'min_polling_rate': 1,
                                 'max_polling_rate': 50,
+                                'framing': 'line',
+                                'bus': True,
                                 'vid_pid': (0x1192, 0x1000),
                                 'ftdi_info': (0x1192, 0x1000),
                                 'known_serials': ["7"]
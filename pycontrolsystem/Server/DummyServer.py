@@ -71,11 +71,13 @@ def initialize():
 
 @app.route("/device/set", methods=['GET', 'POST'])
 def set_value_on_device():
-    # Load the data stream
-    set_cmd = json.loads(request.form['data'])
-    set_cmd["set"] = True
+    # Load the data stream, a single command or a list of commands
+    set_cmds = json.loads(request.form['data'])
+
+    if isinstance(set_cmds, dict):
+        set_cmds = [set_cmds]
 
-    # For reference: This is the message from the GUI:
+    # For reference: This is a message from the GUI:
     # device_data = {'device_driver': device_driver_name,
     #                'device_id': device_id,
     #                'locked_by_server': False,
@@ -84,17 +86,20 @@ def set_value_on_device():
     #                'values': [values],
     #                'data_types': [types]}
 
-    full_device_id = set_cmd['device_id']
-    device_id_parts = full_device_id.split("_")
-    sub_id = device_id_parts[0]
-    device_id = device_id_parts[0]
+    for set_cmd in set_cmds:
+        set_cmd["set"] = True
+
+        full_device_id = set_cmd['device_id']
+        device_id_parts = full_device_id.split("_")
+        sub_id = device_id_parts[0]
+        device_id = device_id_parts[0]
 
-    if len(device_id_parts) > 1:
-        sub_id = device_id_parts[1]
+        if len(device_id_parts) > 1:
+            sub_id = device_id_parts[1]
 
-    set_cmd['device_id'] = sub_id
+        set_cmd['device_id'] = sub_id
 
-    _devices[device_id].add_command_to_queue(set_cmd)
+        _devices[device_id].add_command_to_queue(set_cmd)
 
     return 'Command sent to device'
 
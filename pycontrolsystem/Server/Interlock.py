@@ -0,0 +1,249 @@
+import operator
+import threading
+import time
+
+comparisons = {'equal': operator.eq,
+               'less': operator.lt,
+               'greater': operator.gt,
+               'greatereq': operator.ge,
+               'lesseq': operator.le}
+
+
+class Interlock(object):
+    """
+    Server side copy of one of the client's BasicProcedures. The rules compare the channel values in
+    client units (raw value / scaling), exactly like the client does. Like on the client, a tripped
+    interlock doesn't fire again until its condition has been un-met.
+    """
+
+    def __init__(self, name, rules, actions):
+        self._name = name
+        self._rules = rules  # [(device key, channel name, scaling, comp, value), ...]
+        self._actions = actions  # [(server side device id, delay, set command), ...]
+
+        self._tripped = False
+        self._running = False
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def device_keys(self):
+        return {rule[0] for rule in self._rules}
+
+    @property
+    def tripped(self):
+        return self._tripped
+
+    def condition_satisfied(self, values):
+        """ values: {(server side device id, device id): newest response of that device} """
+        for device_key, channel_name, scaling, comp, value in self._rules:
+            try:
+                channel_value = float(values[device_key][channel_name]) / scaling
+            except (KeyError, TypeError, ValueError, ZeroDivisionError):
+                # no (valid) value yet, don't act on it
+                return False
+
+            if not comp(channel_value, value):
+                return False
+
+        return True
+
+    def unavailable(self, managers, values):
+        """
+        Why the server can't act on this interlock right now (None if it can): an action's device isn't
+        on the server, or a rule has no (valid) value to compare. The client evaluates it itself then.
+        """
+        for server_side_device_id, _, _ in self._actions:
+            if server_side_device_id not in managers:
+                return "action device {} not found on server".format(server_side_device_id)
+
+        for device_key, channel_name, scaling, _, _ in self._rules:
+            try:
+                float(values[device_key][channel_name]) / scaling
+            except (KeyError, TypeError, ValueError, ZeroDivisionError):
+                return "no value for channel {} of device {}".format(channel_name, device_key[1])
+
+        return None
+
+
+class InterlockEngine(object):
+    """
+    Evaluates the BasicProcedure rules of the client's session next to the hardware. It is a listener
+    of every DeviceManager, so the rules are checked in the device's poll cycle right after its
+    current values changed, and the actions are put on the set command queue of the target devices
+    directly instead of going through the client.
+    Only the channels the client queries have values on the server, so rules can only use those.
+    """
+
+    def __init__(self, managers):
+        self._managers = managers  # the server's {server side device id: DeviceManager}
+        self._interlocks = []
+        self._index = {}  # (server side device id, device id) -> interlocks with rules on that device
+        self._values = {}
+        self._dropped = {}  # interlock name -> message of an action that couldn't be queued
+        self._lock = threading.Lock()
+
+    @property
+    def interlocks(self):
+        return self._interlocks
+
+    def load(self, session, resolve_device_ids):
+        """
+        Replaces the interlocks with the basic procedures of a session json (as written by the client's
+        on_save_button). resolve_device_ids translates the client side device id of a device_data dict
+        (see Server.resolve_device_ids). Returns the names of the procedures that were loaded.
+        """
+        devices = session.get('devices', {})
+        interlocks = []
+
+        for name, procedure in session.get('procedures', {}).items():
+            if procedure.get('type') != 'basic' or not procedure.get('rules'):
+                continue
+
+            try:
+                rules = [self._make_rule(devices, rule, resolve_device_ids)
+                         for _, rule in sorted(procedure['rules'].items(), key=lambda item: int(item[0]))]
+                priority = 'emergency' if procedure.get('triggertype') == 'emstop' else 'interlock'
+                actions = [self._make_action(devices, action, priority, resolve_device_ids)
+                           for _, action in sorted(procedure['actions'].items(), key=lambda item: int(item[0]))]
+            except (KeyError, ValueError) as e:
+                print("Unable to load procedure '{}' as interlock: {}".format(name, e))
+                continue
+
+            interlocks.append(Interlock(name, rules, actions))
+
+        index = {}
+        for interlock in interlocks:
+            for device_key in interlock.device_keys:
+                index.setdefault(device_key, []).append(interlock)
+
+        with self._lock:
+            self._interlocks, self._index = interlocks, index
+            self._dropped = {}
+
+        return [interlock.name for interlock in interlocks]
+
+    def status(self):
+        """
+        {name: reason} of the loaded interlocks the server can't act on right now (see
+        Interlock.unavailable) or that had to drop an action. The client keeps doing their actions itself.
+        """
+        with self._lock:
+            status = {}
+
+            for interlock in self._interlocks:
+                reason = interlock.unavailable(self._managers, self._values)
+                if reason is not None:
+                    status[interlock.name] = reason
+
+            status.update(self._dropped)
+
+        return status
+
+    @staticmethod
+    def _device_data(devices, device_name, resolve_device_ids):
+        device = devices[device_name]
+        device_data = {'device_driver': device['driver'], 'device_id': device['device_id']}
+
+        _, server_side_device_id, device_id = resolve_device_ids(device_data)
+        if server_side_device_id is None:
+            raise ValueError("driver '{}' not found in driver_mapping".format(device['driver']))
+
+        return device, server_side_device_id, device_id
+
+    def _make_rule(self, devices, rule, resolve_device_ids):
+        device, server_side_device_id, device_id = self._device_data(devices, rule['rule_device'],
+                                                                     resolve_device_ids)
+        channel = device['channels'][rule['rule_channel']]
+
+        if rule['comp'] not in comparisons:
+            raise ValueError("unknown comparison '{}'".format(rule['comp']))
+
+        return ((server_side_device_id, device_id), rule['rule_channel'], channel['scaling'],
+                comparisons[rule['comp']], rule['value'])
+
+    def _make_action(self, devices, action, priority, resolve_device_ids):
+        device, server_side_device_id, device_id = self._device_data(devices, action['action_device'],
+                                                                     resolve_device_ids)
+        channel = device['channels'][action['action_channel']]
+
+        # same as the client's set_value_callback
+        if channel['data_type'] == str(float):
+            value = action['action_value'] * channel['scaling']
+        else:
+            value = float(action['action_value'])
+
+        cmd = {'device_driver': device['driver'],
+               'device_id': device_id,
+               'locked_by_server': False,
+               'channel_ids': [action['action_channel']],
+               'precisions': [None],
+               'values': [value],
+               'data_types': [channel['data_type']],
+               'priority': priority,
+               'set': True}
+
+        return server_side_device_id, action['action_delay'], cmd
+
+    def on_device_update(self, server_side_device_id, device_id, values):
+        """ DeviceManager listener, called in the device's poll cycle. values=None means the device went away """
+        device_key = (server_side_device_id, device_id)
+
+        with self._lock:
+            if values is None:
+                self._values.pop(device_key, None)
+                return
+
+            self._values[device_key] = values
+
+            triggered = []
+            for interlock in self._index.get(device_key, ()):
+                if not interlock.condition_satisfied(self._values):
+                    interlock._tripped = False
+                elif interlock.unavailable(self._managers, self._values) is not None:
+                    # reported by status(), the client does the actions
+                    continue
+                elif not interlock._tripped and not interlock._running:
+                    interlock._tripped = True
+                    interlock._running = True
+                    triggered.append(interlock)
+
+        for interlock in triggered:
+            print("Interlock '{}' triggered".format(interlock.name))
+            self._run_actions(interlock)
+
+    def _run_actions(self, interlock):
+        """ Actions without delay go on the queues right away, the rest from a separate thread """
+        actions = interlock._actions
+
+        while actions and actions[0][1] <= 0:
+            self._queue_action(interlock, actions[0])
+            actions = actions[1:]
+
+        if not actions:
+            interlock._running = False
+            return
+
+        def run_delayed():
+            for action in actions:
+                time.sleep(action[1])
+                self._queue_action(interlock, action)
+
+            interlock._running = False
+
+        threading.Thread(target=run_delayed, daemon=True).start()
+
+    def _queue_action(self, interlock, action):
+        server_side_device_id, _, cmd = action
+
+        try:
+            self._managers[server_side_device_id].add_command_to_queue(dict(cmd))
+        except KeyError:
+            message = "action for device {} dropped, device not found on server".format(server_side_device_id)
+            print("Interlock '{}': {}".format(interlock.name, message))
+
+            with self._lock:
+                if interlock in self._interlocks:
+                    self._dropped[interlock.name] = message
@@ -0,0 +1,183 @@
+import threading
+from collections import deque
+
+import numpy as np
+
+
+class RollingHistogram(object):
+    """
+    Keeps the last maxlen samples of a quantity (e.g. a round-trip time) for percentiles, and the
+    total count/sum of all samples ever added (for Prometheus summaries).
+    """
+
+    quantiles = (0.5, 0.95, 0.99)
+
+    def __init__(self, maxlen=1000):
+        self._samples = deque(maxlen=maxlen)
+        self._count = 0
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def count(self):
+        return self._count
+
+    @property
+    def sum(self):
+        return self._sum
+
+    def add(self, value):
+        with self._lock:
+            self._samples.append(value)
+            self._count += 1
+            self._sum += value
+
+    def percentiles(self):
+        """ Returns {quantile: value} over the rolling window, NaN if there are no samples yet """
+        with self._lock:
+            samples = np.array(self._samples)
+
+        if len(samples) == 0:
+            return {q: float('nan') for q in self.quantiles}
+
+        return dict(zip(self.quantiles, np.percentile(samples, [100.0 * q for q in self.quantiles]).tolist()))
+
+    def summary(self):
+        """ Percentiles are None (null in JSON) if there are no samples yet, JSON has no NaN """
+        percentiles = {q: None if np.isnan(value) else value for q, value in self.percentiles().items()}
+
+        return {'p50': percentiles[0.5],
+                'p95': percentiles[0.95],
+                'p99': percentiles[0.99],
+                'count': self._count}
+
+
+class DeviceMetrics(object):
+    """ Latency and error book-keeping of one DeviceManager """
+
+    def __init__(self):
+        self._round_trip_time = RollingHistogram()  # (s) serial message -> response
+        self._translate_time = RollingHistogram()  # (s) driver translate_gui_to_device/translate_device_to_gui
+        self._set_queue_depth = RollingHistogram()  # set commands waiting, sampled every cycle
+        self._set_queue_age = RollingHistogram()  # (s) time set commands waited in the queue
+        self._timeouts = 0
+        self._exceptions = 0
+        self._coalesced_sets = 0
+        # the counters are incremented from the poll workers and the set command threads
+        self._lock = threading.Lock()
+
+    @property
+    def round_trip_time(self):
+        return self._round_trip_time
+
+    @property
+    def translate_time(self):
+        return self._translate_time
+
+    @property
+    def set_queue_depth(self):
+        return self._set_queue_depth
+
+    @property
+    def set_queue_age(self):
+        return self._set_queue_age
+
+    @property
+    def coalesced_sets(self):
+        return self._coalesced_sets
+
+    @property
+    def timeouts(self):
+        return self._timeouts
+
+    @property
+    def exceptions(self):
+        return self._exceptions
+
+    def count_timeout(self):
+        with self._lock:
+            self._timeouts += 1
+
+    def count_exception(self):
+        with self._lock:
+            self._exceptions += 1
+
+    def count_coalesced_set(self):
+        with self._lock:
+            self._coalesced_sets += 1
+
+    def summary(self):
+        summary = {'round_trip_time': self._round_trip_time.summary(),
+                   'translate_time': self._translate_time.summary(),
+                   'set_queue_depth': self._set_queue_depth.summary(),
+                   'set_queue_age': self._set_queue_age.summary()}
+
+        with self._lock:
+            summary.update(timeouts=self._timeouts, exceptions=self._exceptions, coalesced_sets=self._coalesced_sets)
+
+        return summary
+
+
+def _format_value(value):
+    if np.isnan(value):
+        return 'NaN'
+
+    return repr(float(value))
+
+
+def format_prometheus(devices):
+    """
+    Formats the metrics of all devices in the Prometheus text exposition format.
+    devices is a list of (labels dict, DeviceMetrics, polling rate, negotiated polling rate)
+    """
+    lines = []
+
+    def labels_string(labels, **extra):
+        labels = dict(labels, **extra)
+        return ','.join('{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                        for key, value in labels.items())
+
+    for name, attribute, help_text in (
+            ('pycontrolsystem_round_trip_seconds', 'round_trip_time', 'Serial round-trip time per message'),
+            ('pycontrolsystem_translate_seconds', 'translate_time', 'Time spent in the device driver'),
+            ('pycontrolsystem_set_queue_depth', 'set_queue_depth', 'Set commands waiting in the queue'),
+            ('pycontrolsystem_set_queue_age_seconds', 'set_queue_age', 'Time set commands waited in the queue')):
+
+        lines.append('# HELP {} {}'.format(name, help_text))
+        lines.append('# TYPE {} summary'.format(name))
+
+        for labels, metrics, _, _ in devices:
+            histogram = getattr(metrics, attribute)
+
+            for quantile, value in histogram.percentiles().items():
+                lines.append('{}{{{}}} {}'.format(name, labels_string(labels, quantile=quantile), _format_value(value)))
+
+            lines.append('{}_sum{{{}}} {}'.format(name, labels_string(labels), _format_value(histogram.sum)))
+            lines.append('{}_count{{{}}} {}'.format(name, labels_string(labels), histogram.count))
+
+    for name, attribute, help_text in (
+            ('pycontrolsystem_timeouts_total', 'timeouts', 'Messages the device did not answer in time'),
+            ('pycontrolsystem_exceptions_total', 'exceptions', 'Exceptions caught while polling the device'),
+            ('pycontrolsystem_coalesced_sets_total', 'coalesced_sets', 'Set commands that replaced a waiting one')):
+
+        lines.append('# HELP {} {}'.format(name, help_text))
+        lines.append('# TYPE {} counter'.format(name))
+
+        for labels, metrics, _, _ in devices:
+            lines.append('{}{{{}}} {}'.format(name, labels_string(labels), getattr(metrics, attribute)))
+
+    lines.append('# HELP pycontrolsystem_polling_rate_hz Measured polling rate of the device')
+    lines.append('# TYPE pycontrolsystem_polling_rate_hz gauge')
+
+    for labels, _, polling_rate, _ in devices:
+        lines.append('pycontrolsystem_polling_rate_hz{{{}}} {}'.format(labels_string(labels),
+                                                                        _format_value(polling_rate)))
+
+    lines.append('# HELP pycontrolsystem_polling_rate_target_hz Polling rate negotiated with the device')
+    lines.append('# TYPE pycontrolsystem_polling_rate_target_hz gauge')
+
+    for labels, _, _, polling_rate_target in devices:
+        lines.append('pycontrolsystem_polling_rate_target_hz{{{}}} {}'.format(labels_string(labels),
+                                                                               _format_value(polling_rate_target)))
+
+    return '\n'.join(lines) + '\n'
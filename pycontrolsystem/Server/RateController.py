@@ -0,0 +1,67 @@
+class AdaptiveRateController(object):
+    """
+    Negotiates the polling rate of one device between the bounds from driver_mapping
+    (min_polling_rate, max_polling_rate). It keeps an exponentially weighted average of how long a full
+    query cycle of the device takes and polls at most as fast as that allows (with some headroom), so a
+    slow device doesn't hog the worker pool and the bus with cycles that overrun anyway. Every cycle
+    with timeouts or exceptions halves the rate, after that it creeps back up by `recovery` per cycle.
+    """
+
+    def __init__(self, min_rate, max_rate, headroom=1.25, smoothing=0.2, backoff=0.5, recovery=1.05):
+        self._min_rate = min_rate
+        self._max_rate = max_rate
+        self._headroom = headroom
+        self._smoothing = smoothing
+        self._backoff = backoff
+        self._recovery = recovery
+
+        self._rate = max_rate  # Hz
+        self._cycle_time = None  # (s) smoothed duration of a query cycle
+
+    @property
+    def rate(self):
+        return self._rate
+
+    @property
+    def cycle_time(self):
+        return self._cycle_time
+
+    @property
+    def min_rate(self):
+        return self._min_rate
+
+    @min_rate.setter
+    def min_rate(self, min_rate):
+        self._min_rate = min_rate
+        self._rate = self._clamp(self._rate)
+
+    @property
+    def max_rate(self):
+        return self._max_rate
+
+    @max_rate.setter
+    def max_rate(self, max_rate):
+        self._max_rate = max_rate
+        self._rate = self._clamp(self._rate)
+
+    def _clamp(self, rate):
+        return min(self._max_rate, max(self._min_rate, rate))
+
+    def update(self, cycle_time, failures=0):
+        """ Call after every query cycle with its duration (s) and the number of timeouts/exceptions """
+        if self._cycle_time is None:
+            self._cycle_time = cycle_time
+        else:
+            self._cycle_time += self._smoothing * (cycle_time - self._cycle_time)
+
+        if failures > 0:
+            rate = self._rate * self._backoff
+        else:
+            rate = self._rate * self._recovery
+
+            if self._cycle_time > 0.0:
+                rate = min(rate, 1.0 / (self._headroom * self._cycle_time))
+
+        self._rate = self._clamp(rate)
+
+        return self._rate
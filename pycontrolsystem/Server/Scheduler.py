@@ -0,0 +1,412 @@
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ScheduledDevice(object):
+    """ Book-keeping for one DeviceManager driven by the PollingScheduler """
+
+    def __init__(self, key, manager):
+        self._key = key
+        self._manager = manager
+
+        self._deadline = None
+        self._sequence = None  # of the heap entry that is current, older ones are stale
+        self._busy = False
+        self._removed = False
+
+        # lateness = time between the deadline and the actual start of the cycle (s)
+        self._lateness = deque(maxlen=100)
+        self._cycles = 0
+        self._missed_cycles = 0
+
+    @property
+    def key(self):
+        return self._key
+
+    @property
+    def manager(self):
+        return self._manager
+
+    @property
+    def period(self):
+        # Read every time we reschedule, so changes of the negotiated rate take effect on the next cycle
+        return 1.0 / self._manager.polling_rate_target
+
+    def stats(self):
+        if len(self._lateness) > 0:
+            last_lateness = self._lateness[-1]
+            mean_lateness = sum(self._lateness) / len(self._lateness)
+            max_lateness = max(self._lateness)
+        else:
+            last_lateness = mean_lateness = max_lateness = 0.0
+
+        return {'period': self.period,
+                'cycles': self._cycles,
+                'missed_cycles': self._missed_cycles,
+                'lateness': last_lateness,
+                'mean_lateness': mean_lateness,
+                'max_lateness': max_lateness}
+
+
+class SnapshotGroup(object):
+    """
+    Devices that are polled together (see PollingScheduler.add_group). All members start their cycle at
+    the same barrier deadline, and the next tick is only scheduled once every member finished.
+    """
+
+    def __init__(self, name, keys, rate, on_frame):
+        self._name = name
+        self._keys = list(keys)
+        self._rate = rate
+        self._on_frame = on_frame
+
+        self._deadline = None
+        self._sequence = None
+        self._removed = False
+
+        self._members = []  # ScheduledDevices of the current tick
+        self._pending = 0  # members that didn't finish the current tick yet
+        self._starts = []
+
+        self._cycles = 0
+        self._missed_cycles = 0
+        # spread = time between the first and the last member starting its cycle in a tick (s)
+        self._spread = deque(maxlen=100)
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def keys(self):
+        return self._keys
+
+    @property
+    def period(self):
+        # never faster than the slowest member can go
+        return max([1.0 / self._rate] + [member.period for member in self._members])
+
+    def stats(self):
+        if len(self._spread) > 0:
+            spread = self._spread[-1]
+            max_spread = max(self._spread)
+        else:
+            spread = max_spread = 0.0
+
+        return {'period': self.period,
+                'members': list(self._keys),
+                'cycles': self._cycles,
+                'missed_cycles': self._missed_cycles,
+                'spread': spread,
+                'max_spread': max_spread}
+
+
+class PollingScheduler(object):
+    """
+    Drives all DeviceManagers from a single deadline heap instead of one sleeping thread per device.
+    Every device is polled on fixed-rate deadlines (deadline + n * period). If a cycle overruns, the
+    missed deadlines are skipped instead of letting the schedule drift, and the lateness of each cycle
+    start is recorded per device. The (blocking) device cycles themselves run on a worker pool with
+    one worker per device (max_workers=None), so the lateness doesn't depend on queueing for a worker.
+    Devices of a snapshot group are not polled on their own deadlines but all at once on the group's.
+    clock and executor can be replaced, e.g. to drive the scheduler by hand with run_due().
+    """
+
+    def __init__(self, max_workers=None, clock=time.monotonic, executor=None):
+        self._heap = []  # entries are (deadline, sequence number, ScheduledDevice or SnapshotGroup)
+        self._entries = {}
+        self._groups = {}
+        self._grouped = {}  # device key -> SnapshotGroup it belongs to
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._clock = clock
+
+        # a pool that is too small for the devices is replaced by a bigger one (only if we own it)
+        self._grow_pool = executor is None and max_workers is None
+        self._retired_pools = []
+
+        if executor is None:
+            self._workers = max_workers or 4
+            executor = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix='DevicePoll')
+        else:
+            self._workers = None
+
+        self._pool = executor
+        self._thread = None
+        self._terminate = False
+
+    @property
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.is_running:
+            return
+
+        self._terminate = False
+        self._thread = threading.Thread(target=self._run, name='PollingScheduler', daemon=True)
+        self._thread.start()
+
+    def add_device(self, key, manager):
+        with self._condition:
+            entry = ScheduledDevice(key, manager)
+            self._entries[key] = entry
+            self._push(entry, self._clock())
+
+            if self._grow_pool and len(self._entries) > self._workers:
+                # run_due may still be submitting to the old pool, it shuts it down on its next call
+                self._retired_pools.append(self._pool)
+                self._workers = 2 * len(self._entries)
+                self._pool = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix='DevicePoll')
+
+            self._condition.notify()
+
+    def remove_device(self, key):
+        """ Stop scheduling the device and wait for a running cycle to finish """
+        with self._condition:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return
+
+            entry._removed = True
+            self._condition.notify_all()
+
+            while entry._busy:
+                self._condition.wait()
+
+    def add_group(self, name, keys, rate, on_frame):
+        """
+        Polls the devices with the given keys as a snapshot group, at rate (Hz) at most: every tick all of
+        them are triggered at the same barrier time, their managers get poll(snapshot=<barrier time>),
+        and on_frame(name, keys, barrier time) is called once all of them finished. A device is in one
+        group at most, it is taken out of any other group (which is removed if that was its last device).
+        Replaces the group of the same name.
+        """
+        with self._condition:
+            self._remove_group(name)
+
+            group = SnapshotGroup(name, keys, rate, on_frame)
+            for key in group.keys:
+                previous = self._grouped.get(key)
+                if previous is not None:
+                    previous.keys.remove(key)
+
+                    # a group that lost all of its devices would keep ticking without members
+                    if not previous.keys:
+                        self._remove_group(previous.name)
+
+                self._grouped[key] = group
+
+            self._groups[name] = group
+            self._push(group, self._clock())
+            self._condition.notify()
+
+    def remove_group(self, name):
+        """ The devices of the group go back to their own schedule """
+        with self._condition:
+            self._remove_group(name)
+            self._condition.notify()
+
+    def _remove_group(self, name):
+        group = self._groups.pop(name, None)
+        if group is None:
+            return
+
+        group._removed = True
+        now = self._clock()
+
+        for key in group.keys:
+            if self._grouped.get(key) is group:
+                del self._grouped[key]
+
+            # devices in the middle of a group tick are rescheduled when they finish
+            entry = self._entries.get(key)
+            if entry is not None and not entry._busy:
+                self._push(entry, now)
+
+    def stats(self, key):
+        with self._condition:
+            try:
+                stats = self._entries[key].stats()
+            except KeyError:
+                return {}
+
+            if key in self._grouped:
+                stats['snapshot_group'] = self._grouped[key].name
+
+            return stats
+
+    def group_stats(self, name):
+        with self._condition:
+            try:
+                return self._groups[name].stats()
+            except KeyError:
+                return {}
+
+    def shutdown(self):
+        with self._condition:
+            self._terminate = True
+            self._condition.notify_all()
+
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+        for pool in self._retired_pools + [self._pool]:
+            pool.shutdown(wait=True)
+
+        self._retired_pools = []
+
+    def _push(self, entry, deadline):
+        entry._deadline = deadline
+        entry._sequence = next(self._sequence)
+        heapq.heappush(self._heap, (deadline, entry._sequence, entry))
+
+    def _reschedule(self, entry, deadline):
+        # Fixed-rate: the next deadline is always a whole number of periods after the last one.
+        # If we overran one or more deadlines, skip them rather than queueing a burst of cycles.
+        period = entry.period
+        now = self._clock()
+        periods = max(1, int((now - deadline) // period) + 1)
+        entry._missed_cycles += periods - 1
+
+        self._push(entry, deadline + periods * period)
+        self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._terminate:
+                    if not self._heap:
+                        self._condition.wait()
+                        continue
+
+                    delay = self._heap[0][0] - self._clock()
+                    if delay <= 0.0:
+                        break
+
+                    self._condition.wait(timeout=delay)
+
+                if self._terminate:
+                    return
+
+            self.run_due()
+
+    def run_due(self):
+        """ Starts the cycles of everything whose deadline has passed. Returns the number of cycles started """
+        jobs = []
+
+        with self._condition:
+            # only this method submits, nothing can be on the way to the retired pools anymore
+            for pool in self._retired_pools:
+                pool.shutdown(wait=False)
+
+            self._retired_pools = []
+            pool = self._pool
+            now = self._clock()
+
+            while self._heap and self._heap[0][0] <= now:
+                deadline, sequence, entry = heapq.heappop(self._heap)
+
+                if entry._removed or sequence != entry._sequence:
+                    continue
+
+                if isinstance(entry, SnapshotGroup):
+                    jobs.extend(self._start_group(entry, deadline))
+                elif entry.key in self._grouped:
+                    # polled by its snapshot group
+                    continue
+                else:
+                    entry._busy = True
+                    jobs.append((self._run_cycle, entry, deadline))
+
+        for job in jobs:
+            pool.submit(*job)
+
+        return len(jobs)
+
+    def _start_group(self, group, deadline):
+        """ Called with the lock held, returns the member cycles to submit """
+        group._members = [self._entries[key] for key in group.keys if key in self._entries]
+
+        if not group._members or any(member._busy for member in group._members):
+            # can't trigger all of them at once, try again on the next tick
+            group._missed_cycles += 1
+            self._push(group, deadline + group.period)
+            return []
+
+        # the barrier time on the wall clock, all responses of this tick get it as timestamp
+        barrier = time.time() - (self._clock() - deadline)
+
+        group._pending = len(group._members)
+        group._starts = []
+
+        for member in group._members:
+            member._busy = True
+
+        return [(self._run_group_cycle, group, member, deadline, barrier) for member in group._members]
+
+    def _run_cycle(self, entry, deadline):
+        start = self._clock()
+
+        try:
+            entry.manager.poll()
+        except Exception as e:
+            entry.manager.metrics.count_exception()
+            print("Exception '{}' caught while polling device {}.".format(e, entry.key))
+
+        with self._condition:
+            entry._busy = False
+            entry._cycles += 1
+            entry._lateness.append(start - deadline)
+
+            if entry._removed:
+                self._condition.notify_all()
+                return
+
+            self._reschedule(entry, deadline)
+
+    def _run_group_cycle(self, group, entry, deadline, barrier):
+        start = self._clock()
+
+        try:
+            entry.manager.poll(snapshot=barrier)
+        except Exception as e:
+            entry.manager.metrics.count_exception()
+            print("Exception '{}' caught while polling device {}.".format(e, entry.key))
+
+        with self._condition:
+            entry._busy = False
+            entry._cycles += 1
+            entry._lateness.append(start - deadline)
+
+            if entry._removed:
+                self._condition.notify_all()
+            elif group._removed:
+                # the group went away during this tick, back to the device's own schedule
+                self._push(entry, self._clock())
+                self._condition.notify()
+
+            group._starts.append(start)
+            group._pending -= 1
+
+            if group._pending > 0:
+                return
+
+            # the last member of the tick
+            group._cycles += 1
+            group._spread.append(max(group._starts) - min(group._starts))
+
+            if group._removed:
+                return
+
+            self._reschedule(group, deadline)
+
+        try:
+            group._on_frame(group.name, list(group.keys), barrier)
+        except Exception as e:
+            print("Exception '{}' caught while publishing snapshot group {}.".format(e, group.name))
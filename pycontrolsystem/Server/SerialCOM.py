@@ -1,4 +1,10 @@
+import asyncio
+import io
+import re
+import threading
 import time
+from collections import deque
+
 import serial
 
 
@@ -13,6 +19,10 @@ class COM(object):
     def port(self):
         return self._port
 
+    def send_messages(self, messages):
+        """ Sends several messages. Ports that can't pipeline just send them one after the other """
+        return [self.send_message(message) for message in messages]
+
 
 class FTDICOM(COM):
     def __init__(self, vend_prod_id, port_name, timeout=1.0, baud_rate=9600):
@@ -54,24 +64,342 @@ class FTDICOM(COM):
         return self.serial_number()
 
 
+class LineFramer(object):
+    """
+    Splits the byte stream coming from a serial port into responses. A response ends with '\\n' or '\\r'
+    (the terminator is kept). Empty frames (e.g. the '\\n' of a '\\r\\n' pair) are dropped.
+    """
+
+    def __init__(self):
+        self._terminators = re.compile(b'[\r\n]')
+        self._buffer = bytearray()
+        self._scan_from = 0
+
+    def reset(self):
+        self._buffer = bytearray()
+        self._scan_from = 0
+
+    def partial(self):
+        """ Returns the bytes of the current incomplete response """
+        return bytes(self._buffer)
+
+    def frame_length(self, match):
+        """ Length of the frame ending in the given terminator match, None if more bytes are needed """
+        return match.end()
+
+    def feed(self, data):
+        """ Adds data to the buffer and returns a list of all responses that are complete now """
+        self._buffer += data
+        frames = []
+
+        while True:
+            match = self._terminators.search(self._buffer, self._scan_from)
+
+            if match is None:
+                self._scan_from = len(self._buffer)
+                break
+
+            length = self.frame_length(match)
+
+            if length is None:
+                # wait for the rest of this frame
+                self._scan_from = match.start()
+                break
+
+            frame = bytes(self._buffer[:length])
+            del self._buffer[:length]
+            self._scan_from = 0
+
+            if frame.strip(b'\r\n'):
+                frames.append(frame)
+
+        return frames
+
+
+class ChecksumFramer(LineFramer):
+    """
+    Like the LineFramer, but a ';' also ends a response after two more bytes (e.g. the MFC checksum,
+    or the status word of the nAIM-S gauges).
+    """
+
+    def __init__(self):
+        LineFramer.__init__(self)
+        self._terminators = re.compile(b'[\r\n;]')
+
+    def frame_length(self, match):
+        if match.group() != b';':
+            return match.end()
+
+        if len(self._buffer) < match.end() + 2:
+            return None
+
+        return match.end() + 2
+
+
+framers = {'line': LineFramer,
+           'checksum': ChecksumFramer}
+
+
+class SerialEventLoop(object):
+    """ A single asyncio event loop (running in its own thread) that drives all serial ports """
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self):
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name='SerialEventLoop', daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def instance(cls):
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = SerialEventLoop()
+
+            return cls._instance
+
+    @property
+    def loop(self):
+        return self._loop
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    def submit(self, coro):
+        """ Schedules a coroutine on the event loop, returns a concurrent.futures.Future """
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def call(self, func, *args):
+        """ Runs func in the event loop thread and waits for the result """
+        async def _call():
+            return func(*args)
+
+        return self.submit(_call()).result()
+
+
+class SerialTransport(object):
+    """
+    Non-blocking transport for one serial port. Reads whatever bytes are available in bulk when the
+    port becomes readable, runs them through the framer and hands each response to the oldest
+    request still waiting. All methods have to be called from the event loop thread.
+    """
+
+    poll_interval = 0.002  # (s) used on platforms where serial ports can't be watched with add_reader
+
+    def __init__(self, ser, framer, loop, timeout):
+        self._ser = ser
+        self._framer = framer
+        self._loop = loop
+        self._timeout = timeout
+
+        self._pending = deque()  # futures waiting for a response, in the order of the requests
+        self._poll_handle = None
+        self._fd = None
+        self._watching = False
+        self._error = None  # the port failed, every request fails with this until it is closed
+
+    def open(self):
+        try:
+            self._fd = self._ser.fileno()
+            self._loop.add_reader(self._fd, self._on_readable)
+            self._watching = True
+        except (AttributeError, NotImplementedError, ValueError, io.UnsupportedOperation):
+            # e.g. Windows: no file descriptor for the port. Fall back to polling in_waiting.
+            self._poll_handle = self._loop.call_soon(self._poll)
+
+    def close(self):
+        self._stop_reading()
+        self._fail_pending(serial.SerialException("Port closed"))
+
+        self._ser.close()
+
+    def _stop_reading(self):
+        if self._watching:
+            self._loop.remove_reader(self._fd)
+            self._watching = False
+
+        if self._poll_handle is not None:
+            self._poll_handle.cancel()
+            self._poll_handle = None
+
+    def _on_readable(self):
+        try:
+            data = self._ser.read(self._ser.in_waiting or 1)
+        except (serial.SerialException, OSError) as e:
+            # e.g. unplugged: the fd stays readable, don't let it fire on the shared loop until the port is closed
+            self._error = e
+            self._stop_reading()
+            self._fail_pending(e)
+            return
+
+        if data:
+            self._feed(data)
+
+    def _poll(self):
+        self._poll_handle = None
+
+        try:
+            if self._ser.in_waiting:
+                self._feed(self._ser.read(self._ser.in_waiting))
+        except (serial.SerialException, OSError) as e:
+            # e.g. unplugged, stop polling until the port is closed
+            self._error = e
+            self._fail_pending(e)
+            return
+
+        self._poll_handle = self._loop.call_later(self.poll_interval, self._poll)
+
+    def _fail_pending(self, exception):
+        while self._pending:
+            fut = self._pending.popleft()
+            if not fut.done():
+                fut.set_exception(exception)
+
+    def _feed(self, data):
+        for frame in self._framer.feed(data):
+            # drop requests that timed out in the meantime
+            while self._pending and self._pending[0].done():
+                self._pending.popleft()
+
+            if not self._pending:
+                # Unsolicited response (nobody waiting), drop it
+                continue
+
+            self._pending.popleft().set_result(frame)
+
+    def _discard_stale_input(self):
+        if not self._pending:
+            # Nothing in flight, so anything in the buffers is stale
+            self._ser.reset_input_buffer()
+            self._ser.reset_output_buffer()
+            self._framer.reset()
+
+    def _expect(self):
+        fut = self._loop.create_future()
+        self._pending.append(fut)
+        return fut
+
+    def _timed_out(self, fut):
+        if fut in self._pending:
+            self._pending.remove(fut)
+
+        # The partial response is only reported. It stays in the framer: if another request is still
+        # waiting, these bytes may be the start of its response. Otherwise the next request discards them.
+        return self._framer.partial() + b'TIMEOUT'
+
+    async def request(self, data, expect_response, timeout=None):
+        """ Writes data to the port and (optionally) waits for the matching response """
+        if self._error is not None:
+            raise self._error
+
+        self._discard_stale_input()
+
+        self._ser.write(data)
+
+        if not expect_response:
+            return None
+
+        fut = self._expect()
+
+        try:
+            return await asyncio.wait_for(fut, self._timeout if timeout is None else timeout)
+        except asyncio.TimeoutError:
+            return self._timed_out(fut)
+
+    async def request_pipelined(self, requests):
+        """
+        Writes all (data, expect_response) requests back-to-back, then collects the responses, which
+        are matched to the requests by order (only for point-to-point ports whose device answers every
+        request in order). Every expected response gets one timeout period, so the whole batch never
+        takes longer than the same requests sent one at a time.
+        """
+        if self._error is not None:
+            raise self._error
+
+        # only when nothing is in flight, the input buffer may hold the start of a pending response
+        self._discard_stale_input()
+
+        futures = []
+        for data, expect_response in requests:
+            self._ser.write(data)
+            futures.append(self._expect() if expect_response else None)
+
+        deadline = self._loop.time() + self._timeout * max(1, sum(fut is not None for fut in futures))
+        responses = []
+
+        for fut in futures:
+            if fut is None:
+                responses.append(None)
+                continue
+
+            try:
+                responses.append(await asyncio.wait_for(fut, max(0.0, deadline - self._loop.time())))
+            except asyncio.TimeoutError:
+                responses.append(self._timed_out(fut))
+
+        return responses
+
+
 class SerialCOM(COM):
-    def __init__(self, arduino_id, port_name, timeout=1.0, baud_rate=115200):
+    def __init__(self, arduino_id, port_name, timeout=1.0, baud_rate=115200, framer=None,
+                 ready_probe=None, ready_timeout=3.0):
         """Summary
 
         Args:
             arduino_id (TYPE): Description
+            framer: splits the incoming bytes into responses. Defaults to a ChecksumFramer.
+            ready_probe: message sent after opening the port until the device answers it (at most
+                ready_timeout seconds). None: the device is ready right away.
         """
         COM.__init__(self, arduino_id, port_name, timeout, baud_rate)
 
+        if framer is None:
+            framer = ChecksumFramer()
+
+        self._event_loop = SerialEventLoop.instance()
+        self._transport = None
+
         try:
-            self._ser = serial.Serial(self._port, baudrate=self._baud_rate, timeout=self._timeout)
+            # timeout=0: reads never block, the event loop tells us when there is something to read
+            self._ser = serial.Serial(self._port, baudrate=self._baud_rate, timeout=0)
+            self._transport = SerialTransport(self._ser, framer, self._event_loop.loop, self._timeout)
+            self._event_loop.call(self._transport.open)
         except PermissionError:
             pass
 
-        time.sleep(1.0)
+        if ready_probe is not None and self._transport is not None:
+            if not self.wait_until_ready(ready_probe, ready_timeout):
+                print("Device {} on port {} did not answer within {} s.".format(arduino_id, port_name, ready_timeout))
+
+    def wait_until_ready(self, probe, timeout=3.0, probe_timeout=0.25):
+        """
+        Sends the probe message until the device gives a response that didn't time out, instead of
+        sleeping a fixed time after opening the port (e.g. while an Arduino resets). Returns False on
+        timeout.
+        """
+        deadline = time.monotonic() + timeout
+
+        while time.monotonic() < deadline:
+            t_probe = time.monotonic()
+
+            try:
+                response = self._event_loop.submit(
+                    self._transport.request(probe.encode(), True, probe_timeout)).result()
+            except Exception:
+                response = None
+
+            if response and not response.endswith(b'TIMEOUT'):
+                return True
+
+            # e.g. the port isn't readable yet, don't spin
+            time.sleep(max(0.0, probe_timeout - (time.monotonic() - t_probe)))
+
+        return False
 
     def close(self):
-        self._ser.close()
+        self._event_loop.call(self._transport.close)
 
     def get_device_id(self):
         """Summary
@@ -89,6 +417,29 @@ class SerialCOM(COM):
         """
         return self._port
 
+    async def _request(self, message):
+        response = await self._transport.request(message[0].encode(), message[1])
+
+        if response is None:
+            return "Didn't wait :P"
+
+        return response.decode()
+
+    async def _request_pipelined(self, messages):
+        responses = await self._transport.request_pipelined([(message[0].encode(), message[1])
+                                                             for message in messages])
+
+        return ["Didn't wait :P" if response is None else response.decode() for response in responses]
+
+    def send_message_async(self, message):
+        """
+        Sends a (message, wait_for_response) tuple without blocking.
+
+        Returns:
+            concurrent.futures.Future: resolves to the decoded response
+        """
+        return self._event_loop.submit(self._request(message))
+
     def send_message(self, message):
         """Summary
 
@@ -100,42 +451,26 @@ class SerialCOM(COM):
         """
 
         try:
+            return self.send_message_async(message).result()
 
-            self._ser.reset_input_buffer()
-            self._ser.reset_output_buffer()
-
-            self._ser.write(message[0].encode())
-
-            # Our own 'readline()' function
-            response = b''
-
-            if message[1]:
+        except Exception as e:
+            raise Exception("Something's wrong! Exception in SerialCOM: {}".format(e))
 
-                start_time = time.time()
-                while not (time.time() - start_time) > self._timeout:
-                    resp = self._ser.read(1)
-                    if resp:
-                        response += bytes(resp)
-                        if resp in [b'\n', b'\r']:
-                            break
-                        elif resp == b';':
-                            # Handle MFC Readout (read in two more bytes for checksum and break)
-                            response += bytes(self._ser.read(2))
-                            break
-                else:  # thanks, python
-                    response += b'TIMEOUT'
+    def send_messages(self, messages):
+        """
+        Pipelined version of send_message: writes all messages back-to-back without waiting for the
+        individual responses in between.
 
-            else:
-                response += b"Didn't wait :P"
+        Returns:
+            list: the decoded responses, in the order of the messages
+        """
 
-            if len(response) != 0:
-                return response.decode()
+        try:
+            return self._event_loop.submit(self._request_pipelined(messages)).result()
 
         except Exception as e:
             raise Exception("Something's wrong! Exception in SerialCOM: {}".format(e))
 
-        return ""
-
 
 if __name__ == "__main__":
     pass
@@ -2,18 +2,26 @@ import sys
 from multiprocessing import Process, Pipe
 import threading
 import json
-import queue
+import hashlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
 # import time
-from datetime import datetime
 from collections import deque
 # import logging
 
-from flask import Flask, request
+from flask import Flask, request, Response
 import numpy as np
 
 from .DeviceDriver import driver_mapping
 from .SerialCOM import *
 from .DeviceFinder import *
+from .Scheduler import PollingScheduler
+from .Metrics import DeviceMetrics, format_prometheus
+from .Interlock import InterlockEngine
+from .CommandQueue import SetCommandQueue, priorities, PRIORITY_USER
+from .RateController import AdaptiveRateController
+from .Streaming import Subscription, sse_event, sse_keepalive
+from ..WireFormat import encode_schema, encode_data, encode_error, encode_keepalive, NonNumericValue
 
 
 if 'Windows' not in myplatform:
@@ -23,25 +31,34 @@ if 'Windows' not in myplatform:
 class DeviceManager(object):
     """ Handles sending/receiving messages for each device """
 
-    def __init__(self, serial_number, driver, com, max_polling_rate=50.0):
+    def __init__(self, serial_number, driver, com, max_polling_rate=50.0, pipelined=False, min_polling_rate=1.0):
         self._serial_number = serial_number
         self._driver = driver
         self._com = com
 
+        # pipelined devices get all messages of a query/set command back-to-back (see driver_mapping)
+        self._pipelined = pipelined
+
         # the generic query message which is sent every time the user queries the device
         self._query_message = {}
         self._query_device_data = {}  # some devices need this to translate the response back
+        self._query_message_keys = {}  # only re-translate the query message if these change
 
         # device's current values (response to query command)
         self._current_values = {}
 
         # polling rate for this device
-        self._polling_rate = 0
         self._com_times = deque(maxlen=20)
-        self._polling_rate_max = max_polling_rate  # Hz
+        self._com_times_sum = 0.0
+        self._rate_controller = AdaptiveRateController(min_polling_rate, max_polling_rate)  # Hz
+        self._last_poll_time = None
+
+        self._set_command_queue = SetCommandQueue()
+
+        self._metrics = DeviceMetrics()
 
-        self._set_command_queue = queue.Queue()
-        self._terminate = False
+        # callables listener(serial_number, device_id, values) that get every new response
+        self._listeners = []
 
     @property
     def driver(self):
@@ -53,15 +70,27 @@ class DeviceManager(object):
 
     @property
     def polling_rate(self):
-        return self._polling_rate
+        if self._com_times_sum <= 0.0:
+            return 0
+
+        return len(self._com_times) / self._com_times_sum
+
+    @property
+    def metrics(self):
+        return self._metrics
 
     @property
     def polling_rate_max(self):
-        return self._polling_rate_max
+        return self._rate_controller.max_rate
 
     @polling_rate_max.setter
     def polling_rate_max(self, polling_rate_max):
-        self._polling_rate_max = polling_rate_max
+        self._rate_controller.max_rate = polling_rate_max
+
+    @property
+    def polling_rate_target(self):
+        """ The rate negotiated with the device, the scheduler polls it at this rate """
+        return self._rate_controller.rate
 
     @property
     def current_values(self):
@@ -78,75 +107,270 @@ class DeviceManager(object):
     @query_message.setter
     def query_message(self, device_data):
         device_id = device_data['device_id']
+
+        # the tuple itself, a hash could collide
+        key = (device_data['device_driver'],
+               device_id,
+               tuple(device_data['channel_ids']),
+               tuple(device_data['precisions']))
+
+        if self._query_message_keys.get(device_id) == key:
+            # the client sends the same query every time, no need to translate it again
+            return
+
         self._query_device_data[device_id] = device_data
         self._query_message[device_id] = self._driver.translate_gui_to_device(device_data)
+        self._query_message_keys[device_id] = key
 
     def add_command_to_queue(self, cmd):
-        self._set_command_queue.put(cmd)
-
-    def run(self):
-        while not self._terminate:
-
-            t1 = datetime.now()
-
-            self._waiting_for_resp = True
-
-            if not self._set_command_queue.empty():
-                # try to send the command to the device
-                cmd = self._set_command_queue.get_nowait()
-
-                msgs = self._driver.translate_gui_to_device(cmd)
-                # print(msgs)
-                for msg in msgs:
-                    # this takes some time
-                    try:
-                        device_response = self._com.send_message(msg)
-                    except Exception as e:
-                        # print('Unable to send set message! Exception: {}'.format(e))
-                        device_response = 'Error, got exception {}'.format(e)
-            else:
-                # update the device's current values
-                # this could take some time
-                if self._query_message is not None:
-                    for device_id, query_message in self._query_message.items():
-                        com_resp_list = []
-                        for msg in query_message:
-                            try:
-                                com_resp = self._com.send_message(msg)
-                                com_resp_list.append(com_resp)
-                            except Exception as e:
-                                com_resp_list.append(None)
-
-                        try:
-                            resp = self._driver.translate_device_to_gui(
-                                com_resp_list, self._query_device_data[device_id])
-                        except:
-                            continue
-
-                        # add additional info to be shown in the GUI
-                        resp['timestamp'] = time.time()
-                        resp['polling_rate'] = self._polling_rate
-
-                        self._current_values[device_id] = resp
-
-            t2 = datetime.now()
-
-            delta = (t2 - t1).total_seconds()
-
-            # check if elapsed time is < 1/maximum polling rate. If true, sleep for the difference
-            if 1.0 > self._polling_rate_max * delta:
-                time.sleep(1.0 / self._polling_rate_max - delta)
-
-            self._com_times.append((datetime.now() - t1).total_seconds())
-            self.update_polling_rate()
+        """ cmd['priority'] (optional) is one of 'emergency', 'interlock', 'user' (default) """
+        priority = priorities.get(cmd.pop('priority', 'user'), PRIORITY_USER)
 
-        self._com.close()
+        if self._set_command_queue.put(cmd, priority):
+            self._metrics.count_coalesced_set()
+
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        try:
+            self._listeners.remove(listener)
+        except ValueError:
+            pass
+
+    def notify_listeners(self, device_id, values):
+        for listener in list(self._listeners):
+            listener(self._serial_number, device_id, values)
+
+    def poll(self, snapshot=None):
+        """
+        Runs a single communication cycle. Called by the PollingScheduler at this device's polling rate.
+        If the device is in a snapshot group, snapshot is the group's barrier time (wall clock), the
+        responses of this cycle get it as their timestamp.
+        """
+        self._start_cycle()
+
+        if not self._set_command_queue.empty():
+            # try to send the command to the device
+            self._send_set_command()
+
+            if snapshot is None:
+                return
+
+            # the snapshot group's frame would be missing this device, query anyway
+
+        # update the device's current values
+        # this could take some time
+        t_query = time.monotonic()
+        failures = self._failure_count()
+
+        if self._query_message:
+            for device_id, query_message in list(self._query_message.items()):
+                self._query(device_id, query_message, snapshot=snapshot)
+
+            # adapt the polling rate to how long this cycle took and whether the device answered
+            self._rate_controller.update(time.monotonic() - t_query, self._failure_count() - failures)
 
-    def update_polling_rate(self):
-        self._polling_rate = 1.0 / np.mean(self._com_times)
+    def _start_cycle(self):
+        t1 = time.monotonic()
+
+        if self._last_poll_time is not None:
+            self.update_polling_rate(t1 - self._last_poll_time)
+
+        self._last_poll_time = t1
+
+        self._metrics.set_queue_depth.add(self._set_command_queue.qsize())
+
+    def _failure_count(self):
+        return self._metrics.timeouts + self._metrics.exceptions
+
+    def _send_set_command(self):
+        """ Sends the most urgent set command of the queue """
+        cmd, age = self._set_command_queue.get_nowait()
+        self._metrics.set_queue_age.add(age)
+
+        t_translate = time.monotonic()
+        msgs = self._driver.translate_gui_to_device(cmd)
+        self._metrics.translate_time.add(time.monotonic() - t_translate)
+        # print(msgs)
+        if self._pipelined:
+            device_response = self._send_messages(msgs)
+        else:
+            for msg in msgs:
+                # this takes some time
+                device_response = self._send_message(msg)
+
+    def _query(self, device_id, query_message, snapshot=None):
+        """
+        Queries one device on this port and updates its current values.
+        Returns False if the device didn't answer properly
+        """
+        t_start = time.time()
+
+        if self._pipelined:
+            com_resp_list = self._send_messages(query_message)
+        else:
+            com_resp_list = [self._send_message(msg) for msg in query_message]
+
+        t_end = time.time()
+
+        answered = all(response is not None and not (isinstance(response, str) and response.endswith('TIMEOUT'))
+                       for response in com_resp_list)
+
+        t_translate = time.monotonic()
+        try:
+            resp = self._driver.translate_device_to_gui(
+                com_resp_list, self._query_device_data[device_id])
+        except:
+            self._metrics.count_exception()
+            return False
+        finally:
+            self._metrics.translate_time.add(time.monotonic() - t_translate)
+
+        # add additional info to be shown in the GUI
+        if snapshot is None:
+            resp['timestamp'] = time.time()
+        else:
+            # all devices of the snapshot group get the same timestamp, so their values line up
+            resp['timestamp'] = snapshot
+            resp['snapshot'] = True
+
+        # wall clock time the request went out and the response was complete
+        resp['t_start'] = t_start
+        resp['t_end'] = t_end
+        resp['polling_rate'] = self.polling_rate
+        resp['polling_rate_target'] = self.polling_rate_target
+
+        self._current_values[device_id] = resp
+        self.notify_listeners(device_id, resp)
+
+        return answered
+
+    def _send_message(self, msg):
+        """ Sends one message, recording its round-trip time. Returns None if the com port raised """
+        t_send = time.monotonic()
+        try:
+            response = self._com.send_message(msg)
+        except Exception as e:
+            # print('Unable to send message! Exception: {}'.format(e))
+            self._metrics.count_exception()
+            return None
+
+        self._metrics.round_trip_time.add(time.monotonic() - t_send)
+        self._count_timeouts([response])
+
+        return response
+
+    def _send_messages(self, msgs):
+        """ Pipelined version of _send_message, the round-trip time is the one of the whole batch """
+        t_send = time.monotonic()
+        try:
+            responses = self._com.send_messages(msgs)
+        except Exception as e:
+            self._metrics.count_exception()
+            return [None] * len(msgs)
+
+        self._metrics.round_trip_time.add(time.monotonic() - t_send)
+        self._count_timeouts(responses)
+
+        return responses
+
+    def _count_timeouts(self, responses):
+        for response in responses:
+            if isinstance(response, str) and response.endswith('TIMEOUT'):
+                self._metrics.count_timeout()
+
+    def update_polling_rate(self, interval):
+        # keep a running sum instead of averaging the whole deque every cycle
+        if len(self._com_times) == self._com_times.maxlen:
+            self._com_times_sum -= self._com_times[0]
+
+        self._com_times.append(interval)
+        self._com_times_sum += interval
 
     def terminate(self):
-        self._terminate = True
+        """ Close the port. The device has to be removed from the scheduler first """
+        for device_id in self._query_message.keys():
+            self.notify_listeners(device_id, None)
+
+        self._com.close()
+
+
+class BusManager(DeviceManager):
+    """
+    DeviceManager for a port that is shared by several addressed devices (RS485 bus of MFCs, Matsusada
+    master/slave supplies, see 'bus' in driver_mapping). The device ids of the query messages are the
+    bus addresses. Compared to the plain DeviceManager:
+    - Set commands (at most sets_per_cycle) share a cycle with the queries instead of replacing the
+      whole query sweep, so a stream of sets can't starve the queries.
+    - The addresses are queried round-robin, each cycle starting one address later.
+    - An address that doesn't answer is skipped for 1, 2, 4, ... (up to max_backoff) cycles, so a dead
+      device doesn't eat the bus time of the others. Only its first failure slows down the whole bus.
+    """
+
+    def __init__(self, *args, sets_per_cycle=2, max_backoff=32, **kwargs):
+        super(BusManager, self).__init__(*args, **kwargs)
+
+        self._sets_per_cycle = sets_per_cycle
+        self._max_backoff = max_backoff
+
+        self._next_address = 0
+        self._backoff = {}  # address -> cycles it is skipped after the next failure
+        self._skip = {}  # address -> cycles it is still skipped
+
+    def poll(self, snapshot=None):
+        self._start_cycle()
+
+        for _ in range(self._sets_per_cycle):
+            if self._set_command_queue.empty():
+                break
+
+            self._send_set_command()
+
+        addresses = self._due_addresses()
+        if not addresses:
+            return
+
+        t_query = time.monotonic()
+        failures = 0
+
+        for address in addresses:
+            answered = self._query(address, self._query_message[address], snapshot=snapshot)
+            failures += self._update_backoff(address, answered)
+
+        self._rate_controller.update(time.monotonic() - t_query, failures)
+
+    def _due_addresses(self):
+        """ Addresses to query in this cycle, in round-robin order """
+        addresses = list(self._query_message.keys())
+        if not addresses:
+            return []
+
+        start = self._next_address % len(addresses)
+        self._next_address = start + 1
+
+        due = []
+        for address in addresses[start:] + addresses[:start]:
+            if self._skip.get(address, 0) > 0:
+                self._skip[address] -= 1
+                continue
+
+            due.append(address)
+
+        return due
+
+    def _update_backoff(self, address, answered):
+        """ Returns 1 if this is the first failure of the address, 0 otherwise """
+        if answered:
+            self._backoff.pop(address, None)
+            self._skip.pop(address, None)
+            return 0
+
+        backoff = self._backoff.get(address, 0)
+        self._backoff[address] = min(self._max_backoff, 2 * backoff if backoff else 1)
+        self._skip[address] = self._backoff[address]
+
+        return 0 if backoff else 1
 
 
 def serial_watchdog(com_pipe, debug, port_identifiers):
@@ -248,9 +472,16 @@ _watch_proc.daemon = True
 _keep_communicating = False
 _initialized = False
 _devices = {}
-_threads = {}
+_scheduler = PollingScheduler()
+_interlocks = InterlockEngine(_devices)
+_hotplug_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix='Hotplug')  # device bring-up/teardown
 _ftdi_serial_port_mapping = {}  # gui uses serial numbers, server uses ports
 _current_responses = {}
+_query_configs = OrderedDict()  # version -> device list posted to /device/query (see query_device)
+_max_query_configs = 16
+_query_configs_lock = threading.Lock()  # flask serves the requests from several threads
+_stream_keepalive = 5.0  # (s) send a keepalive comment if a stream had no new values for this long
+_snapshot_subscriptions = []  # streams get the responses of a snapshot group tick as one frame
 
 
 @app.route("/initialize/")
@@ -262,8 +493,9 @@ def initialize():
         return "Server has already been initialized"
     else:
         _keep_communicating = True
-        threading.Timer(0.1, listen_to_pipe).start()
-        time.sleep(0.2)  # Need to wait a little for the thread to be ready to receive initial info of watchdog
+        _scheduler.start()
+        # the pipe buffers the watchdog's messages until the listener gets to them
+        threading.Thread(target=listen_to_pipe, name='HotplugListener', daemon=True).start()
         _initialized = True
 
         if not _watch_proc.is_alive():
@@ -275,19 +507,53 @@ def initialize():
 
 @app.route("/device/set", methods=['GET', 'POST'])
 def set_value_on_device():
+    """ Queues set commands. The posted data is a single command or a list of commands (sent in order) """
     # Load the data stream
-    device_data = json.loads(request.form['data'])
-    device_data["set"] = True
+    data = json.loads(request.form['data'])
+
+    if isinstance(data, dict):
+        data = [data]
 
-    # For reference: This is the message from the GUI:
+    # For reference: This is a message from the GUI:
     # device_data = {'device_driver': device_driver_name,
     #                'device_id': device_id,
     #                'locked_by_server': False,
     #                'channel_ids': [channel_ids],
     #                'precisions': [precisions],
     #                'values': [values],
-    #                'data_types': [types]}
+    #                'data_types': [types],
+    #                'priority': 'user'}
+
+    errors = []
+    for device_data in data:
+        device_data["set"] = True
+
+        client_side_device_id, server_side_device_id, slave_device_id = resolve_device_ids(device_data)
 
+        if server_side_device_id is None:
+            # device not foundin driver list
+            errors.append("ERROR: Device Driver not found in driver_mapping")
+            continue
+
+        device_data['device_id'] = slave_device_id
+
+        try:
+            _devices[server_side_device_id].add_command_to_queue(device_data)
+        except KeyError:
+            errors.append("ERROR: Device {} not found on server".format(client_side_device_id))
+
+    if errors:
+        return "\n".join(errors)
+
+    return 'Command sent to device' if len(data) == 1 else '{} commands sent to devices'.format(len(data))
+
+
+def resolve_device_ids(device_data):
+    """
+    Translates the client side device id of a query/set message into the server side device id.
+    Returns (client side device id, server side device id, device id on the server side device) and
+    updates device_data['device_id'] accordingly. The server side id is None if the driver is unknown.
+    """
     # --- Handle the various id numbers:
     # Server side, we use <vid>_<pid>_<id> for now, but a better system is necessary!
     # Some devices are master/slave (like the Matsusada CO series)
@@ -301,77 +567,63 @@ def set_value_on_device():
     driver_name = device_data["device_driver"]
     if driver_name not in driver_mapping.keys():
         # device not foundin driver list
-        return "ERROR: Device Driver not found in driver_mapping"
-    else:
+        return client_side_device_id, None, None
 
-        if len(device_id_parts) > 1:
-            slave_device_id = device_id_parts[1]
-            device_data['device_id'] = device_id_parts[1]
-        else:
-            slave_device_id = master_device_id
+    if len(device_id_parts) > 1:
+        slave_device_id = device_id_parts[1]
+        device_data['device_id'] = device_id_parts[1]
+    else:
+        slave_device_id = master_device_id
 
-        vidpid = driver_mapping[driver_name]["vid_pid"]
-        server_side_device_id = "{}_{}_{}".format(int(vidpid[0]), int(vidpid[1]), master_device_id)
+    vidpid = driver_mapping[driver_name]["vid_pid"]
+    server_side_device_id = "{}_{}_{}".format(int(vidpid[0]), int(vidpid[1]), master_device_id)
+    # print("vidpid_id:", server_side_device_id)
 
-        # print("vidpid_id:", server_side_device_id)
+    return client_side_device_id, server_side_device_id, slave_device_id
 
-        device_data['device_id'] = slave_device_id
 
-        _devices[server_side_device_id].add_command_to_queue(device_data)
+@app.route("/device/query", methods=['GET', 'POST'])
+def query_device():
+    """
+    Returns the current values of the devices in the posted device list. The response carries an ETag
+    (the version of that device list). Clients can send the ETag in an If-Match header instead of
+    posting the device list again, as long as their devices/channels didn't change. If the server
+    doesn't know the version (anymore), it answers 412 and the client has to post the list again.
+    """
+    if 'data' in request.form:
+        config_version = hashlib.sha1(request.form['data'].encode()).hexdigest()
+        data = json.loads(request.form['data'])
 
-    # set_cmd['device_id'] = old_device_id
+        with _query_configs_lock:
+            if config_version not in _query_configs:
+                _query_configs[config_version] = data
 
-    '''
-    if _mydebug:
-        print("The message to the device is: {}".format(msg)
-              
-    try:
-        print(msg)
-        for cmd in msg:
-            device_response = _comms[port_id].send_message(cmd)
+                while len(_query_configs) > _max_query_configs:
+                    _query_configs.popitem(last=False)
 
-    except Exception as e:
-        device_response = "Error, exception happened: {}".format(e)
+    else:
+        config_version = None
 
-    return json.dumps(device_response)
-    '''
-    return 'Command sent to device'
+        with _query_configs_lock:
+            for etag in request.if_match.as_set():
+                if etag in _query_configs:
+                    config_version = etag
+                    data = _query_configs[etag]
+                    break
 
+        if config_version is None:
+            return "ERROR: Unknown device configuration, send the device list", 412
 
-@app.route("/device/query", methods=['GET', 'POST'])
-def query_device():
-    # Load the data stream
-    data = json.loads(request.form['data'])
     devices_responses = {}
     for i, device_data in enumerate(data):
+        device_data = dict(device_data)
         device_data['set'] = False
 
-        # --- Handle the various id numbers:
-        # Server side, we use <vid>_<pid>_<id> for now, but a better system is necessary!
-        # Some devices are master/slave (like the Matsusada CO series)
-        # For those we need to send commands to the master only
-        # e.g. if serial number is XXXXXX_2, we look for device XXXXXX, and
-        # device data should then use only the '2' as the id.
-        client_side_device_id = device_data['device_id']
-        device_id_parts = client_side_device_id.split("_")
-        master_device_id = device_id_parts[0]
-
-        driver_name = device_data["device_driver"]
-        if driver_name not in driver_mapping.keys():
-            # device not foundin driver list
+        client_side_device_id, server_side_device_id, slave_device_id = resolve_device_ids(device_data)
+
+        if server_side_device_id is None:
             devices_responses[client_side_device_id] = "ERROR: Device Driver not found in driver_mapping"
         else:
-
-            if len(device_id_parts) > 1:
-                slave_device_id = device_id_parts[1]
-                device_data['device_id'] = device_id_parts[1]
-            else:
-                slave_device_id = master_device_id
-
-            vidpid = driver_mapping[driver_name]["vid_pid"]
-            server_side_device_id = "{}_{}_{}".format(int(vidpid[0]), int(vidpid[1]), master_device_id)
-            # print("vidpid_id:", server_side_device_id)
-
             try:
                 _devices[server_side_device_id].query_message = device_data
                 devices_responses[client_side_device_id] = \
@@ -382,117 +634,350 @@ def query_device():
 
     global _current_responses
     _current_responses = json.dumps(devices_responses)
-    return _current_responses
+
+    response = Response(_current_responses)
+    response.set_etag(config_version)
+
+    return response
+
+
+@app.route("/device/stream", methods=['POST'])
+def stream_devices():
+    """
+    Push alternative to /device/query: The client subscribes once with the same device list and
+    gets a Server-Sent Event whenever a device has new values, {client side device id: values}.
+    With format=binary, the values are sent as WireFormat frames instead of JSON events.
+    """
+    data = json.loads(request.form['data'])
+    stream_format = request.form.get('format', 'json')
+    subscription = Subscription()
+    managers = []
+
+    # for the binary format: devices and channels are referred to by their index in the subscription
+    schema_devices = [device_data['device_id'] for device_data in data]
+    schema_channels = [device_data['channel_ids'] for device_data in data]
+    device_indices = {device_id: i for i, device_id in enumerate(schema_devices)}
+    channel_indices = [{channel_id: j for j, channel_id in enumerate(channel_ids)}
+                       for channel_ids in schema_channels]
+
+    for device_data in data:
+        device_data['set'] = False
+
+        client_side_device_id, server_side_device_id, slave_device_id = resolve_device_ids(device_data)
+
+        if server_side_device_id is None:
+            subscription.push_error(client_side_device_id, "ERROR: Device Driver not found in driver_mapping")
+            continue
+
+        try:
+            manager = _devices[server_side_device_id]
+        except KeyError:
+            subscription.push_error(client_side_device_id, "ERROR: Device not found on server")
+            continue
+
+        manager.query_message = device_data
+        subscription.add_route(server_side_device_id, slave_device_id, client_side_device_id)
+
+        if manager not in managers:
+            manager.add_listener(subscription.on_device_update)
+            managers.append(manager)
+
+    _snapshot_subscriptions.append(subscription)
+
+    def unsubscribe():
+        subscription.close()
+        _snapshot_subscriptions.remove(subscription)
+        for _manager in managers:
+            _manager.remove_listener(subscription.on_device_update)
+
+    def generate():
+        try:
+            while _keep_communicating and not subscription.closed:
+                updates = subscription.get(timeout=_stream_keepalive)
+
+                if updates:
+                    yield sse_event(updates)
+                else:
+                    yield sse_keepalive()
+        finally:
+            # client disconnected (or server shutting down)
+            unsubscribe()
+
+    def encode_updates(updates):
+        frames = []
+        for client_side_device_id, values in updates.items():
+            device_index = device_indices[client_side_device_id]
+
+            if not isinstance(values, dict):
+                frames.append(encode_error(device_index, values))
+                continue
+
+            indices = channel_indices[device_index]
+            channels = [channel_id for channel_id in values.keys() if channel_id in indices]
+
+            try:
+                frames.append(encode_data(device_index, values['timestamp'], values.get('polling_rate', 0.0),
+                                          [indices[channel_id] for channel_id in channels],
+                                          [values[channel_id] for channel_id in channels],
+                                          t_start=values.get('t_start', np.nan), t_end=values.get('t_end', np.nan)))
+            except NonNumericValue as e:
+                # same message the client gives for the JSON stream, it locks the device
+                frames.append(encode_error(device_index, "ERROR: Got '{}' for channel {}".format(
+                    e.value, schema_channels[device_index][e.channel_index])))
+
+        return b''.join(frames)
+
+    def generate_binary():
+        try:
+            yield encode_schema(schema_devices, schema_channels)
+
+            while _keep_communicating and not subscription.closed:
+                updates = subscription.get(timeout=_stream_keepalive)
+
+                if updates:
+                    yield encode_updates(updates)
+                else:
+                    yield encode_keepalive()
+        finally:
+            unsubscribe()
+
+    if stream_format == 'binary':
+        return Response(generate_binary(), mimetype='application/octet-stream')
+
+    return Response(generate(), mimetype='text/event-stream')
+
+
+@app.route("/snapshot/group", methods=['POST'])
+def set_snapshot_group():
+    """
+    Polls the devices of the posted device list (same format as for /device/query) as one snapshot
+    group, at 'rate' (Hz) at most: the scheduler triggers all of them at the same barrier time and
+    their responses get that time as timestamp (t_start/t_end are when the request went out and the
+    response was complete). Streams get the responses of every tick as one event.
+    A rate <= 0 or an empty device list removes the group. Returns the server side device ids of the group.
+    """
+    name = request.form.get('name', 'snapshot')
+    rate = float(request.form.get('rate', 0.0))
+    data = json.loads(request.form.get('data', '[]'))
+
+    keys = []
+    for device_data in data:
+        device_data['set'] = False
+
+        _, server_side_device_id, _ = resolve_device_ids(device_data)
+
+        if server_side_device_id is None or server_side_device_id in keys:
+            continue
+
+        # devices that aren't connected yet join the group when they show up
+        keys.append(server_side_device_id)
+
+        if server_side_device_id in _devices:
+            _devices[server_side_device_id].query_message = device_data
+
+    if rate <= 0.0 or not keys:
+        _scheduler.remove_group(name)
+        return json.dumps([])
+
+    _scheduler.add_group(name, keys, rate, publish_snapshot)
+
+    return json.dumps(keys)
+
+
+def publish_snapshot(name, keys, timestamp):
+    """ Called by the scheduler after every tick of a snapshot group, hands its responses to the streams """
+    frame = []
+    for key in keys:
+        try:
+            current_values = list(_devices[key].current_values.items())
+        except KeyError:
+            continue
+
+        for device_id, values in current_values:
+            # devices that didn't answer in this tick still have the values of an older one
+            if values.get('timestamp') == timestamp:
+                frame.append((key, device_id, values))
+
+    for subscription in list(_snapshot_subscriptions):
+        subscription.on_frame(frame)
+
+
+@app.route("/interlock/load", methods=['POST'])
+def load_interlocks():
+    """
+    Loads the basic procedures of the posted session json (same format as the client's session file)
+    as interlocks, replacing the ones loaded before. Returns the names of the loaded procedures.
+    """
+    session = json.loads(request.form['data'])
+    names = _interlocks.load(session, resolve_device_ids)
+
+    return json.dumps(names)
+
+
+@app.route("/interlock/status")
+def interlock_status():
+    """
+    Returns {name: reason} of the loaded interlocks the server can't act on right now, because a device
+    is missing, a rule has no value yet or an action had to be dropped. The client does their actions.
+    """
+    return json.dumps(_interlocks.status())
 
 
 @app.route("/device/active/")
 def all_devices():
     global _devices
     ports = {}
-    for _id, dm in _devices.items():
-        ports[_id] = [dm.port, dm.polling_rate, dm.driver.get_driver_name()]
+    for _id, dm in list(_devices.items()):
+        ports[_id] = [dm.port, dm.polling_rate, dm.driver.get_driver_name(), _scheduler.stats(_id),
+                      dm.metrics.summary(), dm.polling_rate_target]
     return json.dumps(ports)
 
 
+@app.route("/metrics")
+def metrics():
+    """ Per-device latency, error and queue metrics in the Prometheus text format """
+    devices = [({'device': _id, 'driver': dm.driver.get_driver_name(), 'port': dm.port}, dm.metrics, dm.polling_rate,
+                dm.polling_rate_target)
+               for _id, dm in list(_devices.items())]
+
+    return Response(format_prometheus(devices), mimetype='text/plain; version=0.0.4')
+
+
 def listen_to_pipe():
-    global _devices
-    global _threads
-    global _ftdi_serial_port_mapping
+    """
+    Runs in a long-lived thread (started by initialize) and blocks on the watchdog pipe, so device
+    adds/removes are applied as soon as the watchdog reports them
+    """
     global _keep_communicating
 
-    if _pipe_server.poll(1):
+    while _keep_communicating:
+        if not _pipe_server.poll(1):
+            continue
+
         gui_message = _pipe_server.recv()
 
         if gui_message == 'shutdown':
             _keep_communicating = False
             shutdown()
+            return
 
         if gui_message[0] == "updated_list":
 
             if _mydebug:
                 print("Updating ports/ids in main server")
 
-            message_info = gui_message[1]
-            for name, finder_result in message_info.items():
-                if name == 'serial':
-                    # for key, val in finder_result['current'].items():
-                    #     continue
-                    _obsolete = finder_result['obsolete']
-                    _added = finder_result['added']
-
-                    for _key in _obsolete.keys():
-                        # gracefully remove devices/threads
-                        print('Shutting down device {}'.format(_key))
-                        _devices[_key].terminate()
-                        _threads[_key].join()
-                        if not _threads[_key].is_alive():
-                            print('Removing device {}'.format(_key))
-                            del _devices[_key]
-                            del _threads[_key]
-
-                    for _key, _port_info in _added.items():
-                        # add devices/threads
-                        _baud_rate = driver_mapping[_port_info["identifier"]]["baud_rate"]
-                        print('Adding device {} on port {} with baud rade {}'.format(_key, _port_info, _baud_rate))
-
-                        com = SerialCOM(arduino_id=_key,
-                                        port_name=_port_info["port"],
-                                        baud_rate=_baud_rate,
-                                        timeout=1.0)
-
-                        drv = driver_mapping[_port_info["identifier"]]['driver']()
-                        mpr = driver_mapping[_port_info["identifier"]].get('max_polling_rate', 50)
-                        _devices[_key] = DeviceManager(_key, drv, com, max_polling_rate=mpr)
-                        _threads[_key] = threading.Thread(target=_devices[_key].run)
-                        _threads[_key].start()
-
-                elif name == 'ftdi':
-                    # for key, val in finder_result['current'].items():
-                        # if key in _ids_by_ports.keys():
-                        #    # don't overwrite anything that is already present
-                        #    # because we want to keep the serial number that was
-                        #    # created when the device was added the first time
-                        # continue
-                    _obsolete = finder_result['obsolete']
-                    _added = finder_result['added']
-
-                    for _key in _obsolete.keys():
-                        print('Shutting down device {}'.format(_key))
-                        sn = _ftdi_serial_port_mapping[_key]
-                        _devices[sn].terminate()
-                        _threads[sn].join()
-                        if not _threads[sn].is_alive():
-                            print('Removing device {}'.format(sn))
-                            del _devices[sn]
-                            del _threads[sn]
-                    for _key, _port_info in _added.items():
-                        print('Adding device {} on port {}'.format(_key, _port_info))
-                        _baud_rate = driver_mapping[_port_info['identifier']]['baud_rate']
-                        found = False
-                        it = 0
-                        while not found:
-                            try:
-                                com = FTDICOM(vend_prod_id=_port_info['vend_prod'],
-                                              port_name=it,
-                                              baud_rate=_baud_rate,
-                                              timeout=1.0)
-                                found = True
-                            except DeviceError:
-                                it += 1
-                                if it > 10:
-                                    sys.exit()
-                        # we can only get the serial number after creating the com
-                        # object, but we still want to use it as the key for everything
-                        # since the user will put it in the gui
-                        sn = com.serial_number()
-                        _ftdi_serial_port_mapping[_key] = sn
-                        drv = driver_mapping[_port_info["identifier"]]['driver']()
-                        _devices[sn] = DeviceManager(sn, drv, com)
-                        _threads[sn] = threading.Thread(target=_devices[sn].run)
-                        _threads[sn].start()
-
-    if _keep_communicating:
-        threading.Timer(0.5, listen_to_pipe).start()
+            try:
+                apply_device_changes(gui_message[1])
+            except Exception as e:
+                print("Exception '{}' caught while updating devices.".format(e))
+
+
+def apply_device_changes(message_info):
+    """
+    Tears down the obsolete and brings up the added devices of the watchdog's finder results. Both
+    run in parallel on the hotplug pool, so the devices don't wait for each other's port setup.
+    All removals are done before the first device is added (a device may be removed and added again).
+    """
+    removals = []
+    for name, finder_result in message_info.items():
+        if name == 'serial':
+            removals += list(finder_result['obsolete'].keys())
+        elif name == 'ftdi':
+            for _key in finder_result['obsolete'].keys():
+                removals.append(_ftdi_serial_port_mapping.pop(_key))
+
+    _wait_for_hotplug([_hotplug_pool.submit(remove_device_manager, _key) for _key in removals])
+
+    additions = []
+    for name, finder_result in message_info.items():
+        if name == 'serial':
+            additions += [_hotplug_pool.submit(add_serial_device, _key, _port_info)
+                          for _key, _port_info in finder_result['added'].items()]
+        elif name == 'ftdi' and finder_result['added']:
+            # FTDICOM tries the ports one after the other, so all FTDI devices are added by one task
+            additions.append(_hotplug_pool.submit(add_ftdi_devices, finder_result['added']))
+
+    _wait_for_hotplug(additions)
+
+
+def _wait_for_hotplug(futures):
+    wait(futures)
+
+    for future in futures:
+        if future.exception() is not None:
+            print("Exception '{}' caught while adding/removing a device.".format(future.exception()))
+
+
+def remove_device_manager(_key):
+    # gracefully remove devices/threads
+    print('Shutting down device {}'.format(_key))
+    _scheduler.remove_device(_key)
+    _devices[_key].terminate()
+    print('Removing device {}'.format(_key))
+    del _devices[_key]
+
+
+def add_device_manager(_key, _identifier, com, **kwargs):
+    drv = driver_mapping[_identifier]['driver']()
+    mpr = driver_mapping[_identifier].get('max_polling_rate', 50)
+    mnpr = driver_mapping[_identifier].get('min_polling_rate', 1)
+
+    # one manager per port, ports shared by several addressed devices get a BusManager
+    manager_class = BusManager if driver_mapping[_identifier].get('bus', False) else DeviceManager
+    manager = manager_class(_key, drv, com, max_polling_rate=mpr, min_polling_rate=mnpr, **kwargs)
+    manager.add_listener(_interlocks.on_device_update)
+
+    _devices[_key] = manager
+    _scheduler.add_device(_key, manager)
+
+
+def add_serial_device(_key, _port_info):
+    # add devices/threads
+    _baud_rate = driver_mapping[_port_info["identifier"]]["baud_rate"]
+    print('Adding device {} on port {} with baud rade {}'.format(_key, _port_info, _baud_rate))
+
+    _framing = driver_mapping[_port_info["identifier"]].get("framing", "checksum")
+
+    com = SerialCOM(arduino_id=_key,
+                    port_name=_port_info["port"],
+                    baud_rate=_baud_rate,
+                    timeout=1.0,
+                    framer=framers[_framing](),
+                    ready_probe=driver_mapping[_port_info["identifier"]].get("ready_probe"))
+
+    pip = driver_mapping[_port_info["identifier"]].get('pipelined', False)
+    add_device_manager(_key, _port_info["identifier"], com, pipelined=pip)
+
+
+def add_ftdi_devices(_added):
+    # for key, val in finder_result['current'].items():
+        # if key in _ids_by_ports.keys():
+        #    # don't overwrite anything that is already present
+        #    # because we want to keep the serial number that was
+        #    # created when the device was added the first time
+        # continue
+    for _key, _port_info in _added.items():
+        print('Adding device {} on port {}'.format(_key, _port_info))
+        _baud_rate = driver_mapping[_port_info['identifier']]['baud_rate']
+        found = False
+        it = 0
+        while not found:
+            try:
+                com = FTDICOM(vend_prod_id=_port_info['vend_prod'],
+                              port_name=it,
+                              baud_rate=_baud_rate,
+                              timeout=1.0)
+                found = True
+            except DeviceError:
+                it += 1
+                if it > 10:
+                    sys.exit()
+        # we can only get the serial number after creating the com
+        # object, but we still want to use it as the key for everything
+        # since the user will put it in the gui
+        sn = com.serial_number()
+        _ftdi_serial_port_mapping[_key] = sn
+        add_device_manager(sn, _port_info["identifier"], com)
 
 
 def shutdown():
@@ -500,10 +985,9 @@ def shutdown():
 
     print("Shutting down...")
     _keep_communicating = False
-    for key, device in _devices.items():
-        device.terminate()
-    for key, thread in _threads.items():
-        thread.join()
+    _wait_for_hotplug([_hotplug_pool.submit(remove_device_manager, key) for key in list(_devices.keys())])
+    _scheduler.shutdown()
+    _hotplug_pool.shutdown(wait=True)
 
     _pipe_server.send(["shutdown"])
     _watch_proc.join()
@@ -0,0 +1,103 @@
+import json
+import threading
+
+
+class Subscription(object):
+    """
+    One client's subscription to a list of devices. DeviceManagers push every new response into it,
+    the streaming route takes out whatever arrived since the last time. Only the newest values of each
+    device are kept, and values are never sent twice (their timestamp has to be newer).
+    """
+
+    def __init__(self):
+        # (server side device id, device id on that server side device) -> client side device id
+        self._routes = {}
+        self._pending = {}
+        self._last_timestamps = {}
+        self._condition = threading.Condition()
+        self._closed = False
+
+    @property
+    def routes(self):
+        return self._routes
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def add_route(self, server_side_device_id, device_id, client_side_device_id):
+        self._routes[(server_side_device_id, device_id)] = client_side_device_id
+
+    def push_error(self, client_side_device_id, message):
+        with self._condition:
+            self._pending[client_side_device_id] = message
+            self._condition.notify()
+
+    def on_device_update(self, server_side_device_id, device_id, values):
+        """ Listener for DeviceManager updates. values=None means the device went away """
+        try:
+            client_side_device_id = self._routes[(server_side_device_id, device_id)]
+        except KeyError:
+            return
+
+        if values is None:
+            self.push_error(client_side_device_id, "ERROR: Device not found on server")
+            return
+
+        if values.get('snapshot', False):
+            # comes with the rest of its snapshot group tick, see on_frame
+            return
+
+        with self._condition:
+            if values['timestamp'] <= self._last_timestamps.get(client_side_device_id, 0.0):
+                return
+
+            self._pending[client_side_device_id] = values
+            self._condition.notify()
+
+    def on_frame(self, frame):
+        """
+        The responses of one snapshot group tick, [(server side device id, device id, values), ...].
+        They are put in at once, so get() never hands out only a part of the frame.
+        """
+        with self._condition:
+            for server_side_device_id, device_id, values in frame:
+                client_side_device_id = self._routes.get((server_side_device_id, device_id))
+
+                if client_side_device_id is None or \
+                        values['timestamp'] <= self._last_timestamps.get(client_side_device_id, 0.0):
+                    continue
+
+                self._pending[client_side_device_id] = values
+
+            self._condition.notify()
+
+    def get(self, timeout):
+        """ Waits up to timeout seconds for new values. Returns {client side device id: values} """
+        with self._condition:
+            if not self._pending and not self._closed:
+                self._condition.wait(timeout)
+
+            pending = self._pending
+            self._pending = {}
+
+        for client_side_device_id, values in pending.items():
+            if isinstance(values, dict):
+                self._last_timestamps[client_side_device_id] = values['timestamp']
+
+        return pending
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+
+def sse_event(data):
+    """ Formats data as a Server-Sent Event """
+    return "data: {}\n\n".format(json.dumps(data))
+
+
+def sse_keepalive():
+    """ SSE comment line. Keeps the connection open and lets us notice clients that went away """
+    return ": keepalive\n\n"
@@ -0,0 +1,140 @@
+# Compact binary encoding of the device values pushed by /device/stream (format=binary).
+#
+# The stream is a sequence of frames. Every frame starts with a header (frame type: uint8, payload
+# length: uint32, little endian) followed by the payload:
+#
+# FRAME_SCHEMA    (first frame) JSON {'version': WIRE_VERSION, 'devices': [client side device ids],
+#                 'channels': [[channel names of device 0], ...]}. Devices and channels are referred to by
+#                 their index in these lists (= the order of the subscription) in all later frames.
+# FRAME_DATA      device index (uint16), number of channels n (uint16), timestamp (float64),
+#                 polling rate (float64), t_start and t_end (float64, wall clock time the query went out
+#                 and its response was complete, NaN if unknown), then n packed (channel index: uint16,
+#                 value: float64) pairs.
+# FRAME_ERROR     device index (uint16), utf-8 error message.
+# FRAME_KEEPALIVE empty.
+import json
+import struct
+
+import numpy as np
+
+WIRE_VERSION = 2
+
+FRAME_SCHEMA = 0
+FRAME_DATA = 1
+FRAME_ERROR = 2
+FRAME_KEEPALIVE = 3
+
+_header = struct.Struct('<BI')
+_data_header = struct.Struct('<HHdddd')
+_error_header = struct.Struct('<H')
+
+# one (channel index, value) pair of a data frame
+channel_value_dtype = np.dtype([('channel', '<u2'), ('value', '<f8')])
+
+
+class NonNumericValue(ValueError):
+    """ A value that can't be sent in a data frame (e.g. the "Error: ..." strings of the MFC driver) """
+
+    def __init__(self, value, channel_index):
+        ValueError.__init__(self, "Got '{}' for channel index {}".format(value, channel_index))
+        self.value = value
+        self.channel_index = channel_index
+
+
+def _frame(frame_type, payload):
+    return _header.pack(frame_type, len(payload)) + payload
+
+
+def encode_schema(devices, channels):
+    payload = json.dumps({'version': WIRE_VERSION,
+                          'devices': devices,
+                          'channels': channels}).encode()
+
+    return _frame(FRAME_SCHEMA, payload)
+
+
+def encode_data(device_index, timestamp, polling_rate, channel_indices, values, t_start=np.nan, t_end=np.nan):
+    """
+    channel_indices and values are sequences of equal length. Raises NonNumericValue if a value can't
+    be converted to a float, the device should get an error frame instead.
+    """
+    pairs = np.empty(len(channel_indices), dtype=channel_value_dtype)
+    pairs['channel'] = channel_indices
+
+    for i, value in enumerate(values):
+        try:
+            pairs['value'][i] = float(value)
+        except (TypeError, ValueError):
+            raise NonNumericValue(value, channel_indices[i])
+
+    payload = _data_header.pack(device_index, len(pairs), timestamp, polling_rate, t_start, t_end) + pairs.tobytes()
+
+    return _frame(FRAME_DATA, payload)
+
+
+def encode_error(device_index, message):
+    return _frame(FRAME_ERROR, _error_header.pack(device_index) + message.encode())
+
+
+def encode_keepalive():
+    return _frame(FRAME_KEEPALIVE, b'')
+
+
+class FrameDecoder(object):
+    """
+    Incremental decoder for the binary stream. Feed it the bytes as they arrive, it returns the frames
+    that are complete:
+
+    ('schema', schema dict)
+    ('data', device index, timestamp, polling rate, channel indices (ndarray), values (ndarray), t_start, t_end)
+    ('error', device index, message)
+
+    Keepalive frames are consumed silently. The arrays of data frames are views into the received bytes.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._schema = None
+
+    @property
+    def schema(self):
+        return self._schema
+
+    def feed(self, data):
+        self._buffer += data
+        frames = []
+        offset = 0
+
+        while len(self._buffer) - offset >= _header.size:
+            frame_type, length = _header.unpack_from(self._buffer, offset)
+            start = offset + _header.size
+
+            if len(self._buffer) - start < length:
+                break
+
+            payload = bytes(self._buffer[start:start + length])
+            offset = start + length
+
+            if frame_type == FRAME_DATA:
+                device_index, n, timestamp, polling_rate, t_start, t_end = _data_header.unpack_from(payload)
+                pairs = np.frombuffer(payload, dtype=channel_value_dtype, count=n, offset=_data_header.size)
+                frames.append(('data', device_index, timestamp, polling_rate, pairs['channel'], pairs['value'],
+                               t_start, t_end))
+
+            elif frame_type == FRAME_ERROR:
+                device_index, = _error_header.unpack_from(payload)
+                frames.append(('error', device_index, payload[_error_header.size:].decode()))
+
+            elif frame_type == FRAME_SCHEMA:
+                schema = json.loads(payload.decode())
+
+                if schema['version'] != WIRE_VERSION:
+                    raise ValueError("Unsupported wire format version {} (expected {})".format(
+                        schema['version'], WIRE_VERSION))
+
+                self._schema = schema
+                frames.append(('schema', schema))
+
+        del self._buffer[:offset]
+
+        return frames
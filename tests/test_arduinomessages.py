@@ -0,0 +1,172 @@
+import random
+
+import numpy as np
+import pytest
+
+from pycontrolsystem.Server.Drivers.ArduinoDriver import ArduinoMessages
+from pycontrolsystem.Server.Drivers.ArduinoDriver.ArduinoMessages import (build_query_message, check_for_error,
+                                                                          compile_output_parser,
+                                                                          parse_output_message_regex)
+
+
+def format_value(channel_name, value, precision):
+    """ One channel of an Arduino response: name, sign, mantissa, exponent, exponent sign """
+    mantissa, exponent = "{:.{}e}".format(abs(value), precision).split("e")
+    exponent = int(exponent)
+
+    return "{}{}{}{}{}".format(channel_name, "-" if value < 0 else "+", mantissa.replace(".", ""),
+                               abs(exponent), "-" if exponent < 0 else "+")
+
+
+def respond(query_messages, values):
+    """ What the Arduino answers to the query messages built by build_query_message """
+    responses = []
+
+    for query_message, _ in query_messages:
+        fields = [query_message[i:i + 3] for i in range(3, len(query_message), 3)]
+        response = "o{:0>2}".format(len(fields))
+
+        for field in fields:
+            response += format_value(field[:2], values[field[:2]], int(field[2]))
+
+        responses.append(response + "\r\n")
+
+    return responses
+
+
+def random_query(rng, number_of_channels, min_precision=1):
+    channel_ids = ["{}{}".format(chr(ord("a") + i // 10), i % 10) for i in range(number_of_channels)]
+    precisions = [rng.randint(min_precision, 6) for _ in channel_ids]
+    values = {}
+
+    for channel_name in channel_ids:
+        value = rng.uniform(1.0, 10.0) * 10 ** rng.randint(-9, 9)
+        # round to what the Arduino can send with this precision
+        values[channel_name] = float("{:.{}e}".format(value * rng.choice([-1, 1]), precisions[len(values)]))
+
+    return channel_ids, precisions, values
+
+
+def parse_regex(responses):
+    result = {}
+    for response in responses:
+        result.update(parse_output_message_regex(response))
+
+    return result
+
+
+@pytest.mark.parametrize("number_of_channels", [1, 5, 12, 40])
+def test_parse_matches_regex(number_of_channels):
+    rng = random.Random(number_of_channels)
+
+    for _ in range(50):
+        channel_ids, precisions, values = random_query(rng, number_of_channels)
+        responses = respond(build_query_message(channel_ids, precisions), values)
+
+        parsed = compile_output_parser(tuple(channel_ids), tuple(precisions)).parse(responses)
+
+        assert parsed == values
+        assert parsed == pytest.approx(parse_regex(responses), rel=1e-12)
+
+
+def test_multi_message_response():
+    rng = random.Random(0)
+    channel_ids, precisions, values = random_query(rng, 40)
+    queries = build_query_message(channel_ids, precisions)
+    responses = respond(queries, values)
+
+    assert len(queries) > 1
+
+    parser = compile_output_parser(tuple(channel_ids), tuple(precisions))
+
+    assert parser.parse(responses) == values
+    assert ArduinoMessages.parse_arduino_output_message(responses, channel_ids, precisions) == values
+    assert ArduinoMessages.parse_arduino_output_message(responses) == pytest.approx(values, rel=1e-12)
+
+    # a missing message falls back to the regex on what did arrive
+    partial = parser.parse(responses[:-1])
+    assert set(partial) < set(values)
+    assert partial == pytest.approx({name: values[name] for name in partial}, rel=1e-12)
+
+
+def test_response_without_channel_count():
+    channel_ids, precisions = ["a0", "a1"], [3, 2]
+    values = {"a0": -1.234e-5, "a1": 9.87e3}
+    response = respond(build_query_message(channel_ids, precisions), values)[0]
+
+    assert compile_output_parser(tuple(channel_ids), tuple(precisions)).parse(["o" + response[3:]]) == values
+
+
+def test_unexpected_layout_falls_back_to_regex():
+    values = {"a0": 1.5, "a1": -2.25}
+    # the Arduino answered with other precisions than asked for
+    responses = respond(build_query_message(["a0", "a1"], [1, 2]), values)
+
+    parser = compile_output_parser(("a0", "a1"), (3, 3))
+
+    assert parser.parse(responses) == pytest.approx(values)
+    assert np.allclose(parser.parse_batch([responses]), [[1.5, -2.25]])
+
+
+def test_error_responses():
+    with pytest.raises(Exception) as error:
+        check_for_error("ERR4\r\n")
+
+    assert error.value.args == ("ERR4", ArduinoMessages.arduino_error_messages_dict["ERR4"])
+
+    check_for_error("o01a0+12340+\r\n")
+
+    parser = compile_output_parser(("a0",), (3,))
+
+    with pytest.raises(Exception, match="ERR1"):
+        parser.parse(["ERR1\r\n"])
+
+    with pytest.raises(Exception, match="ERR2"):
+        parser.parse_batch([["o01a0+12340+\r\n"], ["ERR2\r\n"]])
+
+
+def test_parse_batch():
+    rng = random.Random(1)
+    channel_ids, precisions, _ = random_query(rng, 40)
+    parser = compile_output_parser(tuple(channel_ids), tuple(precisions))
+
+    responses, expected = [], []
+    for _ in range(20):
+        values = random_query(rng, 40)[2]
+        values = {name: float("{:.{}e}".format(values[name], precision))
+                  for name, precision in zip(channel_ids, precisions)}
+
+        responses.append(respond(build_query_message(channel_ids, precisions), values))
+        expected.append([values[name] for name in channel_ids])
+
+    # one response with a message missing goes through the fallback
+    responses[5] = responses[5][:-1]
+    missing = [name not in parse_regex(responses[5]) for name in channel_ids]
+
+    batch = parser.parse_batch(responses)
+
+    assert batch.shape == (20, len(channel_ids))
+    assert np.all(np.isnan(batch[5][missing]))
+
+    expected = np.array(expected)
+    expected[5][missing] = np.nan
+
+    assert np.allclose(batch, expected, rtol=1e-12, equal_nan=True)
+
+
+def test_precision_zero():
+    """
+    A channel queried with precision 0 sends a single mantissa digit. The regex needs at least two
+    mantissa digits and can't parse it, the fixed-width parser reads it as digit * 10 ** exponent.
+    """
+    channel_ids, precisions = ("a0", "a1", "a2"), (0, 0, 2)
+    values = {"a0": 5e2, "a1": -3e-4, "a2": 1.25}
+    responses = respond(build_query_message(list(channel_ids), list(precisions)), values)
+
+    assert responses == ["o03a0+52+a1-34-a2+1250+\r\n"]
+    assert "a0" not in parse_output_message_regex(responses[0])
+
+    parser = compile_output_parser(channel_ids, precisions)
+
+    assert parser.parse(responses) == values
+    assert np.allclose(parser.parse_batch([responses, responses]), [[5e2, -3e-4, 1.25]] * 2, rtol=1e-12)
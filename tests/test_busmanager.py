@@ -0,0 +1,96 @@
+from pycontrolsystem.Server.Server import BusManager
+
+
+class FakeDriver(object):
+
+    def translate_gui_to_device(self, data):
+        if data.get('set'):
+            return ['set {} {}'.format(data['device_id'], data['values'][0])]
+
+        return ['query {}'.format(data['device_id'])]
+
+    def translate_device_to_gui(self, responses, device_data):
+        return {'value': responses[0]}
+
+
+class FakeBus(object):
+    """ Answers every address but the dead ones """
+
+    def __init__(self, dead=()):
+        self.dead = set(dead)
+        self.messages = []
+
+    def send_message(self, msg):
+        self.messages.append(msg)
+
+        if msg.split()[-1] in self.dead:
+            return 'TIMEOUT'
+
+        return '1.0'
+
+
+def make_bus(addresses, dead=(), **kwargs):
+    com = FakeBus(dead)
+    manager = BusManager('port', FakeDriver(), com, **kwargs)
+
+    for address in addresses:
+        manager.query_message = {'device_driver': 'fake', 'device_id': address, 'channel_ids': ['ch'],
+                                 'precisions': [None]}
+
+    return manager, com
+
+
+def poll(manager, com):
+    """ Returns the messages sent in one cycle """
+    del com.messages[:]
+    manager.poll()
+
+    return list(com.messages)
+
+
+def test_round_robin_order():
+    manager, com = make_bus(['a', 'b', 'c'])
+
+    assert poll(manager, com) == ['query a', 'query b', 'query c']
+    assert poll(manager, com) == ['query b', 'query c', 'query a']
+    assert poll(manager, com) == ['query c', 'query a', 'query b']
+    assert poll(manager, com) == ['query a', 'query b', 'query c']
+
+
+def test_dead_address_backs_off():
+    manager, com = make_bus(['a', 'b'], dead=['b'], max_backoff=2)
+
+    queried = ['query b' in poll(manager, com) for _ in range(9)]
+
+    # skipped for 1 cycle after the first failure, then for 2 (max_backoff)
+    assert queried == [True, False, True, False, False, True, False, False, True]
+
+    com.dead.clear()
+    queried = ['query b' in poll(manager, com) for _ in range(5)]
+
+    # answers after its skipped cycles, then it is queried every cycle again
+    assert queried == [False, False, True, True, True]
+
+
+def test_only_first_failure_slows_down_bus():
+    manager, com = make_bus(['a', 'b'], dead=['b'])
+
+    poll(manager, com)
+    assert manager.polling_rate_target == 25.0
+
+    # b fails again in the third cycle, the rate keeps recovering
+    poll(manager, com)
+    poll(manager, com)
+    assert manager.polling_rate_target > 25.0
+
+
+def test_sets_per_cycle():
+    manager, com = make_bus(['a'], sets_per_cycle=2)
+
+    for channel, value in (('x', 1), ('y', 2), ('z', 3)):
+        manager.add_command_to_queue({'device_id': 'a', 'channel_ids': [channel], 'values': [value], 'set': True})
+
+    # the sets share the cycle with the queries instead of replacing them
+    assert poll(manager, com) == ['set a 1', 'set a 2', 'query a']
+    assert poll(manager, com) == ['set a 3', 'query a']
+    assert poll(manager, com) == ['query a']
@@ -0,0 +1,84 @@
+import queue
+
+import pytest
+
+from pycontrolsystem.Server.CommandQueue import SetCommandQueue, PRIORITY_EMERGENCY, PRIORITY_INTERLOCK, \
+    PRIORITY_USER
+
+
+def cmd(value, device_id='1', channel='ch'):
+    return {'device_id': device_id, 'channel_ids': [channel], 'values': [value]}
+
+
+def drain(q):
+    cmds = []
+    while not q.empty():
+        cmds.append(q.get_nowait()[0])
+
+    return [(c['device_id'], c['values'][0]) for c in cmds]
+
+
+def test_priority_order_fifo_within_priority():
+    q = SetCommandQueue()
+    q.put(cmd(1, device_id='a'))
+    q.put(cmd(2, device_id='b'), PRIORITY_INTERLOCK)
+    q.put(cmd(3, device_id='c'))
+    q.put(cmd(4, device_id='d'), PRIORITY_EMERGENCY)
+
+    assert q.qsize() == 4
+    assert drain(q) == [('d', 4), ('b', 2), ('a', 1), ('c', 3)]
+
+    with pytest.raises(queue.Empty):
+        q.get_nowait()
+
+
+def test_same_priority_coalesces():
+    q = SetCommandQueue()
+
+    assert not q.put(cmd(1))
+    assert q.put(cmd(2))
+    assert q.put(cmd(3))
+
+    assert q.qsize() == 1
+    assert drain(q) == [('1', 3)]
+
+
+def test_less_urgent_set_waits_behind_urgent_one():
+    q = SetCommandQueue()
+    q.put(cmd('other', device_id='2'))
+    q.put(cmd(0), PRIORITY_EMERGENCY)
+
+    assert not q.put(cmd(5))
+    assert q.qsize() == 3
+
+    # the urgent entry can still be coalesced after the user set came in
+    assert q.put(cmd(1), PRIORITY_EMERGENCY)
+    assert q.put(cmd(6))
+    assert q.qsize() == 3
+
+    assert drain(q) == [('1', 1), ('2', 'other'), ('1', 6)]
+    assert q.qsize() == 0
+
+
+def test_more_urgent_set_replaces_waiting_one():
+    q = SetCommandQueue()
+    q.put(cmd(1))
+    q.put(cmd('other', device_id='2'))
+
+    assert q.put(cmd(0), PRIORITY_INTERLOCK)
+    assert q.qsize() == 2
+    assert drain(q) == [('1', 0), ('2', 'other')]
+
+
+def test_followup_keeps_most_urgent_priority():
+    q = SetCommandQueue()
+    q.put(cmd(0), PRIORITY_EMERGENCY)
+    q.put(cmd(1), PRIORITY_INTERLOCK)
+    q.put(cmd(2), PRIORITY_USER)
+    q.put(cmd('other', device_id='2'), PRIORITY_INTERLOCK)
+
+    assert q.qsize() == 3
+
+    q.get_nowait()
+    # the follow-up is queued with interlock priority, behind the interlock set that came in before it
+    assert drain(q) == [('2', 'other'), ('1', 2)]
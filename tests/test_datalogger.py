@@ -0,0 +1,118 @@
+import time
+
+import numpy as np
+import pytest
+
+h5py = pytest.importorskip('h5py')
+# the client package needs the GUI dependencies
+DataLogger = pytest.importorskip('pycontrolsystem.Client.DataLogger', exc_type=ImportError)
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def filename(tmp_path):
+    return str(tmp_path / 'log' / 'test.h5')
+
+
+def test_flush_by_size(filename):
+    logger = DataLogger.DataLogger(filename, flush_interval=100.0, flush_size=10)
+    logger.initialize()
+
+    for i in range(9):
+        logger.log_value('dev1', 'ch1', float(i), 100.0 + i)
+
+    time.sleep(0.1)
+    assert logger.stats['written'] == 0
+
+    logger.log_value('dev1', 'ch1', 9.0, 109.0)
+    wait_for(lambda: logger.stats['written'] == 10)
+
+    assert logger.stats['flushes'] == 1
+    assert logger.stats['pending'] == 0
+
+    logger.close()
+
+
+def test_flush_by_interval(filename):
+    logger = DataLogger.DataLogger(filename, flush_interval=0.05, flush_size=1000)
+    logger.initialize()
+
+    logger.log_value('dev1', 'ch1', 1.0, 100.0)
+    logger.log_value('dev1', 'ch2', 2.0, 100.0)
+
+    wait_for(lambda: logger.stats['written'] == 2)
+
+    logger.close()
+
+
+def test_full_buffer_drops_values(filename):
+    logger = DataLogger.DataLogger(filename, flush_interval=100.0, flush_size=100, buffer_size=4)
+    logger.initialize()
+
+    for i in range(6):
+        logger.log_value('dev1', 'ch1', float(i), 100.0 + i)
+
+    logger.log_value('dev1', 'ch2', 1.0, 100.0)
+    logger.log_value('dev1', 'ch1', None, 106.0)
+
+    assert logger.stats == {'written': 0, 'pending': 5, 'dropped': 2, 'flushes': 0}
+
+    logger.close()
+
+    assert logger.stats['written'] == 5
+    assert logger.stats['dropped'] == 2
+
+    with h5py.File(filename, 'r') as h5file:
+        assert h5file['mist1_control_system/dev1/ch1'][:, 1].tolist() == [0.0, 1.0, 2.0, 3.0]
+
+
+def test_close_writes_buffered_rows_and_trims(filename):
+    logger = DataLogger.DataLogger(filename, flush_interval=100.0, flush_size=1000, chunk_size=8)
+    logger.initialize()
+
+    for i in range(11):
+        logger.log_value('dev1', 'ch1', float(i), 100.0 + i, t_start=99.0 + i, t_end=99.5 + i)
+
+    logger.log_value('dev2', 'ch1', 5.0, 200.0)
+
+    logger.close()
+
+    with h5py.File(filename, 'r') as h5file:
+        assert h5file.attrs['format_version'] == DataLogger.FORMAT_VERSION
+        assert h5file.attrs['columns'] == ', '.join(DataLogger.COLUMNS)
+
+        dset = h5file['mist1_control_system/dev1/ch1']
+
+        assert dset.shape == (11, len(DataLogger.COLUMNS))
+        assert dset.attrs['length'] == 11
+        assert dset.attrs['columns'] == 'timestamp, value, t_start, t_end'
+        assert np.array_equal(dset[:], [[100.0 + i, float(i), 99.0 + i, 99.5 + i] for i in range(11)])
+
+        # unknown t_start/t_end are NaN
+        assert np.array_equal(h5file['mist1_control_system/dev2/ch1'][:], [[200.0, 5.0, np.nan, np.nan]],
+                              equal_nan=True)
+
+
+def test_grown_rows_are_nan_until_written(filename):
+    logger = DataLogger.DataLogger(filename, flush_interval=100.0, flush_size=3, chunk_size=8)
+    logger.initialize()
+
+    for i in range(3):
+        logger.log_value('dev1', 'ch1', float(i), 100.0 + i)
+
+    wait_for(lambda: logger.stats['flushes'] == 1)
+
+    dset = logger._data_set['/mist1_control_system/dev1/ch1']
+
+    # the dataset grew by a whole chunk, the rows past 'length' are fill values
+    assert dset.shape == (8, len(DataLogger.COLUMNS))
+    assert dset.attrs['length'] == 3
+    assert np.all(np.isnan(dset[3:]))
+
+    logger.close()
@@ -0,0 +1,141 @@
+import random
+
+import numpy as np
+import pytest
+
+# the client package needs the GUI dependencies
+RingBuffer = pytest.importorskip('pycontrolsystem.Client.RingBuffer', exc_type=ImportError).RingBuffer
+MinMaxPyramid = pytest.importorskip('pycontrolsystem.Client.Decimation', exc_type=ImportError).MinMaxPyramid
+
+
+class Stream(object):
+    """
+    A history with its pyramid and every sample ever appended (the timestamp of sample i is i), for
+    computing the expected envelope by brute force
+    """
+
+    def __init__(self, capacity, base_bucket=4, min_buckets=16, seed=0):
+        self.rng = random.Random(seed)
+        self.history = RingBuffer(capacity, columns=2)
+        self.pyramid = MinMaxPyramid(self.history, base_bucket, min_buckets)
+        self.values = []
+        self.origin = 0  # index of the sample the buckets are aligned to (the oldest one at the last rebuild)
+
+        self.bucket_sizes = []
+        bucket_size = base_bucket
+        while capacity // bucket_size >= min_buckets:
+            self.bucket_sizes.append(bucket_size)
+            bucket_size *= 2
+
+    def append(self, n):
+        for _ in range(n):
+            x, y = float(len(self.values)), self.rng.gauss(0.0, 1.0)
+            self.values.append(y)
+            self.history.append(x, y)
+            self.pyramid.append(x, y)
+
+    def extend(self, n):
+        """ extend the history directly, then rebuild the pyramid """
+        y = [self.rng.gauss(0.0, 1.0) for _ in range(n)]
+        x = np.arange(len(self.values), len(self.values) + n, dtype=float)
+        self.values.extend(y)
+        self.history.extend(x, y)
+        self.pyramid.rebuild()
+        self.origin = len(self.values) - len(self.history)
+
+    def expected(self, x_min=None, x_max=None, pixels=None):
+        total = len(self.values)
+        oldest = total - len(self.history)
+
+        def clip(i):
+            return min(max(i, oldest), total)
+
+        # sample indices in the view, including the one before and the one after it
+        first = oldest if x_min is None else max(oldest, clip(int(np.ceil(x_min))) - 1)
+        last = total if x_max is None else min(total, clip(int(np.floor(x_max)) + 1) + 1)
+
+        def raw(start, stop):
+            return list(range(start, stop)), self.values[start:stop]
+
+        if pixels is None or last - first <= 2 * pixels or not self.bucket_sizes:
+            return raw(first, last)
+
+        k = 0
+        while k + 1 < len(self.bucket_sizes) and (last - first) // self.bucket_sizes[k + 1] >= pixels:
+            k += 1
+
+        bucket_size = self.bucket_sizes[k]
+        covered = self.origin + (total - self.origin) // bucket_size * bucket_size
+
+        x, y = [], []
+        buckets = [start for start in range(self.origin, covered, bucket_size) if first <= start <= last - 1]
+
+        for start in buckets:
+            samples = self.values[start:start + bucket_size]
+            x += [start, start]
+            y += [min(samples), max(samples)]
+
+        head_x, head_y = raw(first, buckets[0] if buckets else first)
+        tail_x, tail_y = raw(max(covered, first), last)
+
+        return head_x + x + tail_x, head_y + y + tail_y
+
+
+def check(stream, x_min=None, x_max=None, pixels=None):
+    x, y = stream.pyramid.data_for_view(x_min, x_max, pixels)
+    expected_x, expected_y = stream.expected(x_min, x_max, pixels)
+
+    assert x.tolist() == expected_x
+    assert y.tolist() == expected_y
+
+
+def test_raw_samples_if_few_enough():
+    stream = Stream(256)
+    stream.append(100)
+
+    check(stream)
+    check(stream, pixels=50)
+    check(stream, 10.0, 20.0, pixels=10)
+
+    assert len(stream.pyramid.data_for_view(pixels=50)[0]) == 100
+
+
+def test_envelope_of_appended_samples():
+    stream = Stream(256)
+
+    for n in (5, 70, 200, 3, 500):
+        stream.append(n)
+
+        for pixels in (1, 7, 16, 40):
+            check(stream, pixels=pixels)
+            check(stream, 10.5 + len(stream.values) - 256, len(stream.values) - 30.5, pixels=pixels)
+
+
+def test_envelope_after_extend_and_rebuild():
+    stream = Stream(256, seed=1)
+    stream.append(50)
+
+    for n in (37, 300, 3):
+        stream.extend(n)
+
+        for pixels in (1, 7, 16, 40):
+            check(stream, pixels=pixels)
+
+        # appending continues the buckets of the rebuilt levels
+        stream.append(n + 11)
+
+        for pixels in (1, 7, 16, 40):
+            check(stream, pixels=pixels)
+            check(stream, len(stream.values) - 200.25, len(stream.values) - 20.75, pixels=pixels)
+
+
+def test_envelope_is_bounded_by_pixels():
+    stream = Stream(4096, seed=2)
+    stream.append(10000)
+
+    x, y = stream.pyramid.data_for_view(pixels=100)
+
+    # two points per bucket, at least one but (about) no more than two buckets per pixel
+    assert 200 <= len(x) <= 4 * 100 + 2 * 4
+    assert min(y) == min(stream.values[-4096:])
+    assert max(y) == max(stream.values[-4096:])
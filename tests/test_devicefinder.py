@@ -0,0 +1,44 @@
+import importlib
+import os
+
+# the package exports the DeviceFinder class under the module's name
+DeviceFinder = importlib.import_module('pycontrolsystem.Server.DeviceFinder')
+
+
+def write_usb_device(root, name, vendor, product, devnum):
+    path = root / name
+    path.mkdir(exist_ok=True)
+
+    for attribute, value in (('idVendor', vendor), ('idProduct', product), ('busnum', '1'), ('devnum', devnum)):
+        (path / attribute).write_text(value + '\n')
+
+
+def make_finder(monkeypatch, root):
+    monkeypatch.setattr(DeviceFinder, '_sys_usb_devices', str(root))
+    monkeypatch.setattr(DeviceFinder, 'pyudev', None)
+
+    return DeviceFinder.FTDIDeviceFinder({'ftdi_a': {'ftdi_info': (0x0403, 0x6001)},
+                                          'ftdi_b': {'ftdi_info': (0x0403, 0x6015)}})
+
+
+def test_unchanged_devices_are_not_rescanned(monkeypatch, tmp_path):
+    write_usb_device(tmp_path, '1-1', '0403', '6001', '5')
+    os.mkdir(str(tmp_path / '1-1:1.0'))
+    finder = make_finder(monkeypatch, tmp_path)
+
+    assert finder.find_devices()['added'] == {'1:5': {'port': '1:5', 'identifier': 'ftdi_a',
+                                                      'vend_prod': (0x0403, 0x6001)}}
+    assert finder.find_devices()['added'] == {}
+
+
+def test_replugged_device_on_same_port_is_found(monkeypatch, tmp_path):
+    write_usb_device(tmp_path, '1-1', '0403', '6001', '5')
+    finder = make_finder(monkeypatch, tmp_path)
+    finder.find_devices()
+
+    # another device in the same port: same sysfs name, new devnum
+    write_usb_device(tmp_path, '1-1', '0403', '6015', '6')
+    result = finder.find_devices()
+
+    assert result['added'] == {'1:6': {'port': '1:6', 'identifier': 'ftdi_b', 'vend_prod': (0x0403, 0x6015)}}
+    assert list(result['obsolete']) == ['1:5']
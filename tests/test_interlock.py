@@ -0,0 +1,85 @@
+from pycontrolsystem.Server.Interlock import InterlockEngine
+
+
+class FakeManager(object):
+
+    def __init__(self):
+        self.commands = []
+
+    def add_command_to_queue(self, cmd):
+        self.commands.append(cmd)
+
+
+def resolve_device_ids(device_data):
+    return None, 'port_' + device_data['device_id'], device_data['device_id']
+
+
+SESSION = {
+    'devices': {
+        'gauge': {'driver': 'Arduino', 'device_id': '1',
+                  'channels': {'p': {'scaling': 1.0, 'data_type': str(float)}}},
+        'valve': {'driver': 'Arduino', 'device_id': '2',
+                  'channels': {'open': {'scaling': 1.0, 'data_type': str(bool)}}},
+    },
+    'procedures': {
+        'close valve': {'type': 'basic', 'triggertype': 'auto',
+                        'rules': {'0': {'rule_device': 'gauge', 'rule_channel': 'p', 'comp': 'greater', 'value': 5.0}},
+                        'actions': {'0': {'action_device': 'valve', 'action_channel': 'open',
+                                          'action_value': 0, 'action_delay': 0}}},
+    },
+}
+
+
+def make_engine(device_ids=('1', '2')):
+    managers = {'port_' + device_id: FakeManager() for device_id in device_ids}
+    engine = InterlockEngine(managers)
+
+    assert engine.load(SESSION, resolve_device_ids) == ['close valve']
+
+    return engine, managers
+
+
+def test_rule_triggers_action():
+    engine, managers = make_engine()
+    engine.on_device_update('port_1', '1', {'p': '7.0'})
+
+    assert engine.status() == {}
+    assert managers['port_2'].commands[0]['values'] == [0.0]
+    assert managers['port_2'].commands[0]['priority'] == 'interlock'
+
+
+def test_no_value_is_reported_to_client():
+    engine, managers = make_engine()
+
+    assert engine.status() == {'close valve': "no value for channel p of device 1"}
+
+    engine.on_device_update('port_1', '1', {'p': '1.0'})
+    assert engine.status() == {}
+
+    # the device went away, the client has to take over again
+    engine.on_device_update('port_1', '1', None)
+    assert 'close valve' in engine.status()
+
+
+def test_missing_action_device_does_not_trigger():
+    engine, managers = make_engine(device_ids=('1',))
+    engine.on_device_update('port_1', '1', {'p': '7.0'})
+
+    assert engine.status() == {'close valve': "action device port_2 not found on server"}
+    assert not engine.interlocks[0].tripped
+
+
+def test_dropped_action_is_reported_until_reload():
+    engine, managers = make_engine()
+    engine.on_device_update('port_1', '1', {'p': '1.0'})
+
+    interlock = engine.interlocks[0]
+    engine._queue_action(interlock, interlock._actions[0])
+    del managers['port_2']
+    engine._queue_action(interlock, interlock._actions[0])
+
+    assert engine.status()['close valve'].startswith("action for device port_2 dropped")
+
+    managers['port_2'] = FakeManager()
+    engine.load(SESSION, resolve_device_ids)
+    assert engine.status() == {}
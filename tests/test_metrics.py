@@ -0,0 +1,50 @@
+import json
+import threading
+
+from pycontrolsystem.Server.Metrics import DeviceMetrics, RollingHistogram, format_prometheus
+
+
+def test_summary_without_samples_is_valid_json():
+    summary = DeviceMetrics().summary()
+
+    assert summary['round_trip_time'] == {'p50': None, 'p95': None, 'p99': None, 'count': 0}
+    json.dumps(summary, allow_nan=False)
+
+
+def test_summary_percentiles():
+    histogram = RollingHistogram()
+    for value in range(1, 101):
+        histogram.add(float(value))
+
+    summary = histogram.summary()
+
+    assert summary['count'] == 100
+    assert abs(summary['p50'] - 50.5) < 1e-9
+    assert histogram.sum == 5050.0
+
+
+def test_prometheus_reports_missing_percentiles_as_nan():
+    text = format_prometheus([({'device': 'dev1'}, DeviceMetrics(), 0.0, 10.0)])
+
+    assert 'pycontrolsystem_round_trip_seconds{device="dev1",quantile="0.5"} NaN' in text
+    assert 'pycontrolsystem_polling_rate_target_hz{device="dev1"} 10.0' in text
+
+
+def test_counters_from_several_threads():
+    metrics = DeviceMetrics()
+
+    def count():
+        for _ in range(10000):
+            metrics.count_timeout()
+            metrics.count_exception()
+            metrics.count_coalesced_set()
+
+    threads = [threading.Thread(target=count) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    summary = metrics.summary()
+
+    assert (summary['timeouts'], summary['exceptions'], summary['coalesced_sets']) == (80000, 80000, 80000)
@@ -0,0 +1,119 @@
+import importlib
+import operator
+import os
+import types
+
+import pytest
+
+# the client package needs the GUI dependencies
+QtWidgets = pytest.importorskip('PyQt5.QtWidgets', exc_type=ImportError)
+Procedure = pytest.importorskip('pycontrolsystem.Client.Procedure', exc_type=ImportError)
+ControlSystem = importlib.import_module('pycontrolsystem.Client.ControlSystem').ControlSystem
+
+
+@pytest.fixture(scope='module', autouse=True)
+def app():
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    return QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+
+
+class FakeChannel(object):
+
+    def __init__(self, value):
+        self.value = value
+
+
+class CountingComparison(object):
+    """ A rule's comparison that remembers the values it was evaluated with """
+
+    def __init__(self, comp):
+        self.comp = comp
+        self.calls = []
+
+    def __call__(self, value, rule_value):
+        self.calls.append(value)
+        return self.comp(value, rule_value)
+
+
+def make_procedure(name, *rules):
+    """ rules are (channel, comparison, value) """
+    procedure = Procedure.BasicProcedure(name,
+                                         {i: {'device': None, 'channel': channel, 'comp': CountingComparison(comp),
+                                              'value': value}
+                                          for i, (channel, comp, value) in enumerate(rules)},
+                                         {})
+    # the buttons should_perform_procedure enables and disables
+    procedure.control_button_layout()
+
+    return procedure
+
+
+def calls(procedure):
+    return [rule['comp'].calls for _, rule in sorted(procedure.rules.items())]
+
+
+def test_only_rules_of_changed_channels_are_evaluated():
+    a, b, c = FakeChannel(0.0), FakeChannel(0.0), FakeChannel(0.0)
+    procedure = make_procedure('p1', (a, operator.gt, 1.0), (b, operator.lt, 5.0))
+
+    # first time all rules are evaluated, whatever changed
+    assert not procedure.should_perform_procedure({a})
+    assert calls(procedure) == [[0.0], [0.0]]
+
+    a.value = 2.0
+    assert procedure.should_perform_procedure({a})
+    assert calls(procedure) == [[0.0, 2.0], [0.0]]
+
+    # a change of another channel keeps the last results
+    assert procedure.should_perform_procedure({c})
+    assert calls(procedure) == [[0.0, 2.0], [0.0]]
+
+    b.value = 7.0
+    assert not procedure.should_perform_procedure({b})
+    assert calls(procedure) == [[0.0, 2.0], [0.0, 7.0]]
+
+    # without changed channels everything is evaluated again
+    a.value = 0.5
+    b.value = 1.0
+    assert not procedure.should_perform_procedure()
+    assert calls(procedure) == [[0.0, 2.0, 0.5], [0.0, 7.0, 1.0]]
+
+
+def test_check_procedures_uses_the_channel_index():
+    a, b, c = FakeChannel(0.0), FakeChannel(0.0), FakeChannel(0.0)
+    p1 = make_procedure('p1', (a, operator.gt, 1.0), (b, operator.lt, 5.0))
+    p2 = make_procedure('p2', (b, operator.gt, 1.0), (c, operator.gt, 1.0))
+
+    control_system = types.SimpleNamespace(_procedures={'p1': p1, 'p2': p2, 'other': object()},
+                                           _procedure_index={})
+    ControlSystem.update_procedure_index(control_system)
+
+    assert control_system._procedure_index == {a: [p1], b: [p1, p2], c: [p2]}
+
+    triggered = []
+    for procedure in (p1, p2):
+        procedure.do_actions = lambda triggered_by_rules=False, procedure=procedure: \
+            triggered.append((procedure.name, triggered_by_rules))
+
+    ControlSystem.check_procedures(control_system, {a})
+    assert calls(p1) == [[0.0], [0.0]]
+    assert calls(p2) == [[], []]
+
+    c.value = 3.0
+    ControlSystem.check_procedures(control_system, {c})
+    assert calls(p1) == [[0.0], [0.0]]
+    assert calls(p2) == [[0.0], [3.0]]
+    assert triggered == []
+
+    a.value = 2.0
+    b.value = 2.0
+    ControlSystem.check_procedures(control_system, {a, b})
+    assert calls(p1) == [[0.0, 2.0], [0.0, 2.0]]
+    assert calls(p2) == [[0.0, 2.0], [3.0]]
+    assert sorted(triggered) == [('p1', True), ('p2', True)]
+
+    # removing a procedure takes it out of the index
+    del control_system._procedures['p1']
+    ControlSystem.update_procedure_index(control_system)
+
+    assert control_system._procedure_index == {b: [p2], c: [p2]}
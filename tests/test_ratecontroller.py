@@ -0,0 +1,63 @@
+import pytest
+
+from pycontrolsystem.Server.RateController import AdaptiveRateController
+
+
+def test_starts_at_max_rate():
+    controller = AdaptiveRateController(1.0, 50.0)
+
+    assert controller.rate == 50.0
+    assert controller.cycle_time is None
+
+
+def test_timeout_halves_rate_down_to_min():
+    controller = AdaptiveRateController(1.0, 50.0)
+
+    assert controller.update(0.001, failures=1) == 25.0
+    assert controller.update(0.001, failures=2) == 12.5
+
+    for _ in range(10):
+        controller.update(0.001, failures=1)
+
+    assert controller.rate == 1.0
+
+
+def test_recovers_toward_max_rate():
+    controller = AdaptiveRateController(1.0, 50.0)
+    controller.update(0.001, failures=1)
+
+    assert controller.update(0.001) == pytest.approx(25.0 * 1.05)
+    assert controller.update(0.001) == pytest.approx(25.0 * 1.05 ** 2)
+
+    for _ in range(100):
+        controller.update(0.001)
+
+    assert controller.rate == 50.0
+
+
+def test_rate_capped_by_cycle_time():
+    controller = AdaptiveRateController(1.0, 50.0)
+
+    # 0.1 s cycles with 1.25 headroom allow 8 Hz
+    assert controller.update(0.1) == pytest.approx(8.0)
+    assert controller.cycle_time == pytest.approx(0.1)
+
+    # the average moves by smoothing * difference: 0.1 + 0.2 * (0.2 - 0.1)
+    assert controller.update(0.2) == pytest.approx(1.0 / (1.25 * 0.12))
+
+
+def test_cap_never_goes_below_min_rate():
+    controller = AdaptiveRateController(2.0, 50.0)
+
+    assert controller.update(10.0) == 2.0
+
+
+def test_changing_bounds_clamps_rate():
+    controller = AdaptiveRateController(1.0, 50.0)
+    controller.max_rate = 10.0
+
+    assert controller.rate == 10.0
+
+    controller.update(0.001, failures=1)
+    controller.min_rate = 8.0
+    assert controller.rate == 8.0
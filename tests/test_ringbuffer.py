@@ -0,0 +1,91 @@
+import random
+
+import numpy as np
+import pytest
+
+# the client package needs the GUI dependencies
+RingBuffer = pytest.importorskip('pycontrolsystem.Client.RingBuffer', exc_type=ImportError).RingBuffer
+
+
+def check(ring, reference):
+    """ reference is the list of all rows appended since the last clear, the ring holds the newest ones """
+    kept = reference[-ring.capacity:] if reference else []
+
+    assert len(ring) == len(kept)
+
+    for i in range(2):
+        column = ring.column(i)
+
+        assert column.tolist() == [row[i] for row in kept]
+        # a view, not a copy
+        assert column.base is ring._data
+        assert ring.last(i) == (kept[-1][i] if kept else None)
+
+
+def test_wrap_around():
+    ring = RingBuffer(5, columns=2)
+    reference = []
+
+    check(ring, reference)
+
+    for i in range(13):
+        ring.append(float(i), -float(i))
+        reference.append((float(i), -float(i)))
+        check(ring, reference)
+
+
+def test_extend():
+    ring = RingBuffer(5, columns=2)
+
+    ring.extend([0.0, 1.0, 2.0], [0.0, -1.0, -2.0])
+    ring.extend([3.0, 4.0, 5.0, 6.0], [-3.0, -4.0, -5.0, -6.0])
+    check(ring, [(float(i), -float(i)) for i in range(7)])
+
+    # more values than fit at once
+    ring.extend(np.arange(20.0), -np.arange(20.0))
+    check(ring, [(float(i), -float(i)) for i in range(7)] + [(float(i), -float(i)) for i in range(20)])
+
+
+def test_resize_keeps_newest():
+    ring = RingBuffer(8, columns=2)
+    ring.extend(np.arange(11.0), 2 * np.arange(11.0))
+
+    ring.resize(3)
+    assert ring.capacity == 3
+    check(ring, [(float(i), 2.0 * i) for i in range(11)])
+
+    ring.resize(6)
+    assert ring.capacity == 6
+    check(ring, [(float(i), 2.0 * i) for i in range(8, 11)])
+
+    ring.append(11.0, 22.0)
+    check(ring, [(float(i), 2.0 * i) for i in range(8, 12)])
+
+
+def test_random_operations_match_reference():
+    rng = random.Random(0)
+    ring = RingBuffer(7, columns=2)
+    reference = []
+    n = 0
+
+    for _ in range(2000):
+        operation = rng.random()
+
+        if operation < 0.6:
+            ring.append(float(n), rng.uniform(-1.0, 1.0))
+            reference.append((ring.last(0), ring.last(1)))
+            n += 1
+        elif operation < 0.85:
+            count = rng.randint(0, 2 * ring.capacity)
+            values = [rng.uniform(-1.0, 1.0) for _ in range(count)]
+            ring.extend(np.arange(n, n + count, dtype=float), values)
+            reference.extend(zip(np.arange(n, n + count, dtype=float).tolist(), values))
+            n += count
+        elif operation < 0.97:
+            reference = reference[-ring.capacity:]
+            ring.resize(rng.randint(1, 20))
+        else:
+            ring.clear()
+            reference = []
+
+        check(ring, reference)
@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+# the client package needs the GUI dependencies
+RoutingTable = pytest.importorskip('pycontrolsystem.Client.Routing', exc_type=ImportError).RoutingTable
+
+
+class FakeChannel(object):
+
+    def __init__(self, scaling=1.0):
+        self.scaling = scaling
+
+
+class FakeDevice(object):
+
+    def __init__(self, device_id, channels):
+        self.device_id = device_id
+        self.channels = channels
+
+
+def make_devices():
+    return {'Device 1': FakeDevice('dev1', {'ch1': FakeChannel(2.0), 'ch2': FakeChannel(10.0)}),
+            'Device 2': FakeDevice('dev2', {'ch1': FakeChannel(0.5)})}
+
+
+def test_columns():
+    devices = make_devices()
+    routes = RoutingTable(devices)
+
+    assert routes.column('dev1', 'ch1') == 0
+    assert routes.column('dev1', 'ch2') == 1
+    assert routes.column('dev2', 'ch1') == 2
+
+    assert routes.column('dev2', 'ch2') == -1
+    assert routes.column('dev3', 'ch1') == -1
+
+    device_name, device, channel_name, channel = routes.columns[2]
+    assert (device_name, device, channel_name, channel) == ('Device 2', devices['Device 2'], 'ch1',
+                                                            devices['Device 2'].channels['ch1'])
+
+
+def test_schema_columns_marks_unknown_channels():
+    routes = RoutingTable(make_devices())
+    schema = {'devices': ['dev2', 'dev3', 'dev1'], 'channels': [['ch1', 'ch9'], ['ch1'], ['ch2', 'ch1']]}
+
+    schema_columns = routes.schema_columns(schema)
+
+    assert [columns.tolist() for columns in schema_columns] == [[2, -1], [-1], [1, 0]]
+
+    # cached until the schema or the devices change
+    assert routes.schema_columns(schema) is schema_columns
+
+    devices = make_devices()
+    devices['Device 3'] = FakeDevice('dev3', {'ch1': FakeChannel()})
+    routes.build(devices)
+
+    assert [columns.tolist() for columns in routes.schema_columns(schema)] == [[2, -1], [3], [1, 0]]
+
+
+def test_unknown_channels_are_filtered_before_scaling():
+    routes = RoutingTable(make_devices())
+    schema = {'devices': ['dev1', 'dev2'], 'channels': [['ch1', 'ch9', 'ch2'], ['ch7', 'ch1']]}
+    schema_columns = routes.schema_columns(schema)
+
+    # a frame of each device with all of its channels, the way ControlSystem routes them
+    columns = np.concatenate((schema_columns[0][[0, 1, 2]], schema_columns[1][[0, 1]]))
+    values = np.array([4.0, 1.0, 30.0, 1.0, 2.0])
+
+    known = columns >= 0
+
+    assert columns[known].tolist() == [0, 1, 2]
+    assert routes.scale(columns[known], values[known]).tolist() == [2.0, 3.0, 4.0]
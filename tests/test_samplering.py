@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+# the client package needs the GUI dependencies
+SampleRing = pytest.importorskip('pycontrolsystem.Client.SampleRing', exc_type=ImportError)
+
+
+def test_response_records_use_server_timestamp():
+    response = {'dev1': {'ch1': 1.5, 'polling_rate': 10.0, 'timestamp': 100.0, 't_start': 99.5, 't_end': 99.75},
+                'dev2': {'x': 2.0}}
+
+    records, errors = SampleRing.records_from_response(response, {'dev1': 0, 'dev2': 1},
+                                                       [{'ch1': 0}, {'x': 0}], 200.0)
+
+    assert errors == {}
+    assert records[records['device'] == 0]['timestamp'].tolist() == [100.0, 100.0]
+    assert records[records['device'] == 0]['t_start'].tolist() == [99.5, 99.5]
+    assert records[records['device'] == 0]['t_end'].tolist() == [99.75, 99.75]
+    # no server timestamp, falls back to the time the response was received
+    assert records[records['device'] == 1]['timestamp'].tolist() == [200.0]
+    assert np.isnan(records[records['device'] == 1]['t_start']).all()
+
+
+def test_repeated_sample_keeps_its_timestamp():
+    response = {'dev1': {'ch1': 1.5, 'timestamp': 100.0}}
+
+    first, _ = SampleRing.records_from_response(response, {'dev1': 0}, [{'ch1': 0}], 200.0)
+    second, _ = SampleRing.records_from_response(response, {'dev1': 0}, [{'ch1': 0}], 201.0)
+
+    assert first['timestamp'].tolist() == second['timestamp'].tolist() == [100.0]
+
+
+def test_frame_records_use_frame_timestamp():
+    frames = [('data', 0, 100.0, 10.0, np.array([1]), np.array([2.5]), 99.5, 99.75),
+              ('data', 1, 0.0, 5.0, np.array([0]), np.array([3.0]), np.nan, np.nan),
+              ('error', 2, "TIMEOUT")]
+
+    records, errors = SampleRing.records_from_frames(frames, 200.0)
+
+    assert records['timestamp'].tolist() == [100.0, 100.0, 200.0, 200.0]
+    assert records['t_end'][:2].tolist() == [99.75, 99.75]
+    assert records['channel'].tolist() == [SampleRing.METADATA_POLLING_RATE, 1,
+                                           SampleRing.METADATA_POLLING_RATE, 0]
+    assert errors == [(2, "TIMEOUT")]
@@ -0,0 +1,401 @@
+import threading
+
+from pycontrolsystem.Server.Metrics import DeviceMetrics
+from pycontrolsystem.Server.Scheduler import PollingScheduler
+
+
+class FakeClock(object):
+
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class InlineExecutor(object):
+    """ Runs every submitted cycle right away in the calling thread """
+
+    def submit(self, fn, *args):
+        fn(*args)
+
+    def shutdown(self, wait=True):
+        pass
+
+
+class ManualExecutor(object):
+    """ Keeps the submitted cycles until the test runs them, so devices can be held busy """
+
+    def __init__(self):
+        self.jobs = []
+
+    def submit(self, fn, *args):
+        self.jobs.append((fn, args))
+
+    def run_next(self):
+        fn, args = self.jobs.pop(0)
+        fn(*args)
+
+    def run_all(self):
+        while self.jobs:
+            self.run_next()
+
+    def shutdown(self, wait=True):
+        pass
+
+
+class FakeManager(object):
+
+    def __init__(self, rate=10.0, on_poll=None):
+        self.polling_rate_target = rate
+        self.polls = []
+        self.metrics = DeviceMetrics()
+        self._on_poll = on_poll
+
+    def poll(self, snapshot=None):
+        self.polls.append(snapshot)
+
+        if self._on_poll is not None:
+            self._on_poll()
+
+
+def make_scheduler(executor=None):
+    clock = FakeClock()
+    scheduler = PollingScheduler(clock=clock, executor=executor if executor is not None else InlineExecutor())
+
+    return scheduler, clock
+
+
+def test_fixed_rate_deadlines():
+    scheduler, clock = make_scheduler()
+    manager = FakeManager(rate=10.0)
+    scheduler.add_device('a', manager)
+
+    assert scheduler.run_due() == 1
+
+    clock.now = 0.05
+    assert scheduler.run_due() == 0
+
+    # started late, the next deadline is still on the 0.1 s grid
+    clock.now = 0.13
+    assert scheduler.run_due() == 1
+
+    clock.now = 0.19
+    assert scheduler.run_due() == 0
+
+    clock.now = 0.2
+    assert scheduler.run_due() == 1
+
+    stats = scheduler.stats('a')
+    assert stats['cycles'] == 3
+    assert stats['missed_cycles'] == 0
+    assert abs(stats['max_lateness'] - 0.03) < 1e-9
+    assert len(manager.polls) == 3
+
+
+def test_overrun_skips_missed_deadlines():
+    scheduler, clock = make_scheduler()
+
+    def overrun():
+        clock.now += 0.35
+
+    manager = FakeManager(rate=10.0, on_poll=overrun)
+    scheduler.add_device('a', manager)
+
+    assert scheduler.run_due() == 1
+    assert clock.now == 0.35
+
+    # deadlines 0.1, 0.2 and 0.3 were missed, no burst of catch-up cycles
+    assert scheduler.run_due() == 0
+    assert scheduler.stats('a')['missed_cycles'] == 3
+
+    manager._on_poll = None
+    clock.now = 0.4
+    assert scheduler.run_due() == 1
+    assert len(manager.polls) == 2
+
+
+def test_rate_change_takes_effect_on_next_cycle():
+    scheduler, clock = make_scheduler()
+    manager = FakeManager(rate=10.0)
+    scheduler.add_device('a', manager)
+
+    scheduler.run_due()
+    manager.polling_rate_target = 2.0
+
+    clock.now = 0.1
+    assert scheduler.run_due() == 1
+
+    clock.now = 0.2
+    assert scheduler.run_due() == 0
+
+    clock.now = 0.6
+    assert scheduler.run_due() == 1
+
+
+def test_removed_device_is_not_polled():
+    scheduler, clock = make_scheduler()
+    manager = FakeManager()
+    scheduler.add_device('a', manager)
+    scheduler.remove_device('a')
+
+    assert scheduler.run_due() == 0
+    assert manager.polls == []
+    assert scheduler.stats('a') == {}
+
+
+def test_failing_poll_is_counted():
+    scheduler, clock = make_scheduler()
+
+    def fail():
+        raise IOError("port went away")
+
+    manager = FakeManager(on_poll=fail)
+    scheduler.add_device('a', manager)
+
+    assert scheduler.run_due() == 1
+    assert manager.metrics.exceptions == 1
+
+    # still on its schedule
+    clock.now = 0.1
+    assert scheduler.run_due() == 1
+    assert manager.metrics.exceptions == 2
+
+
+def test_pool_grows_with_devices():
+    scheduler = PollingScheduler(clock=FakeClock())
+    started = threading.Semaphore(0)
+    release = threading.Event()
+
+    def block():
+        started.release()
+        release.wait(5.0)
+
+    for i in range(10):
+        scheduler.add_device(i, FakeManager(on_poll=block))
+
+    # every device gets its own worker, none of them waits for another one's round trip
+    assert scheduler.run_due() == 10
+    assert all(started.acquire(timeout=5.0) for _ in range(10))
+
+    release.set()
+    scheduler.shutdown()
+
+
+def test_remove_waits_for_running_cycle():
+    clock = FakeClock()
+    scheduler = PollingScheduler(max_workers=2, clock=clock)
+
+    started = threading.Event()
+    release = threading.Event()
+
+    def block():
+        started.set()
+        release.wait(5.0)
+
+    manager = FakeManager(on_poll=block)
+    scheduler.add_device('a', manager)
+    scheduler.run_due()
+    assert started.wait(5.0)
+
+    removed = threading.Event()
+
+    def remove():
+        scheduler.remove_device('a')
+        removed.set()
+
+    remover = threading.Thread(target=remove)
+    remover.start()
+
+    assert not removed.wait(0.1)
+
+    release.set()
+    assert removed.wait(5.0)
+    remover.join()
+
+    # the finished cycle didn't put the device back on the schedule
+    clock.now = 10.0
+    assert scheduler.run_due() == 0
+    assert len(manager.polls) == 1
+
+    scheduler.shutdown()
+
+
+class FrameRecorder(object):
+
+    def __init__(self):
+        self.frames = []
+
+    def __call__(self, name, keys, barrier):
+        self.frames.append((name, keys, barrier))
+
+
+def test_group_polls_members_at_same_barrier():
+    scheduler, clock = make_scheduler()
+    a, b = FakeManager(rate=10.0), FakeManager(rate=10.0)
+    scheduler.add_device('a', a)
+    scheduler.add_device('b', b)
+
+    frames = FrameRecorder()
+    scheduler.add_group('g', ['a', 'b'], 20.0, frames)
+
+    # the devices' own deadlines are skipped, the group polls them
+    assert scheduler.run_due() == 2
+    assert a.polls == b.polls == [frames.frames[0][2]]
+    assert frames.frames == [('g', ['a', 'b'], a.polls[0])]
+
+    # never faster than the slowest member
+    clock.now = 0.05
+    assert scheduler.run_due() == 0
+
+    clock.now = 0.1
+    assert scheduler.run_due() == 2
+    assert a.polls == b.polls == [frame[2] for frame in frames.frames]
+    assert scheduler.group_stats('g')['cycles'] == 2
+    assert scheduler.stats('a')['snapshot_group'] == 'g'
+
+
+def test_one_frame_per_tick():
+    executor = ManualExecutor()
+    scheduler, clock = make_scheduler(executor)
+    scheduler.add_device('a', FakeManager())
+    scheduler.add_device('b', FakeManager())
+
+    frames = FrameRecorder()
+    scheduler.add_group('g', ['a', 'b'], 10.0, frames)
+    assert scheduler.run_due() == 2
+
+    executor.run_next()
+    assert frames.frames == []
+
+    # the group's next tick is only scheduled once the last member finished
+    clock.now = 0.1
+    assert scheduler.run_due() == 0
+
+    executor.run_next()
+    assert len(frames.frames) == 1
+
+    # the tick finished at the 0.1 s deadline, that one counts as missed
+    assert scheduler.group_stats('g')['missed_cycles'] == 1
+    clock.now = 0.2
+    assert scheduler.run_due() == 2
+    executor.run_all()
+    assert len(frames.frames) == 2
+
+
+def test_busy_member_skips_tick():
+    executor = ManualExecutor()
+    scheduler, clock = make_scheduler(executor)
+    a, b = FakeManager(), FakeManager()
+    scheduler.add_device('a', a)
+    scheduler.add_device('b', b)
+
+    # both are in the middle of their own cycle when the group is added
+    assert scheduler.run_due() == 2
+
+    frames = FrameRecorder()
+    scheduler.add_group('g', ['a', 'b'], 10.0, frames)
+    assert scheduler.run_due() == 0
+    assert scheduler.group_stats('g')['missed_cycles'] == 1
+
+    executor.run_all()
+
+    clock.now = 0.1
+    assert scheduler.run_due() == 2
+    executor.run_all()
+
+    assert a.polls == [None, frames.frames[0][2]]
+    assert b.polls == [None, frames.frames[0][2]]
+
+
+def test_group_removed_mid_tick():
+    executor = ManualExecutor()
+    scheduler, clock = make_scheduler(executor)
+    a, b = FakeManager(), FakeManager()
+    scheduler.add_device('a', a)
+    scheduler.add_device('b', b)
+
+    frames = FrameRecorder()
+    scheduler.add_group('g', ['a', 'b'], 10.0, frames)
+    assert scheduler.run_due() == 2
+
+    executor.run_next()
+    scheduler.remove_group('g')
+    executor.run_next()
+
+    # no frame for the unfinished tick, and the group isn't rescheduled
+    assert frames.frames == []
+    assert scheduler.group_stats('g') == {}
+
+    # both devices are back on their own schedule
+    clock.now = 0.1
+    assert scheduler.run_due() == 2
+    executor.run_all()
+
+    assert a.polls[-1] is None and b.polls[-1] is None
+    assert 'snapshot_group' not in scheduler.stats('a')
+
+
+def test_regrouping_moves_device_between_groups():
+    scheduler, clock = make_scheduler()
+    managers = {key: FakeManager() for key in 'abc'}
+    for key, manager in managers.items():
+        scheduler.add_device(key, manager)
+
+    frames = FrameRecorder()
+    scheduler.add_group('g1', ['a', 'b'], 10.0, frames)
+    scheduler.add_group('g2', ['b', 'c'], 10.0, frames)
+
+    assert scheduler.run_due() == 3
+    assert sorted((name, keys) for name, keys, _ in frames.frames) == [('g1', ['a']), ('g2', ['b', 'c'])]
+    assert [len(manager.polls) for manager in managers.values()] == [1, 1, 1]
+    assert scheduler.stats('b')['snapshot_group'] == 'g2'
+
+    # removing the group b left doesn't take b out of its new group
+    scheduler.remove_group('g1')
+    clock.now = 0.1
+    assert scheduler.run_due() == 3
+    assert managers['a'].polls[-1] is None
+    assert managers['b'].polls[-1] is not None
+    assert scheduler.stats('b')['snapshot_group'] == 'g2'
+
+
+def test_group_left_empty_by_regrouping_is_removed():
+    scheduler, clock = make_scheduler()
+    managers = {key: FakeManager() for key in 'ab'}
+    for key, manager in managers.items():
+        scheduler.add_device(key, manager)
+
+    frames = FrameRecorder()
+    scheduler.add_group('g1', ['a'], 10.0, frames)
+    scheduler.add_group('g2', ['a', 'b'], 10.0, frames)
+
+    assert scheduler.group_stats('g1') == {}
+
+    for tick in range(3):
+        clock.now = 0.1 * tick
+        assert scheduler.run_due() == 2
+
+    assert [(name, keys) for name, keys, _ in frames.frames] == [('g2', ['a', 'b'])] * 3
+
+    # the name can be used again
+    scheduler.add_group('g1', ['b'], 10.0, frames)
+    assert scheduler.stats('b')['snapshot_group'] == 'g1'
+    assert scheduler.group_stats('g1') != {}
+
+
+def test_stale_heap_entries_are_skipped():
+    scheduler, clock = make_scheduler()
+    manager = FakeManager()
+    scheduler.add_device('a', manager)
+
+    # the device now has two heap entries, the one from add_device is stale
+    scheduler.add_group('g', ['a'], 10.0, FrameRecorder())
+    scheduler.remove_group('g')
+
+    assert scheduler.run_due() == 1
+    assert manager.polls == [None]
+
+    clock.now = 0.1
+    assert scheduler.run_due() == 1
+    assert manager.polls == [None, None]
@@ -0,0 +1,265 @@
+import asyncio
+import io
+import os
+
+import pytest
+import serial
+
+from pycontrolsystem.Server.SerialCOM import LineFramer, ChecksumFramer, SerialTransport, SerialCOM, \
+    SerialEventLoop
+
+
+class FakeSerial(object):
+    """ Port without a file descriptor, so the transport polls in_waiting """
+
+    def __init__(self):
+        self.incoming = bytearray()
+        self.written = []
+
+    def fileno(self):
+        raise io.UnsupportedOperation
+
+    @property
+    def in_waiting(self):
+        return len(self.incoming)
+
+    def read(self, n):
+        data = bytes(self.incoming[:n])
+        del self.incoming[:n]
+        return data
+
+    def write(self, data):
+        self.written.append(data)
+
+    def reset_input_buffer(self):
+        self.incoming = bytearray()
+
+    def reset_output_buffer(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def test_line_framer_splits_chunks():
+    framer = LineFramer()
+
+    assert framer.feed(b'12') == []
+    assert framer.partial() == b'12'
+    assert framer.feed(b'34\r\n56\n7') == [b'1234\r', b'56\n']
+    assert framer.partial() == b'7'
+
+
+def test_checksum_framer_waits_for_checksum():
+    framer = ChecksumFramer()
+
+    assert framer.feed(b'@@@000ACK1.0;') == []
+    assert framer.feed(b'F') == []
+    assert framer.feed(b'Fx') == [b'@@@000ACK1.0;FF']
+    assert framer.partial() == b'x'
+
+
+class UnpluggedSerial(FakeSerial):
+    """ A hung-up port: the fd stays readable, but reading fails """
+
+    def __init__(self):
+        FakeSerial.__init__(self)
+        self.reads = 0
+        self._read_fd, self._write_fd = os.pipe()
+        os.write(self._write_fd, b'x')
+
+    def fileno(self):
+        return self._read_fd
+
+    @property
+    def in_waiting(self):
+        self.reads += 1
+        raise OSError(5, "Input/output error")
+
+    def read(self, n):
+        self.reads += 1
+        raise serial.SerialException("device reports readiness to read but returned no data")
+
+    def close(self):
+        os.close(self._read_fd)
+        os.close(self._write_fd)
+
+
+class UnpluggedPolledSerial(UnpluggedSerial):
+
+    def fileno(self):
+        raise io.UnsupportedOperation
+
+
+def run_transport(scenario, timeout=1.0, ser=None):
+    if ser is None:
+        ser = FakeSerial()
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        transport = SerialTransport(ser, LineFramer(), loop, timeout)
+        transport.open()
+
+        try:
+            return await scenario(ser, transport)
+        finally:
+            transport.close()
+
+    return asyncio.run(main())
+
+
+def test_request_gets_response():
+    async def scenario(ser, transport):
+        request = asyncio.ensure_future(transport.request(b'q\n', True))
+        await asyncio.sleep(0.01)
+        ser.incoming += b'ok\n'
+
+        return await request, ser.written
+
+    response, written = run_transport(scenario)
+
+    assert response == b'ok\n'
+    assert written == [b'q\n']
+
+
+def test_timeout_keeps_bytes_of_later_response():
+    async def scenario(ser, transport):
+        first = asyncio.ensure_future(transport.request(b'a\n', True, timeout=0.05))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(transport.request(b'b\n', True, timeout=1.0))
+        await asyncio.sleep(0.01)
+
+        # the first request never gets an answer, the second one's starts arriving
+        ser.incoming += b'B-par'
+        first_response = await first
+
+        ser.incoming += b't\n'
+
+        return first_response, await second
+
+    first_response, second_response = run_transport(scenario)
+
+    assert first_response == b'B-parTIMEOUT'
+    assert second_response == b'B-part\n'
+
+
+def test_stale_bytes_are_discarded_before_next_request():
+    async def scenario(ser, transport):
+        timed_out = await transport.request(b'a\n', True, timeout=0.05)
+
+        ser.incoming += b'late'
+        await asyncio.sleep(0.01)
+
+        request = asyncio.ensure_future(transport.request(b'b\n', True))
+        await asyncio.sleep(0.01)
+        ser.incoming += b'ok\n'
+
+        return timed_out, await request
+
+    timed_out, response = run_transport(scenario)
+
+    assert timed_out == b'TIMEOUT'
+    assert response == b'ok\n'
+
+
+class ResettingTransport(object):
+    """ Times out the first requests, like an Arduino that is still resetting """
+
+    def __init__(self, timeouts):
+        self.timeouts = timeouts
+        self.requests = []
+
+    async def request(self, message, wait_for_response, timeout=None):
+        self.requests.append((message, wait_for_response))
+
+        if len(self.requests) <= self.timeouts:
+            return b'TIMEOUT'
+
+        return b'ok\n'
+
+
+def test_wait_until_ready_sends_probe_until_answered():
+    com = SerialCOM.__new__(SerialCOM)
+    com._event_loop = SerialEventLoop.instance()
+    com._transport = ResettingTransport(timeouts=2)
+
+    assert com.wait_until_ready('q00', timeout=1.0, probe_timeout=0.01)
+    assert com._transport.requests == [(b'q00', True)] * 3
+
+
+def test_wait_until_ready_times_out():
+    com = SerialCOM.__new__(SerialCOM)
+    com._event_loop = SerialEventLoop.instance()
+    com._transport = ResettingTransport(timeouts=1000)
+
+    assert not com.wait_until_ready('q00', timeout=0.05, probe_timeout=0.01)
+
+
+@pytest.mark.parametrize('port_class', [UnpluggedSerial, UnpluggedPolledSerial])
+def test_unplugged_port_stops_reading(port_class):
+    async def scenario(ser, transport):
+        request = asyncio.ensure_future(transport.request(b'q\n', True))
+        await asyncio.sleep(0.05)
+        reads = ser.reads
+
+        # nothing fires on the loop anymore
+        await asyncio.sleep(0.05)
+
+        with pytest.raises((serial.SerialException, OSError)):
+            await request
+
+        return reads, ser.reads
+
+    reads, later_reads = run_transport(scenario, ser=port_class())
+
+    assert reads == later_reads == 1
+
+
+def test_pipelined_requests_are_written_before_first_response():
+    async def scenario(ser, transport):
+        batch = asyncio.ensure_future(transport.request_pipelined([(b'a\n', True), (b'b\n', False),
+                                                                   (b'c\n', True)]))
+        await asyncio.sleep(0.01)
+        written = list(ser.written)
+
+        # the device answers in order
+        ser.incoming += b'A\nC\n'
+
+        return written, await batch
+
+    written, responses = run_transport(scenario)
+
+    assert written == [b'a\n', b'b\n', b'c\n']
+    assert responses == [b'A\n', None, b'C\n']
+
+
+def test_pipelined_input_is_kept_while_requests_are_in_flight():
+    async def scenario(ser, transport):
+        first = asyncio.ensure_future(transport.request(b'a\n', True))
+        await asyncio.sleep(0.01)
+
+        # the start of the first response is already buffered when the batch goes out
+        ser.incoming += b'A-par'
+        await asyncio.sleep(0.01)
+        batch = asyncio.ensure_future(transport.request_pipelined([(b'b\n', True), (b'c\n', True)]))
+        await asyncio.sleep(0.01)
+
+        ser.incoming += b't\nB\nC\n'
+
+        return await first, await batch
+
+    first, batch = run_transport(scenario)
+
+    assert first == b'A-part\n'
+    assert batch == [b'B\n', b'C\n']
+
+
+def test_pipelined_timeout_only_affects_missing_responses():
+    async def scenario(ser, transport):
+        batch = asyncio.ensure_future(transport.request_pipelined([(b'a\n', True), (b'b\n', True)]))
+        await asyncio.sleep(0.01)
+        ser.incoming += b'A\n'
+
+        return await batch
+
+    assert run_transport(scenario, timeout=0.05) == [b'A\n', b'TIMEOUT']
@@ -0,0 +1,107 @@
+import importlib
+import json
+import threading
+import time
+
+import pytest
+
+# the client package needs the GUI dependencies
+pytest.importorskip('pycontrolsystem.Client', exc_type=ImportError)
+ControlSystem = importlib.import_module('pycontrolsystem.Client.ControlSystem')
+
+
+class FakeResponse(object):
+    status_code = 200
+    text = 'OK'
+
+
+class FakeSession(object):
+    """ Records the posted set commands, blocks in post while blocked is cleared """
+
+    def __init__(self):
+        self.posts = []
+        self.blocked = threading.Event()
+        self.blocked.set()
+        self.closed = False
+
+    def post(self, url, data=None, timeout=None):
+        self.posts.append((url, json.loads(data['data'])))
+        self.blocked.wait(5.0)
+        return FakeResponse()
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def session(monkeypatch):
+    session = FakeSession()
+    monkeypatch.setattr(ControlSystem.requests, 'Session', lambda: session)
+    return session
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_commands_sent_while_a_request_is_on_its_way_are_batched(session):
+    dispatcher = ControlSystem.SetDispatcher('http://server/')
+    session.blocked.clear()
+
+    dispatcher.submit({'device_id': 'dev1', 'values': [1.0]})
+    wait_for(lambda: len(session.posts) == 1)
+
+    for value in (2.0, 3.0, 4.0):
+        dispatcher.submit({'device_id': 'dev1', 'values': [value]})
+
+    session.blocked.set()
+    wait_for(lambda: len(session.posts) == 2)
+
+    assert session.posts == [('http://server/device/set', [{'device_id': 'dev1', 'values': [1.0]}]),
+                             ('http://server/device/set', [{'device_id': 'dev1', 'values': [2.0]},
+                                                           {'device_id': 'dev1', 'values': [3.0]},
+                                                           {'device_id': 'dev1', 'values': [4.0]}])]
+
+    dispatcher.close()
+
+    assert len(session.posts) == 2
+    assert session.closed
+
+
+def test_close_sends_pending_commands(session):
+    dispatcher = ControlSystem.SetDispatcher('http://server/')
+    session.blocked.clear()
+
+    dispatcher.submit({'device_id': 'dev1', 'values': [1.0]})
+    wait_for(lambda: len(session.posts) == 1)
+
+    dispatcher.submit({'device_id': 'dev2', 'values': [5.0]})
+    threading.Timer(0.1, session.blocked.set).start()
+    dispatcher.close()
+
+    assert [cmds for _, cmds in session.posts] == [[{'device_id': 'dev1', 'values': [1.0]}],
+                                                   [{'device_id': 'dev2', 'values': [5.0]}]]
+    assert session.closed
+
+
+def test_failed_request_does_not_stop_the_dispatcher(session):
+    def post(url, data=None, timeout=None):
+        session.posts.append((url, json.loads(data['data'])))
+        if len(session.posts) == 1:
+            raise ConnectionError('server went away')
+        return FakeResponse()
+
+    session.post = post
+    dispatcher = ControlSystem.SetDispatcher('http://server/')
+
+    dispatcher.submit({'device_id': 'dev1', 'values': [1.0]})
+    wait_for(lambda: len(session.posts) == 1)
+
+    dispatcher.submit({'device_id': 'dev1', 'values': [2.0]})
+    dispatcher.close()
+
+    assert [cmds for _, cmds in session.posts] == [[{'device_id': 'dev1', 'values': [1.0]}],
+                                                   [{'device_id': 'dev1', 'values': [2.0]}]]
@@ -0,0 +1,64 @@
+import importlib
+
+from pycontrolsystem.Server.Streaming import Subscription
+
+# the package exports names of the Server module, get the module itself
+Server = importlib.import_module('pycontrolsystem.Server.Server')
+
+
+def make_subscription():
+    subscription = Subscription()
+    subscription.add_route('port_a', '1', 'dev_a')
+    subscription.add_route('port_b', '2', 'dev_b')
+
+    return subscription
+
+
+def test_snapshot_values_only_come_with_the_frame():
+    subscription = make_subscription()
+    subscription.on_device_update('port_a', '1', {'x': 1.0, 'timestamp': 10.0, 'snapshot': True})
+
+    assert subscription.get(timeout=0.0) == {}
+
+    subscription.on_device_update('port_a', '1', {'x': 2.0, 'timestamp': 11.0})
+    assert subscription.get(timeout=0.0) == {'dev_a': {'x': 2.0, 'timestamp': 11.0}}
+
+
+def test_frame_is_put_in_at_once():
+    subscription = make_subscription()
+    a = {'x': 1.0, 'timestamp': 10.0, 'snapshot': True}
+    b = {'y': 2.0, 'timestamp': 10.0, 'snapshot': True}
+
+    subscription.on_frame([('port_a', '1', a), ('port_b', '2', b), ('port_c', '3', {'timestamp': 10.0})])
+
+    assert subscription.get(timeout=0.0) == {'dev_a': a, 'dev_b': b}
+
+
+def test_frame_values_are_not_sent_twice():
+    subscription = make_subscription()
+    a = {'x': 1.0, 'timestamp': 10.0, 'snapshot': True}
+
+    subscription.on_frame([('port_a', '1', a)])
+    subscription.get(timeout=0.0)
+
+    subscription.on_frame([('port_a', '1', a)])
+    assert subscription.get(timeout=0.0) == {}
+
+
+class FakeManager(object):
+
+    def __init__(self, current_values):
+        self.current_values = current_values
+
+
+def test_publish_snapshot_only_sends_values_of_the_tick(monkeypatch):
+    a = {'x': 1.0, 'timestamp': 10.0, 'snapshot': True}
+    b = {'y': 2.0, 'timestamp': 9.0, 'snapshot': True}  # didn't answer in this tick
+
+    monkeypatch.setattr(Server, '_devices', {'port_a': FakeManager({'1': a}), 'port_b': FakeManager({'2': b})})
+    subscription = make_subscription()
+    monkeypatch.setattr(Server, '_snapshot_subscriptions', [subscription])
+
+    Server.publish_snapshot('g', ['port_a', 'port_b', 'port_gone'], 10.0)
+
+    assert subscription.get(timeout=0.0) == {'dev_a': a}
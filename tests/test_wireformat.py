@@ -0,0 +1,74 @@
+import json
+import math
+import struct
+
+import pytest
+
+from pycontrolsystem.WireFormat import encode_schema, encode_data, encode_error, encode_keepalive, \
+    FrameDecoder, NonNumericValue, WIRE_VERSION, FRAME_SCHEMA
+
+
+def test_round_trip():
+    stream = encode_schema(['dev1', 'dev2_3'], [['ch1', 'ch2'], ['x']]) + \
+        encode_data(0, 1234.5, 10.0, [1, 0], [2.5, 3], t_start=1234.25, t_end=1234.5) + \
+        encode_keepalive() + \
+        encode_error(1, "ERROR: Device not found on server")
+
+    decoder = FrameDecoder()
+    frames = decoder.feed(stream)
+
+    assert frames[0] == ('schema', {'version': WIRE_VERSION, 'devices': ['dev1', 'dev2_3'],
+                                    'channels': [['ch1', 'ch2'], ['x']]})
+    assert decoder.schema['devices'] == ['dev1', 'dev2_3']
+
+    kind, device_index, timestamp, polling_rate, channels, values, t_start, t_end = frames[1]
+    assert (kind, device_index, timestamp, polling_rate) == ('data', 0, 1234.5, 10.0)
+    assert (t_start, t_end) == (1234.25, 1234.5)
+    assert channels.tolist() == [1, 0]
+    assert values.tolist() == [2.5, 3.0]
+
+    assert frames[2] == ('error', 1, "ERROR: Device not found on server")
+    assert len(frames) == 3
+
+
+def test_frames_split_across_reads():
+    stream = encode_data(2, 1.0, 0.0, [0], [True]) + encode_error(0, "TIMEOUT")
+    decoder = FrameDecoder()
+
+    frames = []
+    for i in range(len(stream)):
+        frames += decoder.feed(stream[i:i + 1])
+
+    assert [frame[0] for frame in frames] == ['data', 'error']
+    assert frames[0][5].tolist() == [1.0]
+    assert frames[1] == ('error', 0, "TIMEOUT")
+
+
+def test_empty_data_frame():
+    frames = FrameDecoder().feed(encode_data(0, 5.0, 1.0, [], []))
+
+    assert frames[0][4].tolist() == [] and frames[0][5].tolist() == []
+    # no query times given
+    assert math.isnan(frames[0][6]) and math.isnan(frames[0][7])
+
+
+def test_numeric_strings_are_converted():
+    frames = FrameDecoder().feed(encode_data(0, 5.0, 1.0, [0], ['12.5']))
+
+    assert frames[0][5].tolist() == [12.5]
+
+
+def test_non_numeric_value_raises():
+    with pytest.raises(NonNumericValue) as error:
+        encode_data(0, 5.0, 1.0, [0, 3], [1.0, "Error: Invalid gas"])
+
+    assert error.value.value == "Error: Invalid gas"
+    assert error.value.channel_index == 3
+
+
+def test_unsupported_version():
+    payload = json.dumps({'version': WIRE_VERSION + 1, 'devices': [], 'channels': []}).encode()
+    stream = struct.pack('<BI', FRAME_SCHEMA, len(payload)) + payload
+
+    with pytest.raises(ValueError, match='Unsupported wire format version'):
+        FrameDecoder().feed(stream)